@@ -0,0 +1,183 @@
+# adaptive.py — адаптивная (AIMD) конкурентность для вызовов Telethon
+#
+# Вместо фиксированного семафора: лимит растёт на ~1 за «окно» успешных
+# запросов и делится пополам на FloodWait (с паузой на e.seconds).
+# Временные ошибки (5xx, таймауты, обрывы соединения) повторяются
+# с экспоненциальной задержкой, пока не истёк дедлайн вызова.
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from telethon.errors import FloodWaitError, ServerError, TimedOutError
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = (
+    ServerError,
+    TimedOutError,
+    ConnectionError,
+    asyncio.TimeoutError,
+    OSError,
+)
+
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 8.0
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial: int = 6,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        decrease: float = 0.5,
+        default_timeout: float = 30.0,
+    ):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.default_timeout = default_timeout
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.floods = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    # ---------- статистика ----------
+    @property
+    def load(self) -> float:
+        """Доля занятого лимита (для выбора наименее загруженного клиента)."""
+        return self.in_flight / max(1.0, self.limit)
+
+    def is_paused(self) -> bool:
+        return self.paused_until > time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "paused_for": max(0.0, round(self.paused_until - time.monotonic(), 1)),
+            "floods": self.floods,
+        }
+
+    # ---------- AIMD ----------
+    def on_success(self):
+        self.limit = min(float(self.max_limit), self.limit + 1.0 / max(1.0, self.limit))
+
+    def on_flood(self, seconds: float):
+        now = time.monotonic()
+        self.floods += 1
+        self.paused_until = max(self.paused_until, now + seconds)
+        asyncio.get_running_loop().call_later(seconds, self._wake)
+        # несколько одновременных FloodWait — это одно событие, режем лимит один раз
+        if now - self._last_decrease > 1.0:
+            self.limit = max(float(self.min_limit), self.limit * self.decrease)
+            self._last_decrease = now
+        logger.warning(f"[{self.name}] FloodWait {seconds}s, limit -> {self.limit:.1f}")
+
+    # ---------- слоты ----------
+    def _wake(self):
+        if self.is_paused():
+            return
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(True)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    async def acquire(self, deadline: Optional[float] = None):
+        pause = self.paused_until - time.monotonic()
+        if pause > 0 and deadline is not None and time.monotonic() + pause > deadline:
+            raise asyncio.TimeoutError(f"{self.name}: paused past deadline")
+        if not self._waiters and not self.is_paused() and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except BaseException:
+            # слот мог быть выдан одновременно с отменой/таймаутом — вернём его
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                fut.cancel()
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+            raise
+
+    async def run(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+        retry_flood: bool = True,
+    ) -> Any:
+        """
+        Выполнить factory() в слоте лимитера с повторами до дедлайна.
+        FloodWait длиннее оставшегося времени пробрасывается наружу;
+        с retry_flood=False — сразу (вызывающий сам уйдёт на другой клиент).
+        """
+        deadline = time.monotonic() + (timeout or self.default_timeout)
+        attempt = 0
+        while True:
+            await self.acquire(deadline)
+            try:
+                result = await factory()
+            except FloodWaitError as e:
+                self.release()
+                self.on_flood(e.seconds)
+                if not retry_flood or time.monotonic() + e.seconds > deadline:
+                    raise
+                continue
+            except TRANSIENT_ERRORS as e:
+                self.release()
+                attempt += 1
+                delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if time.monotonic() + delay > deadline:
+                    raise
+                logger.warning(f"[{self.name}] transient error {e!r}, retry #{attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.release()
+                raise
+            self.release()
+            self.on_success()
+            return result
+
+
+class LimiterGroup:
+    """
+    Отдельный AdaptiveLimiter на ключ (например, на DC, где лежат файлы):
+    FloodWait одного DC не тормозит загрузки из других.
+    """
+
+    def __init__(self, name: str, **limiter_kwargs):
+        self.name = name
+        self._kwargs = limiter_kwargs
+        self._limiters: Dict[Hashable, AdaptiveLimiter] = {}
+
+    def get(self, key: Hashable) -> AdaptiveLimiter:
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveLimiter(f"{self.name}:{key}", **self._kwargs)
+            self._limiters[key] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {str(k): v.stats() for k, v in self._limiters.items()}
@@ -0,0 +1,141 @@
+# bench_collage.py — замеры сборки коллажа и матрица настроек JPEG-энкодера
+#
+# python src/bench_collage.py photo1.jpg photo2.jpg photo3.jpg [--runs 20] [--csv out.csv]
+#
+# Без файлов генерирует синтетические фото 1600x1200. Печатает:
+#   1) декод+ресайз: старый путь (полный декод, LANCZOS целиком, crop)
+#      против нового (draft + box + reducing_gap);
+#   2) для каждой комбинации quality/optimize/progressive/subsampling —
+#      время кодирования, размер и PSNR относительно несжатого коллажа.
+
+import argparse
+import csv
+import itertools
+import math
+import os
+import sys
+import time
+from io import BytesIO
+from typing import Callable, List
+
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from collage import collage_tiles, compose_collage, encode_jpeg  # noqa: E402
+
+WIDTH, HEIGHT = 1280, 720
+
+QUALITIES = (75, 80, 85, 90)
+OPTIMIZE = (False, True)
+PROGRESSIVE = (False, True)
+SUBSAMPLING = (0, 1, 2)
+_SUBSAMPLING_NAMES = {0: "4:4:4", 1: "4:2:2", 2: "4:2:0"}
+
+
+def synthetic_photos(count: int = 3) -> List[bytes]:
+    photos = []
+    for i in range(count):
+        img = Image.effect_mandelbrot((1600, 1200), (-2.0 + i * 0.3, -1.2, 1.0, 1.2), 100 + i * 50)
+        img = Image.merge("RGB", (img, img.rotate(90, expand=False), ImageChops.invert(img)))
+        out = BytesIO()
+        img.save(out, format="JPEG", quality=92)
+        photos.append(out.getvalue())
+    return photos
+
+
+def legacy_compose(images_bytes: List[bytes], width: int, height: int) -> Image.Image:
+    """Прежний путь: полный декод и LANCZOS всего кадра, потом crop."""
+    n = min(3, len(images_bytes))
+    collage = Image.new("RGB", (width, height))
+    for data, (x, y, tw, th) in zip(images_bytes[:n], collage_tiles(n, width, height)):
+        img = Image.open(BytesIO(data)).convert("RGB")
+        w, h = img.size
+        scale = max(tw / w, th / h)
+        nw, nh = int(w * scale), int(h * scale)
+        img2 = img.resize((nw, nh), Image.LANCZOS)
+        left, top = (nw - tw) // 2, (nh - th) // 2
+        collage.paste(img2.crop((left, top, left + tw, top + th)), (x, y))
+    return collage
+
+
+def timeit(fn: Callable[[], object], runs: int) -> float:
+    fn()  # прогрев
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs * 1000.0
+
+
+def psnr(reference: Image.Image, data: bytes) -> float:
+    decoded = Image.open(BytesIO(data)).convert("RGB")
+    diff = ImageChops.difference(reference, decoded)
+    mse = sum(v * v for v in ImageStat.Stat(diff).rms) / 3.0
+    return float("inf") if mse == 0 else 20 * math.log10(255.0 / math.sqrt(mse))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collage decode/resize and JPEG encoder benchmark")
+    parser.add_argument("photos", nargs="*")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--csv", help="записать матрицу энкодера в CSV")
+    args = parser.parse_args()
+
+    if args.photos:
+        photos = []
+        for path in args.photos[:3]:
+            with open(path, "rb") as f:
+                photos.append(f.read())
+    else:
+        photos = synthetic_photos()
+
+    print(f"{len(photos)} photo(s), collage {WIDTH}x{HEIGHT}, {args.runs} runs\n")
+
+    legacy_ms = timeit(lambda: legacy_compose(photos, WIDTH, HEIGHT), args.runs)
+    fast_ms = timeit(lambda: compose_collage(photos, WIDTH, HEIGHT), args.runs)
+    print("decode + resize:")
+    print(f"  legacy (full decode, LANCZOS, crop): {legacy_ms:8.1f} ms")
+    print(f"  draft + box + reducing_gap:          {fast_ms:8.1f} ms  (x{legacy_ms / fast_ms:.2f})\n")
+
+    reference = compose_collage(photos, WIDTH, HEIGHT)
+    rows = []
+    for quality, optimize, progressive, subsampling in itertools.product(
+        QUALITIES, OPTIMIZE, PROGRESSIVE, SUBSAMPLING
+    ):
+        encoder = {
+            "quality": quality,
+            "optimize": optimize,
+            "progressive": progressive,
+            "subsampling": subsampling,
+        }
+        data = encode_jpeg(reference, encoder)
+        rows.append({
+            "quality": quality,
+            "optimize": optimize,
+            "progressive": progressive,
+            "subsampling": _SUBSAMPLING_NAMES[subsampling],
+            "encode_ms": round(timeit(lambda: encode_jpeg(reference, encoder), args.runs), 2),
+            "size_kb": round(len(data) / 1024, 1),
+            "psnr_db": round(psnr(reference, data), 2),
+        })
+
+    rows.sort(key=lambda r: (r["encode_ms"], r["size_kb"]))
+    header = f"{'q':>3} {'opt':>5} {'prog':>5} {'subs':>6} {'enc ms':>8} {'KB':>7} {'PSNR':>6}"
+    print("encoder matrix (fastest first):")
+    print(header)
+    for r in rows:
+        print(
+            f"{r['quality']:>3} {str(r['optimize']):>5} {str(r['progressive']):>5} "
+            f"{r['subsampling']:>6} {r['encode_ms']:>8} {r['size_kb']:>7} {r['psnr_db']:>6}"
+        )
+
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\nCSV: {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
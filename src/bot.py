@@ -2,44 +2,68 @@
 #
 # Требуемые пакеты:
 # pip install aiogram telethon pillow google-auth google-auth-oauthlib google-api-python-client
+#
+# Pillow и Google-библиотеки импортируются при первом использовании,
+# Bot / Telethon-клиенты / кэши создаются в run_bot() — старт быстрее.
+
+import time
+
+STARTUP_T0 = time.perf_counter()   # до тяжёлых импортов — для отчёта о времени старта
 
 import logging
 import asyncio
 import re
 import os
 import json
+import socket
 import calendar
+import threading
+import zlib
+import heapq
+import itertools
+import tracemalloc
 from io import BytesIO
-from typing import List, Tuple, Optional, Dict, Any
+from types import SimpleNamespace
+from typing import List, Tuple, Optional, Dict, Any, MutableMapping, Callable, Iterator, AsyncIterator, Union
 from datetime import datetime
 
-from PIL import Image
-
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     ReplyKeyboardMarkup,
     KeyboardButton,
     BufferedInputFile,
+    InputMediaPhoto,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent,
 )
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram import Router
 
-from telethon import TelegramClient
+from telethon import events
+from telethon.errors import FloodWaitError
 from telethon.tl.types import MessageEntityTextUrl, MessageEntityUrl
 
-# Google Drive libs
-try:
-    from google.auth.transport.requests import Request
-    from google.oauth2.credentials import Credentials
-    from google_auth_oauthlib.flow import InstalledAppFlow  # не используем, но пусть лежит
-    from googleapiclient.discovery import build
-    from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-    _HAS_GOOGLE = True
-except Exception:
-    _HAS_GOOGLE = False
+from collage_pack import CollageInputFile, CollagePack
+from columnar import OfferColumns, parse_find_query
+from export import OfferCsvFile
+from inline_query import InlineQuery, QueryMemo, parse_inline_query, unique_inline_results
+from offers import Offer
+from outbound import OutboundScheduler, RateLimitMiddleware, background_priority
+from profiling import LoopStallMonitor, StackSampler, memory_report
+from recording import TrafficRecorder, decode_entities, encode_entities
+from shared_state import make_backend
+from snapshot import load_snapshot, write_snapshot
+from subscriptions import Subscription, SubscriptionIndex
+from telethon_pool import TelethonPool
+from tracing import TraceIdLogFilter, Tracer, client_span, span
+
+IMPORTS_DONE_AT = time.perf_counter()
 
 # ===================== CONFIG =====================
 
@@ -47,13 +71,90 @@ API_TOKEN = os.environ.get('API_TOKEN')
 TELEGRAM_API_ID = os.environ.get('TELEGRAM_API_ID')
 TELEGRAM_API_HASH = os.environ.get('TELEGRAM_API_HASH')
 
-CHANNEL_OFFICES = '@KyivOfficeRent'
-CHANNEL_WAREHOUSES = '@KievSKLAD123'
+# Пользовательские сессии Telethon через запятую (файлы <имя>.session рядом с ботом).
+# bot.session сюда не подходит: ботам недоступна история каналов (messages.getHistory).
+TELETHON_SESSIONS = [s.strip() for s in os.environ.get('TELETHON_SESSIONS', 'user_session').split(',') if s.strip()]
+
+# каналы по умолчанию; дополнительные — через CHANNELS
+DEFAULT_CHANNELS = '@KyivOfficeRent:office,@KievSKLAD123:warehouse'
+
+
+def _parse_channels(spec: str) -> Dict[str, str]:
+    """'@chan:profile,@chan2:profile' -> {'@chan': 'profile', ...} в порядке приоритета."""
+    channels: Dict[str, str] = {}
+    for item in spec.split(','):
+        name, _, profile = item.strip().partition(':')
+        if name:
+            channels[name.strip()] = profile.strip() or 'office'
+    return channels
+
+
+# канал -> профиль парсера (см. PARSER_PROFILES); при дублях оффер берётся из канала выше
+CHANNELS = _parse_channels(
+    os.environ.get('CHANNELS', DEFAULT_CHANNELS)
+)
 
 PAGE_SIZE = 5
-MAX_PARALLEL_DOWNLOADS = 6
+# 'edit' — «Далі»/«Назад» правят карточки и навигацию на месте, 'send' — новая страница сообщениями
+PAGINATION_MODE = os.environ.get('PAGINATION_MODE', 'edit')
+# сколько страница ждёт коллажи; не успевшие карточки уходят текстом и получают фото позже
+CARD_MEDIA_DEADLINE = float(os.environ.get('CARD_MEDIA_DEADLINE', '1.5'))   # сек
+SEARCH_RESULT_LIMIT = 100       # top-k самых дешёвых офферов на поиск (20 страниц)
+HISTORY_STREAM_BUFFER = 200     # сообщений между чтением канала и разбором на холодном пути
+INLINE_PAGE_SIZE = 20           # результатов на один ответ inline (лимит Telegram — 50)
+INLINE_CACHE_TIME = 60          # кэш ответа на стороне Telegram и TTL мемо запросов, сек
+MAX_PARALLEL_DOWNLOADS = 6      # стартовый лимит, дальше подстраивается (AIMD)
+TELETHON_MIN_CONCURRENCY = 1
+TELETHON_MAX_CONCURRENCY = 24
+TELETHON_CALL_TIMEOUT = 60      # дедлайн на history/metadata-запрос с повторами, сек
 COLLAGE_W, COLLAGE_H = 1280, 720
 JPEG_QUALITY = 85
+# профиль энкодера: без optimize (лишний проход Хаффмана); сравнение профилей — src/bench_collage.py
+JPEG_ENCODER = {
+    "quality": JPEG_QUALITY,
+    "optimize": False,
+    "progressive": False,
+    "subsampling": 2,   # 4:2:0
+}
+# Варианты коллажа: (ширина, высота, энкодер). Карточки списка Telegram показывает
+# маленькими — им хватает превью; полный размер — по кнопке на карточке. У каждого
+# варианта свои байты в L1/pack, свой file_id и свой объект в Drive. Полный вариант
+# хранится под прежним slug'ом — уже загруженные коллажи остаются валидными.
+COLLAGE_VARIANTS: Dict[str, Tuple[int, int, Dict[str, Any]]] = {
+    "preview": (640, 360, {**JPEG_ENCODER, "quality": 75}),
+    "full": (COLLAGE_W, COLLAGE_H, JPEG_ENCODER),
+}
+CARD_COLLAGE_VARIANT = "preview"
+
+# Лимиты Bot API: ~30 сообщений/с на бота, ~1/с в один чат (короткие всплески допустимы)
+BOT_API_GLOBAL_RATE = 30.0
+BOT_API_CHAT_RATE = 1.0
+BOT_API_CHAT_BURST = 8.0
+BOT_API_GROUP_RATE = 20.0 / 60.0
+OUTBOUND_QUEUE_WARN = 50
+
+# Админ-команда /profile [сек] и детектор зависаний event loop
+ADMIN_IDS = {int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x.strip()}
+LOOP_STALL_THRESHOLD = float(os.environ.get('LOOP_STALL_THRESHOLD', '0.25'))   # сек
+PROFILE_MAX_SECONDS = 60
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Подписки на сохранённые поиски
+MAX_SUBSCRIPTIONS_PER_USER = 5
+PUSH_CONCURRENCY = 8            # одновременных пушей (дальше всё равно решает OutboundScheduler)
+SUBSCRIPTION_PUSH_TTL = 7 * 24 * 3600   # сек, сколько помним отправленные пуши (дедупликация)
+PUSH_CARDS_KEEP = 20            # пуш-карточек чата с рабочим калькулятором; старые вытесняются из calc_store
+
+# Трассировка апдейтов: JSONL в формате OTLP/JSON; по умолчанию выключена,
+# включается путём в TRACE_FILE (вне каталога с кодом, например /var/log/bot/traces.jsonl)
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', str(50 * 1024 * 1024)))   # дальше — ротация в .1
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+TRACE_SLOW_SECONDS = float(os.environ.get('TRACE_SLOW_SECONDS', '3'))   # медленные трассы пишутся всегда
+
+# Запись трафика для replay.py (по умолчанию выключена)
+RECORD_FILE = os.environ.get('RECORD_FILE')             # например, src/recording.jsonl.gz
+RECORD_SALT = os.environ.get('RECORD_SALT')             # одна соль на воркеры — одни псевдонимы
 
 # ====== Google Drive (OAuth 2.0, refresh_token) ======
 SCOPES = ["https://www.googleapis.com/auth/drive"]
@@ -67,11 +168,46 @@ DRIVE_FOLDER_ID = os.environ.get('DRIVE_FOLDER_ID')
 BASE_DIR = os.path.dirname(__file__)
 TEMP_FOLDER = os.path.join(BASE_DIR, "temp_collages")
 os.makedirs(TEMP_FOLDER, exist_ok=True)
+# коллажи воркера — один pack-файл в TEMP_FOLDER (collage_pack.py); compact — из snapshot_loop,
+# когда мёртвых байт (перезаписи + слаги без офферов) хотя бы MIN_DEAD и не меньше RATIO файла
+COLLAGE_PACK_MIN_DEAD = 32 * 1024 * 1024
+COLLAGE_PACK_DEAD_RATIO = 0.3
 
 USE_DRIVE = True  # включён Drive
 
 CACHE_FILE = os.path.join(BASE_DIR, 'collage_url_cache_local.json')
 
+# Снапшот индекса (офферы, альбомы, file_id коллажей, метаданные кэшей) для холодного старта
+SNAPSHOT_FILE = os.path.join(BASE_DIR, 'index_snapshot.bin')
+SNAPSHOT_INTERVAL = 300         # сек
+
+# ====== Несколько воркеров (общий state + шардирование апдейтов по user_id) ======
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory')   # или sqlite:////shared/state.db
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', '1'))
+
+
+def _worker_index() -> int:
+    if os.environ.get('WORKER_INDEX'):
+        return int(os.environ['WORKER_INDEX'])
+    # Heroku: DYNO=worker.3 -> 2
+    dyno = os.environ.get('DYNO', '')
+    if '.' in dyno:
+        try:
+            return int(dyno.rsplit('.', 1)[1]) - 1
+        except ValueError:
+            pass
+    return 0
+
+
+WORKER_INDEX = _worker_index()
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL = 30                  # сек, lease лидера поллинга
+CHANNEL_SYNC_INTERVAL = 120     # сек, как часто лидер перечитывает каналы
+CHANNEL_FULL_SYNC_EVERY = 10    # каждый N-й круг синхронизации читает каналы целиком (правки, удаления)
+CHANNEL_HISTORY_TTL = 300       # сек, сколько история канала считается свежей
+BACKFILL_RANGE_SIZE = 2000      # id сообщений в одном диапазоне полного чтения канала
+BACKFILL_WORKERS = 8            # диапазонов в работе одновременно (дальше решают AIMD-лимитеры)
+
 CLIENT_SECRET_FILE = os.path.join(BASE_DIR, "client_secret.json")
 TOKEN_FILE = os.path.join(BASE_DIR, "token.json")
 
@@ -79,35 +215,166 @@ TOKEN_FILE = os.path.join(BASE_DIR, "token.json")
 
 logging.basicConfig(
     level=logging.WARNING,   # в проде показываем только warning/error
-    format="%(asctime)s - %(levelname)s - %(message)s"
+    format="%(asctime)s - %(levelname)s - %(message)s%(trace)s"
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(TraceIdLogFilter())
 logger = logging.getLogger(__name__)
 
-# Aiogram
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+
+# ----------------- Startup timing -----------------
+class StartupTimer:
+    """
+    Отметки времени от запуска процесса: импорты, загрузка сессий/кэшей,
+    старт поллинга, первый обработанный апдейт.
+    """
+
+    def __init__(self, t0: float):
+        self.t0 = t0
+        self.marks: Dict[str, float] = {}
+        self.reported = False
+
+    def mark(self, name: str, at: Optional[float] = None):
+        if name not in self.marks:
+            self.marks[name] = (at if at is not None else time.perf_counter()) - self.t0
+
+    def report(self) -> str:
+        return " ".join(f"{name}={sec:.2f}s" for name, sec in self.marks.items())
+
+
+startup_timer = StartupTimer(STARTUP_T0)
+startup_timer.mark("imports", IMPORTS_DONE_AT)
+
+# Aiogram: Dispatcher/Router нужны декораторам хэндлеров, Bot создаётся в create_bot()
+bot: Optional[Bot] = None
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
-# Telethon
-telethon_client = TelegramClient('user_session', TELEGRAM_API_ID, TELEGRAM_API_HASH)
-telethon_semaphore = asyncio.Semaphore(MAX_PARALLEL_DOWNLOADS)
+stall_monitor = LoopStallMonitor(LOOP_STALL_THRESHOLD)
+tracer = Tracer(TRACE_FILE, "kyiv-office-rent-bot", TRACE_SAMPLE_RATE, TRACE_SLOW_SECONDS, TRACE_MAX_BYTES)
+traffic_recorder: Optional[TrafficRecorder] = None
+
+outbound = OutboundScheduler(
+    global_rate=BOT_API_GLOBAL_RATE,
+    chat_rate=BOT_API_CHAT_RATE,
+    chat_burst=BOT_API_CHAT_BURST,
+    group_rate=BOT_API_GROUP_RATE,
+)
+
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """Span на каждый вызов Bot API, включая ожидание в OutboundScheduler."""
+
+    async def __call__(self, make_request, bot, method):
+        attributes = {}
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            attributes["chat_id"] = chat_id
+        with client_span(f"bot_api.{method.__api_method__}", **attributes):
+            return await make_request(bot, method)
+
+
+def create_bot() -> Bot:
+    global bot
+    if bot is None:
+        bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+        # первым — внешний: span трассировки включает ожидание лимитера
+        bot.session.middleware(BotApiTracingMiddleware())
+        bot.session.middleware(RateLimitMiddleware(outbound, queue_warn=OUTBOUND_QUEUE_WARN))
+    return bot
+
+
+# Telethon: пул сессий, у каждой свои AIMD-лимитеры (history + media по DC)
+telethon_pool: Optional[TelethonPool] = None
+_telethon_started: Optional[asyncio.Task] = None
+
+
+def create_telethon_pool() -> TelethonPool:
+    global telethon_pool
+    if telethon_pool is None:
+        telethon_pool = TelethonPool.from_sessions(
+            TELETHON_SESSIONS,
+            TELEGRAM_API_ID,
+            TELEGRAM_API_HASH,
+            initial=MAX_PARALLEL_DOWNLOADS,
+            min_limit=TELETHON_MIN_CONCURRENCY,
+            max_limit=TELETHON_MAX_CONCURRENCY,
+            default_timeout=TELETHON_CALL_TIMEOUT,
+        )
+    return telethon_pool
 
 # State / caches
-user_sessions: Dict[int, Dict[str, Any]] = {}
-collage_bytes_cache: Dict[int, bytes] = {}
-if os.path.exists(CACHE_FILE):
+# user_sessions, calc_store, collage_url_cache и история каналов живут в общем backend'е;
+# collage_bytes_cache — локальный L1-кэш воркера: memoryview из pack-файла (или bytes,
+# если запись в pack не удалась); восстанавливается из pack/Drive
+state_backend = make_backend(STATE_BACKEND)
+user_sessions: MutableMapping[int, Dict[str, Any]] = state_backend.mapping("user_sessions")
+collage_bytes_cache: Dict[Tuple[str, int, str], Union[bytes, memoryview]] = {}
+collage_url_cache: MutableMapping[str, str] = state_backend.mapping("collage_url_cache")
+calc_store: MutableMapping[Tuple[int, int], Dict[str, Any]] = state_backend.mapping("calc_store")
+# (канал, msg_id) -> (текст, entities плоскими списками): по ключу на сообщение,
+# чтобы синхронизация писала в общее состояние только новые и изменённые сообщения
+channel_messages: MutableMapping[Tuple[str, int], Tuple[str, List[List[Any]]]] = state_backend.mapping("channel_messages")
+# канал -> время последнего чтения истории (версия истории для индексов воркеров)
+channel_history_ts: MutableMapping[str, float] = state_backend.mapping("channel_history_ts")
+# slug коллажа -> Telegram file_id: повторная отправка без загрузки байтов
+collage_file_ids: MutableMapping[str, str] = state_backend.mapping("collage_file_ids")
+# chat_id -> {'cards': [(message_id, has_photo)], 'nav_id': message_id, 'shown': сколько карточек заполнено}
+# — последняя показанная страница
+page_views: MutableMapping[int, Dict[str, Any]] = state_backend.mapping("page_views")
+# chat_id -> message_id последних пуш-карточек (старые первыми) — их записи в calc_store
+push_cards: MutableMapping[int, List[int]] = state_backend.mapping("push_cards")
+# канал -> максимальный прочитанный id сообщения (инкрементальная синхронизация)
+channel_cursors: MutableMapping[str, int] = state_backend.mapping("channel_cursors")
+# user_id -> {'chat_id': ..., 'items': [Subscription]} — сохранённые поиски
+subscriptions: MutableMapping[int, Dict[str, Any]] = state_backend.mapping("subscriptions")
+# 'version' меняется при каждой правке подписок любым воркером
+subscription_meta: MutableMapping[str, int] = state_backend.mapping("subscription_meta")
+# (user_id, канал, msg_id) -> (версия поста, время) — уже отправленные пуши
+subscription_pushes: MutableMapping[Tuple[int, str, int], Tuple[int, float]] = state_backend.mapping("subscription_pushes")
+# канал -> {'top': id, 'done': {(lo, hi): сообщений}} — прогресс полного чтения канала
+backfill_progress: MutableMapping[str, Dict[str, Any]] = state_backend.mapping("backfill_progress")
+# (канал, lo, hi) -> история диапазона; собирается в channel_messages после последнего диапазона
+backfill_chunks: MutableMapping[Tuple[str, int, int], List[Tuple[str, int, Any]]] = state_backend.mapping("backfill_chunks")
+# тип оффера -> (версии индексов каналов, объединённые офферы без дублей)
+type_index: Dict[str, Tuple[Tuple, List[Offer]]] = {}
+# канал -> (время чтения истории, разобранные офферы без фильтров)
+offer_index: Dict[str, Tuple[float, List[Offer]]] = {}
+
+def load_url_cache():
+    if collage_url_cache or not os.path.exists(CACHE_FILE):
+        return
     try:
         with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-            collage_url_cache: Dict[str, str] = json.load(f)
+            collage_url_cache.update(json.load(f))
     except Exception:
-        collage_url_cache = {}
-else:
-    collage_url_cache = {}
-calc_store: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        pass
 
 # ----------------- Google Drive (через refresh_token) -----------------
 _drive_service = None
+_drive_lock = threading.Lock()
+_google = None
+
+
+def _google_libs() -> SimpleNamespace:
+    """
+    Google API client тянет discovery, httplib2 и пр. — грузим при первом обращении к Drive.
+    """
+    global _google
+    if _google is None:
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from googleapiclient.discovery import build
+        from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+        _google = SimpleNamespace(
+            Request=Request,
+            Credentials=Credentials,
+            build=build,
+            MediaIoBaseUpload=MediaIoBaseUpload,
+            MediaIoBaseDownload=MediaIoBaseDownload,
+        )
+    return _google
 
 
 def init_drive_service():
@@ -119,13 +386,22 @@ def init_drive_service():
     if not USE_DRIVE:
         raise RuntimeError("Google Drive disabled (USE_DRIVE=False)")
 
-    if not _HAS_GOOGLE:
-        raise RuntimeError("Google packages not installed")
-
     if _drive_service is not None:
         return _drive_service
 
-    creds = Credentials(
+    with _drive_lock:
+        if _drive_service is None:
+            _drive_service = _build_drive_service()
+    return _drive_service
+
+
+def _build_drive_service():
+    try:
+        g = _google_libs()
+    except ImportError:
+        raise RuntimeError("Google packages not installed")
+
+    creds = g.Credentials(
         token=None,
         refresh_token=GOOGLE_REFRESH_TOKEN,
         token_uri="https://oauth2.googleapis.com/token",
@@ -135,13 +411,20 @@ def init_drive_service():
     )
 
     try:
-        creds.refresh(Request())
+        creds.refresh(g.Request())
     except Exception as e:
         logger.exception("Помилка при оновленні Google токена (refresh_token)")
         raise e
 
-    _drive_service = build("drive", "v3", credentials=creds, cache_discovery=False)
-    return _drive_service
+    return g.build("drive", "v3", credentials=creds, cache_discovery=False)
+
+
+def warm_up_drive():
+    try:
+        init_drive_service()
+        startup_timer.mark("drive_ready")
+    except Exception:
+        logger.exception("Google Drive init failed")
 
 
 # def upload_collage_to_drive(collage_bytes: bytes, filename: str, folder_id: str) -> Optional[str]:
@@ -219,7 +502,7 @@ def upload_collage_to_drive(collage_bytes: bytes, filename: str, folder_id: str)
             file_id = files[0]["id"]
         else:
             # Upload new file (resumable)
-            media = MediaIoBaseUpload(
+            media = _google_libs().MediaIoBaseUpload(
                 BytesIO(collage_bytes),
                 mimetype="image/jpeg",
                 resumable=True,
@@ -275,7 +558,7 @@ def download_collage_from_drive(file_id: str) -> Optional[bytes]:
         service = init_drive_service()
         request = service.files().get_media(fileId=file_id)
         fh = BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
+        downloader = _google_libs().MediaIoBaseDownload(fh, request)
         done = False
         while not done:
             status, done = downloader.next_chunk()
@@ -322,117 +605,121 @@ OFFER_LINE_RE = re.compile(
 )
 
 # ----------------- Photo download helpers -----------------
+async def start_telethon():
+    for pc in telethon_pool.clients:
+        await pc.client.start()
+
+        # Run Telethon in background
+        asyncio.create_task(pc.client.run_until_disconnected())
+    # новые и отредактированные посты — для подписок (одной сессии достаточно)
+    register_channel_events(telethon_pool.primary.client)
+    startup_timer.mark("telethon_ready")
+
+
 async def ensure_connected():
-    if not telethon_client.is_connected():
-        try:
-            await telethon_client.connect()
-        except Exception:
-            await telethon_client.start()
-    # если не авторизован – просто предупредим в логах
-    try:
-        if not await telethon_client.is_user_authorized():
-            logger.warning("Telethon client is not authorized!")
-    except Exception:
-        pass
+    # Telethon стартует в фоне параллельно с поллингом — дождёмся его
+    if _telethon_started is not None and not _telethon_started.done():
+        await asyncio.wait([_telethon_started])
+    await telethon_pool.ensure_connected()
+
+
+def _photo_thumb(photo, side: Optional[int]) -> Optional[str]:
+    """
+    Тип наименьшего размера фото, у которого большая сторона не меньше side
+    (None — качать самый большой, как раньше).
+    """
+    if not side:
+        return None
+    fitting = [
+        (max(size.w, size.h), size.type)
+        for size in getattr(photo, "sizes", None) or []
+        if getattr(size, "w", None) and getattr(size, "h", None) and max(size.w, size.h) >= side
+    ]
+    return min(fitting)[1] if fitting else None
 
 
-async def _download_small_photo_bytes(msg) -> Optional[bytes]:
-    if not getattr(msg, "photo", None):
+async def _download_small_photo_bytes(pc, msg, photo_side: Optional[int] = None) -> Optional[bytes]:
+    photo = getattr(msg, "photo", None)
+    if not photo:
         return None
+    thumb = _photo_thumb(photo, photo_side)
+    kwargs = {"thumb": thumb} if thumb else {}
+    # Telethon сам ходит в DC файла; лимитер на DC держит параллельность там
+    dc_id = getattr(photo, "dc_id", 0)
+    limiter = pc.media.get(dc_id)
     try:
-        data = await telethon_client.download_media(msg, file=bytes)
+        with client_span("telethon.download", session=pc.name, dc=dc_id, msg_id=msg.id) as sp:
+            data = await limiter.run(lambda: pc.client.download_media(msg, file=bytes, **kwargs), retry_flood=False)
+            sp.set("bytes", len(data) if data else 0)
         if data:
             return bytes(data)
+    except FloodWaitError:
+        # пусть пул переключится на другую сессию
+        raise
     except Exception as e:
         logger.warning(f"Download media failed: {e}")
     return None
 
 
-async def fetch_first_3_small_photos_for_channel(channel_username: str, msg_id: int) -> List[bytes]:
-    await ensure_connected()
-    try:
-        channel = await telethon_client.get_entity(channel_username)
-        message = await telethon_client.get_messages(channel, ids=msg_id)
+async def _fetch_first_3_small_photos(pc, channel_username: str, msg_id: int,
+                                      photo_side: Optional[int] = None) -> List[bytes]:
+    """
+    Метаданные альбома берутся через общий батчер пула: коллажи одной страницы
+    (или пачки префетча) получают сообщения одним get_messages на канал.
+    Если альбом ещё не в индексе — сразу окно ±20 id (без отдельного запроса
+    самого сообщения), окна соседних офферов в пачке склеиваются.
+    photo_side — нужная большая сторона фото: качается наименьший подходящий размер.
+    """
+    album_ids = telethon_pool.albums.lookup(channel_username, msg_id)
+    if album_ids:
+        by_id = await telethon_pool.messages.get(telethon_pool, pc, channel_username, album_ids)
+        msgs = [by_id[i] for i in album_ids if i in by_id]
+    else:
+        ids_window = range(max(1, msg_id - 20), msg_id + 21)
+        by_id = await telethon_pool.messages.get(telethon_pool, pc, channel_username, ids_window)
+        message = by_id.get(msg_id)
         if not message:
             return []
         grouped_id = getattr(message, "grouped_id", None)
-        msgs = []
         if grouped_id:
-            ids_window = list(range(max(1, msg_id - 20), msg_id + 21))
-            all_msgs = await telethon_client.get_messages(channel, ids=ids_window)
-            msgs = [m for m in all_msgs if getattr(m, "grouped_id", None) == grouped_id]
-            msgs.sort(key=lambda x: x.id)
+            msgs = sorted(
+                (by_id[i] for i in ids_window if i in by_id and getattr(by_id[i], "grouped_id", None) == grouped_id),
+                key=lambda x: x.id,
+            )
+            telethon_pool.albums.add(channel_username, grouped_id, [m.id for m in msgs])
         else:
             msgs = [message]
 
-        photos: List[bytes] = []
-        for m in msgs:
-            if getattr(m, "photo", None) is not None:
-                async with telethon_semaphore:
-                    b = await _download_small_photo_bytes(m)
-                if b:
-                    photos.append(b)
-                if len(photos) >= 3:
-                    break
-        return photos
+    photo_msgs = [m for m in msgs if getattr(m, "photo", None) is not None][:3]
+    downloaded = await asyncio.gather(*(_download_small_photo_bytes(pc, m, photo_side) for m in photo_msgs))
+    return [b for b in downloaded if b]
+
+
+async def fetch_first_3_small_photos_for_channel(channel_username: str, msg_id: int,
+                                                 photo_side: Optional[int] = None) -> List[bytes]:
+    await ensure_connected()
+    try:
+        return await telethon_pool.run(
+            lambda pc: _fetch_first_3_small_photos(pc, channel_username, msg_id, photo_side)
+        )
     except Exception as e:
         logger.exception(f"Error fetching photos for msg {msg_id} from {channel_username}: {e}")
         return []
 
 # ----------------- Collage layout: универсальный (1–3 фото) -----------------
-def _resize_cover(img: Image.Image, tw: int, th: int) -> Image.Image:
-    w, h = img.size
-    if w == 0 or h == 0:
-        return img
-    scale = max(tw / w, th / h)
-    nw, nh = int(w * scale), int(h * scale)
-    img2 = img.resize((nw, nh), Image.LANCZOS)
-    left = (nw - tw) // 2
-    top = (nh - th) // 2
-    return img2.crop((left, top, left + tw, top + th))
-
-
-def make_universal_collage(images_bytes: List[bytes]) -> Optional[bytes]:
+def make_universal_collage(images_bytes: List[bytes], variant: str = "full") -> Optional[bytes]:
     if not images_bytes:
         return None
 
-    final_w, final_h = COLLAGE_W, COLLAGE_H
-    n = min(3, len(images_bytes))
+    # Pillow подгружается вместе с collage только при первой сборке коллажа
+    from collage import render_collage
 
+    width, height, encoder = COLLAGE_VARIANTS[variant]
     try:
-        imgs = [Image.open(BytesIO(b)).convert("RGB") for b in images_bytes[:n]]
-
-        if n == 1:
-            img1 = _resize_cover(imgs[0], final_w, final_h)
-            collage = Image.new("RGB", (final_w, final_h))
-            collage.paste(img1, (0, 0))
-
-        elif n == 2:
-            left_w = final_w // 2
-            right_w = final_w - left_w
-            img1 = _resize_cover(imgs[0], left_w, final_h)
-            img2 = _resize_cover(imgs[1], right_w, final_h)
-            collage = Image.new("RGB", (final_w, final_h))
-            collage.paste(img1, (0, 0))
-            collage.paste(img2, (left_w, 0))
-
-        else:
-            left_w = final_w // 2
-            right_w = final_w - left_w
-            half_h = final_h // 2
-            img1 = _resize_cover(imgs[0], left_w, final_h)
-            img2 = _resize_cover(imgs[1], right_w, half_h)
-            img3 = _resize_cover(imgs[2], right_w, half_h)
-            collage = Image.new("RGB", (final_w, final_h))
-            collage.paste(img1, (0, 0))
-            collage.paste(img2, (left_w, 0))
-            collage.paste(img3, (left_w, half_h))
-
-        out = BytesIO()
-        collage.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
-        out.seek(0)
-        return out.read()
-
+        with span("collage.render", photos=len(images_bytes), variant=variant) as sp:
+            data = render_collage(images_bytes, width, height, encoder)
+            sp.set("bytes", len(data) if data else 0)
+            return data
     except Exception as e:
         logger.exception(f"Error creating collage: {e}")
         return None
@@ -515,21 +802,34 @@ def offices_price_keyboard_reply():
     return kb
 
 
+def page_nav_keyboard(page: int, total_pages: int, has_filter: bool = False):
+    rows = []
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data="page_prev"))
+    if page < total_pages - 1:
+        nav.append(InlineKeyboardButton(text="Далі ➡️", callback_data="page_next"))
+    if nav:
+        rows.append(nav)
+    if has_filter:
+        rows.append([InlineKeyboardButton(text="📄 Усі результати файлом (CSV)", callback_data="export_csv")])
+        rows.append([InlineKeyboardButton(text="🔔 Стежити за цим пошуком", callback_data="subscribe")])
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+
 def offer_card_keyboard(detail_url: str, msg_id: int):
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Детальніше ➡️", url=detail_url)],
-        [InlineKeyboardButton(text="📊 Калькулятор ЦІНИ", callback_data=f"calc_{msg_id}")]
+        [InlineKeyboardButton(text="📊 Калькулятор ЦІНИ", callback_data=f"calc_{msg_id}")],
+        [InlineKeyboardButton(text="🔍 Фото у повному розмірі", callback_data=f"full_{msg_id}")]
     ])
 
 # ----------------- Parsing & filtering (офисы/склады) -----------------
-async def parse_and_filter_messages_offices(
-    messages,
-    min_size: int,
-    max_size: Optional[int],
-    min_price_per_m2: Optional[int] = None,
-    max_price_per_m2: Optional[int] = None
-):
-    offers: List[Dict[str, Any]] = []
+def iter_offices(messages, channel_username: str) -> Iterator[Offer]:
+    """
+    Офферы канала офисов по мере разбора сообщений, без фильтров и сортировки.
+    Подпись карточки не рендерится здесь — см. Offer.caption().
+    """
     pattern = re.compile(
         r"(\d+(?:-й|-й поверх| поверх|й поверх))\s+(\d+(?:\.\d+)?)m2\s*\((\d+(?:\.\d+)?\$)\)",
         flags=re.I
@@ -545,6 +845,7 @@ async def parse_and_filter_messages_offices(
         bc_class = extract_bc_class(message)
         price_formula = extract_price_formula(message)
         metro_station = extract_metro_station(message)
+        version = zlib.crc32(message.encode("utf-8"))
 
         ents = entities or []
 
@@ -558,12 +859,6 @@ async def parse_and_filter_messages_offices(
                 continue
             price_per_m2 = round(price_total / size_number, 2)
 
-            if not (min_size <= size_number if max_size is None else min_size <= size_number <= max_size):
-                continue
-            if (min_price_per_m2 is not None and price_per_m2 < min_price_per_m2) or \
-               (max_price_per_m2 is not None and price_per_m2 > max_price_per_m2):
-                continue
-
             link = None
             min_dist = None
             chosen_ent = None
@@ -589,38 +884,47 @@ async def parse_and_filter_messages_offices(
                         link = None
 
             if not link:
-                link = f"https://t.me/{CHANNEL_OFFICES[1:]}/{msg_id}"
-
-            lines = [f"<b>{bc_name}</b>"]
-            if bc_class:
-                lines.append(f"Клас {bc_class}")
-            if price_formula:
-                lines.append(f"ЦІНА: {price_formula}")
-            lines.append(f"{floor}, {int(size_number) if size_number.is_integer() else size_number}м²")
-            lines.append(f"💵 {int(price_total):,}$ ({price_per_m2}$/м²)")
-            if metro_station:
-                lines.append(f"Ⓜ️{metro_station}")
-
-            text_out = "\n".join(lines)
-
-            offers.append({
-                'text': text_out,
-                'link': link,
-                'msg_id': msg_id,
-                'price_total': price_total,
-                'price_per_m2': price_per_m2,
-                'size': size_number,
-                'floor': floor,
-                'bc_name': bc_name,
-                'type': 'office'
-            })
-
-    offers.sort(key=lambda x: x['price_total'])
-    return offers
+                link = f"https://t.me/{channel_username[1:]}/{msg_id}"
+
+            yield Offer(
+                type='office',
+                msg_id=msg_id,
+                link=link,
+                price_total=price_total,
+                price_per_m2=price_per_m2,
+                size=size_number,
+                bc_name=bc_name,
+                floor=floor,
+                bc_class=bc_class,
+                price_formula=price_formula,
+                metro=metro_station,
+                version=version,
+                channel=channel_username,
+            )
 
 
-async def parse_and_filter_messages_warehouses(messages, shore_filter: Optional[str], size_choice: Optional[str]):
-    offers: List[Dict[str, Any]] = []
+def office_filter(
+    min_size: int,
+    max_size: Optional[int],
+    min_price_per_m2: Optional[int] = None,
+    max_price_per_m2: Optional[int] = None
+) -> Callable[[Offer], bool]:
+    def matches(offer: Offer) -> bool:
+        size_number = offer.size
+        price_per_m2 = offer.price_per_m2
+        if not (min_size <= size_number if max_size is None else min_size <= size_number <= max_size):
+            return False
+        if (min_price_per_m2 is not None and price_per_m2 < min_price_per_m2) or \
+           (max_price_per_m2 is not None and price_per_m2 > max_price_per_m2):
+            return False
+        return True
+    return matches
+
+
+def iter_warehouses(messages, channel_username: str) -> Iterator[Offer]:
+    """
+    Офферы канала складов по мере разбора сообщений, без фильтров и сортировки.
+    """
     for message, msg_id, entities in messages:
         if not message:
             continue
@@ -629,6 +933,7 @@ async def parse_and_filter_messages_warehouses(messages, shore_filter: Optional[
         if not lines:
             continue
         title = lines[0]
+        version = zlib.crc32(txt.encode("utf-8"))
         addr = None
         shore = None
         height = None
@@ -673,22 +978,6 @@ async def parse_and_filter_messages_warehouses(messages, shore_filter: Optional[
             url = m.group(4)
             price_per_m2 = round(price_total / size, 2) if size else 0.0
 
-            if shore_filter:
-                if shore:
-                    if shore_filter.lower().startswith("лів") and not shore.lower().startswith("лів"):
-                        continue
-                    if shore_filter.lower().startswith("прав") and not shore.lower().startswith("прав"):
-                        continue
-                else:
-                    continue
-
-            if size_choice == "<=1000":
-                if not (size <= 1000.0):
-                    continue
-            elif size_choice == ">1000":
-                if not (size >= 1000.0):
-                    continue
-
             link = url
             if not link:
                 ents = entities or []
@@ -715,122 +1004,495 @@ async def parse_and_filter_messages_warehouses(messages, shore_filter: Optional[
                         except Exception:
                             link = None
             if not link:
-                link = f"https://t.me/{CHANNEL_WAREHOUSES[1:]}/{msg_id}"
+                link = f"https://t.me/{channel_username[1:]}/{msg_id}"
 
             display_name = title or (addr or f"Склад {msg_id}")
-            lines_out = [f"<b>{display_name}</b>"]
-            if addr:
-                lines_out.append(f"📍 {addr}")
-            if metro:
-                lines_out.append(f"Ⓜ️ {metro}")
+            yield Offer(
+                type='warehouse',
+                msg_id=msg_id,
+                link=link,
+                price_total=price_total,
+                price_per_m2=price_per_m2,
+                size=size,
+                bc_name=display_name,
+                desc=desc,
+                addr=addr,
+                shore=shore,
+                w_class=w_class,
+                height=height,
+                power=power,
+                metro=metro,
+                version=version,
+                channel=channel_username,
+            )
+
+
+def warehouse_filter(shore_filter: Optional[str], size_choice: Optional[str]) -> Callable[[Offer], bool]:
+    def matches(offer: Offer) -> bool:
+        shore = offer.shore
+        size = offer.size
+        if shore_filter:
             if shore:
-                lines_out.append(f"🚩 Берег: {shore}")
-            if w_class:
-                lines_out.append(f"🏗 Клас: {w_class}")
-            if height:
-                lines_out.append(f"📏 Висота стелі: {int(height) if float(height).is_integer() else height} м")
-            if power:
-                lines_out.append(f"⚡ Потужність: {power}")
-            lines_out.append(f"{desc}, {int(size) if size.is_integer() else size}м²")
-            lines_out.append(f"💵 {int(price_total):,}$ ({price_per_m2}$/м²)")
-
-            text_out = "\n".join(lines_out)
-            offers.append({
-                'text': text_out,
-                'link': link,
-                'msg_id': msg_id,
-                'price_total': price_total,
-                'price_per_m2': price_per_m2,
-                'size': size,
-                'desc': desc,
-                'bc_name': display_name,
-                'type': 'warehouse',
-                'height': height,
-                'w_class': w_class
-            })
-    offers.sort(key=lambda x: x['price_total'])
-    return offers
+                if shore_filter.lower().startswith("лів") and not shore.lower().startswith("лів"):
+                    return False
+                if shore_filter.lower().startswith("прав") and not shore.lower().startswith("прав"):
+                    return False
+            else:
+                return False
+
+        if size_choice == "<=1000":
+            if not (size <= 1000.0):
+                return False
+        elif size_choice == ">1000":
+            if not (size >= 1000.0):
+                return False
+        return True
+    return matches
+
 
 # ----------------- Ensure collage, cache & send page -----------------
-async def ensure_collage_and_cache_for_offer(channel_username: str, offer: Dict[str, Any]):
+def offer_channel(offer: Offer) -> str:
+    if offer.channel:
+        return offer.channel
+    # офферы из старого снапшота — первый канал того же профиля
+    return next((ch for ch, profile in CHANNELS.items() if profile == offer.type), next(iter(CHANNELS)))
+
+
+def offer_key(offer: Offer) -> Tuple[str, int]:
+    """id сообщений уникальны только в пределах канала."""
+    return offer_channel(offer), offer.msg_id
+
+
+def collage_slug(offer: Offer, variant: str = CARD_COLLAGE_VARIANT) -> str:
+    """Ключ коллажа в pack, file_id и Drive; полный вариант — без суффикса."""
+    msg_id = offer.msg_id
+    bc_key_raw = offer.bc_name or str(msg_id)
+    slug = slugify(bc_key_raw) or f"offer_{msg_id}"
+    return slug if variant == "full" else f"{slug}.{variant}"
+
+
+def collage_cache_key(offer: Offer, variant: str = CARD_COLLAGE_VARIANT) -> Tuple[str, int, str]:
+    return (*offer_key(offer), variant)
+
+
+def collage_file_id(offer: Offer, variant: str = CARD_COLLAGE_VARIANT) -> Tuple[str, Optional[str]]:
+    """
+    (slug, file_id) для отправки. Если превью ещё нет, а полный коллаж Telegram
+    уже видел — берём его: повторная отправка по file_id дешевле сборки превью.
+    """
+    slug = collage_slug(offer, variant)
+    file_id = collage_file_ids.get(slug)
+    if file_id is None and variant != "full":
+        full_slug = collage_slug(offer, "full")
+        full_id = collage_file_ids.get(full_slug)
+        if full_id is not None:
+            return full_slug, full_id
+    return slug, file_id
+
+
+collage_pack: Optional[CollagePack] = None
+
+
+def get_collage_pack() -> CollagePack:
+    # открывается лениво: loadtest/replay подменяют TEMP_FOLDER после импорта
+    global collage_pack
+    if collage_pack is None:
+        collage_pack = CollagePack(os.path.join(TEMP_FOLDER, f"collages-{WORKER_INDEX}.pack"))
+        # коллажи до перехода на pack лежали файлами <slug>.jpg (полный вариант) —
+        # переносим один раз; файлы забирает первый открывший pack воркер
+        imported = collage_pack.import_files(TEMP_FOLDER)
+        if imported:
+            logger.warning(f"Imported {imported} legacy collage files into {collage_pack.path}")
+    return collage_pack
+
+
+def close_collage_pack():
+    global collage_pack
+    if collage_pack is not None:
+        collage_pack.close()
+        collage_pack = None
+
+
+async def _store_collage(slug: str, data: bytes) -> Union[bytes, memoryview]:
+    """Дописать коллаж в pack; в L1 дальше лежит memoryview на mmap, а не копия в куче."""
+    try:
+        return await asyncio.to_thread(get_collage_pack().put, slug, data)
+    except Exception:
+        logger.exception("Ошибка записи коллажа в pack-файл")
+        return data
+
+
+async def maintain_collage_pack():
+    """
+    Сбросить индекс pack'а на диск и, если мёртвых байт много, сжать его.
+    Слаги без офферов считаются мёртвыми, только когда проиндексированы все каналы.
+    """
+    pack = get_collage_pack()
+    keep = None
+    if all(ch in offer_index for ch in CHANNELS):
+        live = {
+            collage_slug(offer, variant)
+            for _, offers in offer_index.values() for offer in offers for variant in COLLAGE_VARIANTS
+        }
+        keep = live.__contains__
+    compacted = await asyncio.to_thread(
+        pack.maybe_compact, COLLAGE_PACK_MIN_DEAD, COLLAGE_PACK_DEAD_RATIO, keep
+    )
+    if compacted:
+        # memoryview на старый файл держат его mmap — перечитаем из нового pack'а при надобности
+        for key in [k for k, v in collage_bytes_cache.items() if isinstance(v, memoryview)]:
+            del collage_bytes_cache[key]
+        logger.info(f"Collage pack compacted: {pack.stats()}")
+    else:
+        await asyncio.to_thread(pack.flush)
+
+
+async def ensure_collage_and_cache_for_offer(channel_username: str, offer: Offer,
+                                             variant: str = CARD_COLLAGE_VARIANT):
+    with span("collage.ensure", channel=channel_username, msg_id=offer.msg_id, variant=variant) as sp:
+        sp.set("tier", await _ensure_collage(channel_username, offer, variant))
+
+
+async def _ensure_collage(channel_username: str, offer: Offer, variant: str) -> str:
     """
-    Гарантирует, что для оффера есть байты коллажа в collage_bytes_cache.
+    Гарантирует, что для оффера есть байты коллажа нужного варианта в collage_bytes_cache.
+    Возвращает уровень кэша, который ответил: memory / local / drive / built
+    (или none / failed, если коллаж собрать не из чего).
 
     Приоритет:
     1) Если уже есть в collage_bytes_cache — ничего не делаем.
-    2) Если есть локальный файл temp_collages/slug.jpg — читаем его.
-    3) Если есть запись в collage_url_cache (Drive) — скачиваем из Drive и кладём в temp + cache.
-    4) Иначе — качаем 1–3 фото из канала, создаём коллаж, сохраняем локально, грузим в Drive, пишем cache.
+    2) Если slug есть в pack-файле — берём memoryview без чтения с диска.
+    3) Если есть запись в collage_url_cache (Drive) — скачиваем из Drive и кладём в pack + cache.
+    4) Иначе — качаем 1–3 фото из канала, создаём коллаж, дописываем в pack, грузим в Drive, пишем cache.
     """
-    msg_id = offer["msg_id"]
-    if msg_id in collage_bytes_cache:
-        return
+    msg_id = offer.msg_id
+    cache_key = (channel_username, msg_id, variant)
+    if cache_key in collage_bytes_cache:
+        return "memory"
 
-    bc_key_raw = offer.get("bc_name") or str(msg_id)
-    initial_slug = slugify(bc_key_raw)
-    bc_key_slug = initial_slug or f"offer_{msg_id}"
+    bc_key_slug = collage_slug(offer, variant)
 
     local_name = f"{bc_key_slug}.jpg"
-    local_path = os.path.join(TEMP_FOLDER, local_name)
 
-    # 2) Локальный файл уже есть
-    if os.path.exists(local_path):
-        try:
-            with open(local_path, "rb") as f:
-                data = f.read()
-            if data:
-                collage_bytes_cache[msg_id] = data
-                return
-        except Exception:
-            logger.exception("Ошибка чтения локального файла коллажа")
+    # 2) Коллаж уже есть в pack-файле
+    data = get_collage_pack().get(bc_key_slug)
+    if data is not None:
+        collage_bytes_cache[cache_key] = data
+        return "local"
 
     # 3) Если есть запись в Drive-кэше — пробуем скачать
     if USE_DRIVE and bc_key_slug in collage_url_cache:
         url = collage_url_cache[bc_key_slug]
         file_id = extract_file_id_from_url(url)
-        data = await asyncio.to_thread(download_collage_from_drive, file_id)
+        with client_span("drive.download") as sp:
+            data = await asyncio.to_thread(download_collage_from_drive, file_id)
+            sp.set("bytes", len(data) if data else 0)
         if data:
-            try:
-                with open(local_path, "wb") as f:
-                    f.write(data)
-            except Exception:
-                logger.exception("Ошибка записи локального файла при скачивании с Drive")
-            collage_bytes_cache[msg_id] = data
-            return
+            collage_bytes_cache[cache_key] = await _store_collage(bc_key_slug, data)
+            return "drive"
         # если скачивание с Drive не удалось, пойдём в шаг 4 (создание с нуля)
 
     # 4) Генерация с нуля: качаем фото из Telegram, создаём коллаж
-    photos = await fetch_first_3_small_photos_for_channel(channel_username, msg_id)
+    width, height, _ = COLLAGE_VARIANTS[variant]
+    photos = await fetch_first_3_small_photos_for_channel(channel_username, msg_id, max(width, height))
     if not photos:
-        return
+        return "none"
 
-    collage_bytes = make_universal_collage(photos)
+    collage_bytes = make_universal_collage(photos, variant)
     if not collage_bytes:
-        return
-
-    # Сохраняем локально
-    try:
-        with open(local_path, 'wb') as f:
-            f.write(collage_bytes)
-    except Exception:
-        logger.exception("Ошибка записи локального файла коллажа")
+        return "failed"
 
-    # Кэшируем в памяти
-    collage_bytes_cache[msg_id] = collage_bytes
+    # Сохраняем в pack и кэшируем в памяти
+    collage_bytes_cache[cache_key] = await _store_collage(bc_key_slug, collage_bytes)
 
     # Пытаемся загрузить в Drive и обновить JSON-кэш
     if USE_DRIVE:
-        url = await asyncio.to_thread(upload_collage_to_drive, collage_bytes, local_name, DRIVE_FOLDER_ID)
+        with client_span("drive.upload", bytes=len(collage_bytes)):
+            url = await asyncio.to_thread(upload_collage_to_drive, collage_bytes, local_name, DRIVE_FOLDER_ID)
         if url:
             collage_url_cache[bc_key_slug] = url
             try:
                 with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(collage_url_cache, f, ensure_ascii=False, indent=2)
+                    json.dump(dict(collage_url_cache), f, ensure_ascii=False, indent=2)
             except Exception:
                 logger.exception("Ошибка записи JSON-кэша коллажей")
+    return "built"
+
+
+async def send_offer_card(chat_id, offer: Offer, keyboard, variant: str = CARD_COLLAGE_VARIANT):
+    """
+    Фото по file_id (если Telegram уже видел этот коллаж), иначе загрузка байтов,
+    иначе текст. Возвращает (сообщение, есть ли фото).
+    """
+    slug, file_id = collage_file_id(offer, variant)
+    if file_id:
+        try:
+            sent = await bot.send_photo(chat_id, file_id, caption=offer.caption(), reply_markup=keyboard)
+            return sent, True
+        except TelegramBadRequest:
+            # file_id больше не принимается — забываем и грузим байты
+            collage_file_ids.pop(slug, None)
+            await ensure_collage_and_cache_for_offer(offer_channel(offer), offer, variant)
+
+    slug = collage_slug(offer, variant)
+    collage_bytes = collage_bytes_cache.get(collage_cache_key(offer, variant))
+    if collage_bytes:
+        sent = await bot.send_photo(
+            chat_id,
+            CollageInputFile(collage_bytes),
+            caption=offer.caption(),
+            reply_markup=keyboard
+        )
+        if sent and sent.photo:
+            collage_file_ids[slug] = sent.photo[-1].file_id
+        return sent, True
+
+    sent = await bot.send_message(chat_id, offer.caption(), reply_markup=keyboard)
+    return sent, False
+
+
+def _has_collage(offer: Offer, variant: str = CARD_COLLAGE_VARIANT) -> bool:
+    return collage_file_id(offer, variant)[1] is not None or collage_cache_key(offer, variant) in collage_bytes_cache
+
+
+async def prepare_page_media(offers: List[Offer]) -> Dict[Tuple[str, int], asyncio.Task]:
+    """
+    Запустить подготовку коллажей страницы и ждать не дольше CARD_MEDIA_DEADLINE.
+    Возвращает ещё не завершённые задачи по offer_key — они продолжают работать в фоне.
+    """
+    tasks: Dict[Tuple[str, int], asyncio.Task] = {}
+    for offer in offers:
+        key = offer_key(offer)
+        if key in tasks or collage_file_id(offer)[1] is not None:
+            continue
+        tasks[key] = asyncio.create_task(ensure_collage_and_cache_for_offer(offer_channel(offer), offer))
+    if not tasks:
+        return {}
+    try:
+        await asyncio.wait(tasks.values(), timeout=CARD_MEDIA_DEADLINE)
+    except asyncio.CancelledError:
+        # страницу заменил новый запрос — её коллажи больше не нужны
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return {key: task for key, task in tasks.items() if not task.done()}
+
+
+# chat_id -> отложенные превращения текстовых карточек в фото
+_media_upgrades: Dict[Any, set] = {}
+
+
+async def _attach_media_later(chat_id, message_id: int, offer: Offer, keyboard, task: asyncio.Task):
+    try:
+        await task
+    except Exception:
+        logger.exception(f"Deferred collage for {offer.msg_id} failed")
+        return
+    if not _has_collage(offer):
+        return
+    # карточка могла уйти со страницы (новый поиск, листание на месте) — тогда не трогаем
+    entry = calc_store.get((chat_id, message_id))
+    if (not entry or (entry.get('has_photo') and not entry.get('placeholder'))
+            or offer_key(entry['offer']) != offer_key(offer)):
+        return
+    try:
+        await edit_offer_card(chat_id, message_id, offer, keyboard, has_photo=True)
+    except TelegramBadRequest as e:
+        logger.warning(f"Deferred media attach to {message_id} failed: {e}")
+        return
+    calc_store[(chat_id, message_id)] = {**entry, 'has_photo': True, 'placeholder': False}
+    view = page_views.get(chat_id)
+    if view and any(mid == message_id for mid, _ in view.get('cards', [])):
+        view['cards'] = [(mid, True if mid == message_id else has_photo) for mid, has_photo in view['cards']]
+        page_views[chat_id] = view
+
+
+def defer_media_attach(chat_id, message_id: int, offer: Offer, keyboard,
+                       pending: Dict[Tuple[str, int], asyncio.Task]):
+    """Текстовая карточка, чей коллаж ещё готовится, станет фото через edit_message_media."""
+    task = pending.get(offer_key(offer))
+    if task is None:
+        return
+    upgrade = asyncio.create_task(_attach_media_later(chat_id, message_id, offer, keyboard, task))
+    upgrades = _media_upgrades.setdefault(chat_id, set())
+    upgrades.add(upgrade)
+
+    def _done(t):
+        upgrades.discard(t)
+        if not upgrades and _media_upgrades.get(chat_id) is upgrades:
+            del _media_upgrades[chat_id]
+
+    upgrade.add_done_callback(_done)
+
+
+def cancel_media_upgrades(chat_id):
+    """Отменить отложенные коллажи чата (ожидаемая задача коллажа отменяется вместе с ними)."""
+    for upgrade in list(_media_upgrades.get(chat_id, ())):
+        upgrade.cancel()
+
+
+def _forget_page_view(chat_id):
+    """Старые карточки чата больше не хранятся в calc_store (калькулятор найдёт их через сессию)."""
+    view = page_views.pop(chat_id, None)
+    if not view:
+        return
+    for message_id, _ in view.get('cards', []):
+        calc_store.pop((chat_id, message_id), None)
 
 
-async def send_page(chat_id, user_id):
+async def edit_offer_card(chat_id, message_id: int, offer: Offer, keyboard, has_photo: bool):
+    """
+    Подменить содержимое карточки: фото — через edit_message_media (file_id или байты),
+    текст — через edit_message_text.
+    """
+    if not has_photo:
+        await bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id, text=offer.caption(), reply_markup=keyboard
+        )
+        return
+
+    slug, file_id = collage_file_id(offer)
+    media = file_id or CollageInputFile(collage_bytes_cache[collage_cache_key(offer)])
+    edited = await bot.edit_message_media(
+        chat_id=chat_id,
+        message_id=message_id,
+        media=InputMediaPhoto(media=media, caption=offer.caption()),
+        reply_markup=keyboard,
+    )
+    if not file_id and isinstance(edited, types.Message) and edited.photo:
+        collage_file_ids[slug] = edited.photo[-1].file_id
+
+
+# пустая карточка: лишние сообщения короткой последней страницы не удаляются,
+# а очищаются — при листании назад их снова заполняют на месте
+BLANK_CARD_TEXT = "⋯"
+BLANK_CARD_SLUG = "blank-card"
+_blank_card_bytes: Optional[bytes] = None
+
+
+async def _edit_blank_photo(chat_id, message_id: int, caption: str, keyboard=None):
+    global _blank_card_bytes
+    file_id = collage_file_ids.get(BLANK_CARD_SLUG)
+    if not file_id and _blank_card_bytes is None:
+        from collage import render_blank
+        width, height, _ = COLLAGE_VARIANTS[CARD_COLLAGE_VARIANT]
+        _blank_card_bytes = render_blank(width, height)
+    edited = await bot.edit_message_media(
+        chat_id=chat_id,
+        message_id=message_id,
+        media=InputMediaPhoto(media=file_id or CollageInputFile(_blank_card_bytes), caption=caption),
+        reply_markup=keyboard,
+    )
+    if not file_id and isinstance(edited, types.Message) and edited.photo:
+        collage_file_ids[BLANK_CARD_SLUG] = edited.photo[-1].file_id
+
+
+async def blank_offer_card(chat_id, message_id: int, has_photo: bool):
+    if not has_photo:
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=BLANK_CARD_TEXT)
+        return
+    await _edit_blank_photo(chat_id, message_id, BLANK_CARD_TEXT)
+
+
+def _not_modified(e: TelegramBadRequest) -> bool:
+    return "message is not modified" in str(e)
+
+
+async def _refill_card(chat_id, message_id: int, has_photo: bool, offer: Offer, keyboard) -> Tuple[bool, bool]:
+    """
+    Заполнить карточку страницы новым оффером; вид сообщения подстраивается под
+    оффер по одной карточке. Возвращает (есть ли фото, фото — заглушка до коллажа).
+    TelegramBadRequest — сообщения больше нет.
+    """
+    want_photo = _has_collage(offer)
+    try:
+        if has_photo and not want_photo:
+            # коллаж ещё готовится — заглушка с подписью, коллаж подставит defer_media_attach
+            await _edit_blank_photo(chat_id, message_id, offer.caption(), keyboard)
+            return True, True
+        if want_photo and not has_photo:
+            try:
+                await edit_offer_card(chat_id, message_id, offer, keyboard, has_photo=True)
+                return True, False
+            except TelegramBadRequest as e:
+                logger.info(f"Card {message_id} stays text: {e}")
+        await edit_offer_card(chat_id, message_id, offer, keyboard, has_photo)
+    except TelegramBadRequest as e:
+        if not _not_modified(e):
+            raise
+    return has_photo, False
+
+
+async def _edit_page_in_place(chat_id, view: Dict[str, Any], page_offers: List[Offer],
+                              page: int, total_pages: int, nav_kb,
+                              pending: Dict[Tuple[str, int], asyncio.Task]) -> bool:
+    """
+    Переиспользовать сообщения текущей страницы. Возвращает False, если карточек
+    меньше, чем нужно, — тогда страница отправляется заново. Несовпадение фото/текст
+    и удалённые сообщения решаются по одной карточке (_refill_card). Лишние
+    карточки очищаются и остаются в view['cards']; view['shown'] — сколько заполнено.
+    """
+    cards = list(view.get('cards', []))
+    if len(page_offers) > len(cards):
+        return False
+
+    for i, offer in enumerate(page_offers):
+        message_id, has_photo = cards[i]
+        keyboard = offer_card_keyboard(offer.link, offer.msg_id)
+        try:
+            has_photo, placeholder = await _refill_card(chat_id, message_id, has_photo, offer, keyboard)
+        except TelegramBadRequest as e:
+            # сообщение удалено пользователем — заново только эту карточку
+            logger.warning(f"Edit of card {message_id} failed, resending the card: {e}")
+            calc_store.pop((chat_id, message_id), None)
+            sent, has_photo = await send_offer_card(chat_id, offer, keyboard)
+            message_id, placeholder = sent.message_id, False
+        cards[i] = (message_id, has_photo)
+        calc_store[(chat_id, message_id)] = {
+            'offer': offer,
+            'has_photo': has_photo,
+            'placeholder': placeholder,
+            'reply_markup': keyboard
+        }
+        if placeholder or not has_photo:
+            defer_media_attach(chat_id, message_id, offer, keyboard, pending)
+
+    # на последней странице карточек может быть меньше — лишние очищаем (уже пустые не трогаем)
+    gone = set()
+    for message_id, has_photo in cards[len(page_offers):view.get('shown', len(cards))]:
+        calc_store.pop((chat_id, message_id), None)
+        try:
+            await blank_offer_card(chat_id, message_id, has_photo)
+        except TelegramBadRequest as e:
+            if not _not_modified(e):
+                # удалено пользователем — переиспользовать нечего
+                logger.warning(f"Blanking of card {message_id} failed: {e}")
+                gone.add(message_id)
+
+    try:
+        await bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=view['nav_id'],
+            text=f"Сторінка {page + 1} із {total_pages}",
+            reply_markup=nav_kb,
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.warning(f"Edit of nav message failed: {e}")
+
+    view['cards'] = [card for card in cards if card[0] not in gone]
+    view['shown'] = len(page_offers)
+    page_views[chat_id] = view
+    return True
+
+
+async def send_page(chat_id, user_id, nav_message_id: Optional[int] = None):
+    """
+    Показать текущую страницу сессии. Если передан nav_message_id (нажата кнопка
+    навигации) и PAGINATION_MODE == 'edit', карточки и навигация правятся на месте.
+    Карточки, чей коллаж не готов за CARD_MEDIA_DEADLINE, уходят текстом и
+    превращаются в фото, когда коллаж соберётся.
+    """
     session = user_sessions.get(user_id)
     if not session:
         return
@@ -838,59 +1500,119 @@ async def send_page(chat_id, user_id):
     page = session.get('page', 0)
     start = page * PAGE_SIZE
     end = min(len(results), start + PAGE_SIZE)
+    page_offers = results[start:end]
+    total_pages = (len(results) - 1) // PAGE_SIZE + 1 if results else 1
 
-    # подготавливаем коллажи для офферов этой страницы
-    tasks = []
-    for i in range(start, end):
-        offer = results[i]
-        ch = CHANNEL_OFFICES if offer.get('type') == 'office' else CHANNEL_WAREHOUSES
-        tasks.append(ensure_collage_and_cache_for_offer(ch, offer))
-    await asyncio.gather(*tasks)
-
-    for i in range(start, end):
-        offer = results[i]
-        keyboard = offer_card_keyboard(offer['link'], offer['msg_id'])
-        sent = None
-        has_photo = False
-        try:
-            collage_bytes = collage_bytes_cache.get(offer['msg_id'])
-            if collage_bytes:
-                sent = await bot.send_photo(
-                    chat_id,
-                    BufferedInputFile(collage_bytes, filename="collage.jpg"),
-                    caption=offer['text'],
-                    reply_markup=keyboard
-                )
-                has_photo = True
-            else:
-                sent = await bot.send_message(chat_id, offer['text'], reply_markup=keyboard)
-                has_photo = False
-
-            if sent:
-                calc_store[(chat_id, sent.message_id)] = {
-                    'offer': offer,
-                    'has_photo': has_photo,
-                    'reply_markup': keyboard
-                }
+    # коллажи страницы ждём не дольше дедлайна (если file_id уже есть — не нужно)
+    pending = await prepare_page_media(page_offers)
 
-        except Exception as e:
-            logger.exception(f"Error sending offer: {e}")
+    nav_kb = page_nav_keyboard(page, total_pages, has_filter='filter' in session)
+    view = page_views.get(chat_id)
+    if (PAGINATION_MODE == 'edit' and nav_message_id is not None
+            and view and view.get('nav_id') == nav_message_id):
+        if await _edit_page_in_place(chat_id, view, page_offers, page, total_pages, nav_kb, pending):
+            return
 
-    total_pages = (len(results) - 1) // PAGE_SIZE + 1 if results else 1
-    rows = []
-    if page > 0:
-        rows.append(InlineKeyboardButton(text="⬅️ Назад", callback_data="page_prev"))
-    if page < total_pages - 1:
-        rows.append(InlineKeyboardButton(text="Далі ➡️", callback_data="page_next"))
-    nav_kb = InlineKeyboardMarkup(inline_keyboard=[rows]) if rows else None
+    _forget_page_view(chat_id)
+    cards = []
+    try:
+        for offer in page_offers:
+            keyboard = offer_card_keyboard(offer.link, offer.msg_id)
+            try:
+                sent, has_photo = await send_offer_card(chat_id, offer, keyboard)
+
+                if sent:
+                    calc_store[(chat_id, sent.message_id)] = {
+                        'offer': offer,
+                        'has_photo': has_photo,
+                        'reply_markup': keyboard
+                    }
+                    cards.append((sent.message_id, has_photo))
+                    if not has_photo:
+                        defer_media_attach(chat_id, sent.message_id, offer, keyboard, pending)
+
+            except Exception as e:
+                logger.exception(f"Error sending offer: {e}")
+    except asyncio.CancelledError:
+        # страницу заменил новый запрос: запоминаем уже отправленные карточки,
+        # чтобы следующая страница убрала их из calc_store
+        page_views[chat_id] = {'cards': cards, 'nav_id': None}
+        raise
 
     if nav_kb:
-        await bot.send_message(chat_id, f"Сторінка {page + 1} із {total_pages}", reply_markup=nav_kb)
+        nav = await bot.send_message(chat_id, f"Сторінка {page + 1} із {total_pages}", reply_markup=nav_kb)
     else:
-        await bot.send_message(chat_id, f"Сторінка {page + 1} із {total_pages}")
+        nav = await bot.send_message(chat_id, f"Сторінка {page + 1} із {total_pages}")
+    # часть карточек могла уже получить фото, пока отправлялась страница
+    cards = [
+        (mid, (calc_store.get((chat_id, mid)) or {}).get('has_photo', has_photo))
+        for mid, has_photo in cards
+    ]
+    page_views[chat_id] = {'cards': cards, 'nav_id': nav.message_id}
 
     await bot.send_message(chat_id, "Щоб почати новий пошук:", reply_markup=new_search_keyboard())
 
+# ----------------- Per-user in-flight work -----------------
+# Кнопки, после которых прежний поиск или страница пользователю уже не нужны
+SUPERSEDING_TEXTS = frozenset({
+    "/start", "Новий пошук", "🔙 Назад", "🏢 Офіс", "🏭 Склад",
+    "До 200 м²", "200–500 м²", "500–1000 м²", "1000+ м²",
+    "До 20$ за м²", "20–30$ за м²", "Більше 30$ за м²",
+    "Лівий берег", "Правий берег", "До 1000 м²", "Від 1000 м²",
+})
+SUPERSEDING_CALLBACKS = frozenset({"page_next", "page_prev"})
+
+# user_id -> (задача обработчика, кнопка); апдейты пользователя всегда на одном воркере
+user_work: Dict[int, Tuple[asyncio.Task, str]] = {}
+work_stats = {'superseded': 0, 'debounced': 0}
+
+
+async def supersede_middleware(handler, event, data: Dict[str, Any]):
+    """
+    Поиск и отрисовка страницы идут в отдельной задаче на пользователя.
+    Новая кнопка отменяет прежнюю задачу (CancelledError в ближайшем await:
+    чтение канала, загрузка фото, сборка коллажа, отправка), повторное нажатие
+    той же кнопки, пока она выполняется, игнорируется.
+    """
+    if isinstance(event, types.CallbackQuery):
+        key, superseding, chat_id = event.data, event.data in SUPERSEDING_CALLBACKS, event.message.chat.id
+    else:
+        key, superseding, chat_id = event.text, event.text in SUPERSEDING_TEXTS, event.chat.id
+    if not superseding or event.from_user is None:
+        return await handler(event, data)
+
+    user_id = event.from_user.id
+    previous = user_work.get(user_id)
+    if previous and not previous[0].done():
+        if previous[1] == key:
+            work_stats['debounced'] += 1
+            if isinstance(event, types.CallbackQuery):
+                try:
+                    await event.answer()
+                except Exception:
+                    pass
+            return None
+        previous[0].cancel()
+        work_stats['superseded'] += 1
+    cancel_media_upgrades(chat_id)
+
+    work = asyncio.create_task(handler(event, data), name=asyncio.current_task().get_name())
+    user_work[user_id] = (work, key)
+    try:
+        return await work
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise       # отменили сам апдейт (остановка бота), а не его работу
+        logger.info(f"User {user_id}: {key!r} superseded")
+        return None
+    finally:
+        if user_work.get(user_id, (None,))[0] is work:
+            del user_work[user_id]
+
+
+router.message.outer_middleware(supersede_middleware)
+router.callback_query.outer_middleware(supersede_middleware)
+
 # ----------------- Handlers -----------------
 @router.message(CommandStart())
 async def start_handler(message: types.Message):
@@ -959,12 +1681,17 @@ async def office_price_low(message: types.Message):
             one_time_keyboard=True
         )
     )
-    messages = await fetch_channel_messages(limit=None)
-    parsed_offices = await parse_and_filter_messages_offices(messages, min_size, max_size, min_price, max_price)
+    parsed_offices = await search_offers(
+        'office', office_filter(min_size, max_size, min_price, max_price)
+    )
     if not parsed_offices:
         await message.answer("На жаль, відповідних варіантів не знайдено.", reply_markup=new_search_keyboard())
         return
-    user_sessions[message.from_user.id] = {'results': parsed_offices, 'page': 0}
+    user_sessions[message.from_user.id] = {
+        'results': parsed_offices,
+        'page': 0,
+        'filter': Subscription.for_offices(min_size, max_size, min_price, max_price),
+    }
     await send_page(message.chat.id, message.from_user.id)
 
 
@@ -983,12 +1710,17 @@ async def office_price_mid(message: types.Message):
             one_time_keyboard=True
         )
     )
-    messages = await fetch_channel_messages(limit=None)
-    parsed_offices = await parse_and_filter_messages_offices(messages, min_size, max_size, min_price, max_price)
+    parsed_offices = await search_offers(
+        'office', office_filter(min_size, max_size, min_price, max_price)
+    )
     if not parsed_offices:
         await message.answer("На жаль, відповідних варіантів не знайдено.", reply_markup=new_search_keyboard())
         return
-    user_sessions[message.from_user.id] = {'results': parsed_offices, 'page': 0}
+    user_sessions[message.from_user.id] = {
+        'results': parsed_offices,
+        'page': 0,
+        'filter': Subscription.for_offices(min_size, max_size, min_price, max_price),
+    }
     await send_page(message.chat.id, message.from_user.id)
 
 
@@ -998,7 +1730,7 @@ async def office_price_high(message: types.Message):
     min_size = session.get('min_size', 0)
     max_size = session.get('max_size', None)
     min_price = 30
-    max_price = 1000000
+    max_price = None
     await message.answer(
         "Шукаємо відповідні варіанти...",
         reply_markup=ReplyKeyboardMarkup(
@@ -1007,12 +1739,17 @@ async def office_price_high(message: types.Message):
             one_time_keyboard=True
         )
     )
-    messages = await fetch_channel_messages(limit=None)
-    parsed_offices = await parse_and_filter_messages_offices(messages, min_size, max_size, min_price, max_price)
+    parsed_offices = await search_offers(
+        'office', office_filter(min_size, max_size, min_price, max_price)
+    )
     if not parsed_offices:
         await message.answer("На жаль, відповідних варіантів не знайдено.", reply_markup=new_search_keyboard())
         return
-    user_sessions[message.from_user.id] = {'results': parsed_offices, 'page': 0}
+    user_sessions[message.from_user.id] = {
+        'results': parsed_offices,
+        'page': 0,
+        'filter': Subscription.for_offices(min_size, max_size, min_price, max_price),
+    }
     await send_page(message.chat.id, message.from_user.id)
 
 
@@ -1044,14 +1781,17 @@ async def warehouse_size_le_1000(message: types.Message):
     session['size_choice'] = "<=1000"
     user_sessions[message.from_user.id] = session
     await message.answer("Шукаємо склади — будь ласка зачекайте...")
-    messages = await fetch_channel_messages_for(CHANNEL_WAREHOUSES, limit=None)
     shore = session.get('shore')
     size_choice = session.get('size_choice')
-    parsed = await parse_and_filter_messages_warehouses(messages, shore, size_choice)
+    parsed = await search_offers('warehouse', warehouse_filter(shore, size_choice))
     if not parsed:
         await message.answer("На жаль, відповідних складів не знайдено.", reply_markup=new_search_keyboard())
         return
-    user_sessions[message.from_user.id] = {'results': parsed, 'page': 0}
+    user_sessions[message.from_user.id] = {
+        'results': parsed,
+        'page': 0,
+        'filter': Subscription.for_warehouses(shore, size_choice),
+    }
     await send_page(message.chat.id, message.from_user.id)
 
 
@@ -1061,14 +1801,17 @@ async def warehouse_size_ge_1000(message: types.Message):
     session['size_choice'] = ">1000"
     user_sessions[message.from_user.id] = session
     await message.answer("Шукаємо склади — будь ласка зачекайте...")
-    messages = await fetch_channel_messages_for(CHANNEL_WAREHOUSES, limit=None)
     shore = session.get('shore')
     size_choice = session.get('size_choice')
-    parsed = await parse_and_filter_messages_warehouses(messages, shore, size_choice)
+    parsed = await search_offers('warehouse', warehouse_filter(shore, size_choice))
     if not parsed:
         await message.answer("На жаль, відповідних складів не знайдено.", reply_markup=new_search_keyboard())
         return
-    user_sessions[message.from_user.id] = {'results': parsed, 'page': 0}
+    user_sessions[message.from_user.id] = {
+        'results': parsed,
+        'page': 0,
+        'filter': Subscription.for_warehouses(shore, size_choice),
+    }
     await send_page(message.chat.id, message.from_user.id)
 
 # ----------------- Pagination & Calculator -----------------
@@ -1081,7 +1824,12 @@ async def page_next_handler(callback_query: types.CallbackQuery):
     session = user_sessions.get(callback_query.from_user.id)
     if session and session['page'] < (len(session['results']) - 1) // PAGE_SIZE:
         session['page'] += 1
-        await send_page(callback_query.message.chat.id, callback_query.from_user.id)
+        user_sessions[callback_query.from_user.id] = session
+        await send_page(
+            callback_query.message.chat.id,
+            callback_query.from_user.id,
+            nav_message_id=callback_query.message.message_id,
+        )
 
 
 @router.callback_query(F.data == "page_prev")
@@ -1093,11 +1841,38 @@ async def page_prev_handler(callback_query: types.CallbackQuery):
     session = user_sessions.get(callback_query.from_user.id)
     if session and session['page'] > 0:
         session['page'] -= 1
-        await send_page(callback_query.message.chat.id, callback_query.from_user.id)
+        user_sessions[callback_query.from_user.id] = session
+        await send_page(
+            callback_query.message.chat.id,
+            callback_query.from_user.id,
+            nav_message_id=callback_query.message.message_id,
+        )
 
 
-@router.callback_query(F.data.startswith("calc_"))
-async def calculator_handler(callback_query: types.CallbackQuery):
+def _card_offer(callback_query: types.CallbackQuery) -> Tuple[Optional[Dict[str, Any]], Optional[Offer], Any]:
+    """
+    Оффер карточки, на кнопку которой нажали: из calc_store, а если карточка
+    туда не попала — по id поста из callback_data в результатах сессии.
+    Возвращает (запись calc_store, оффер, клавиатура карточки).
+    """
+    data = calc_store.get((callback_query.message.chat.id, callback_query.message.message_id))
+    if data:
+        return data, data.get("offer"), data.get("reply_markup")
+    try:
+        chan_msg_id = int(callback_query.data.split("_", 1)[1])
+    except Exception:
+        chan_msg_id = None
+    if chan_msg_id:
+        session = user_sessions.get(callback_query.from_user.id)
+        if session:
+            for o in session.get("results", []):
+                if o.msg_id == chan_msg_id:
+                    return None, o, offer_card_keyboard(o.link, o.msg_id)
+    return None, None, None
+
+
+@router.callback_query(F.data.startswith("calc_"))
+async def calculator_handler(callback_query: types.CallbackQuery):
     try:
         await callback_query.answer()
     except Exception:
@@ -1107,33 +1882,14 @@ async def calculator_handler(callback_query: types.CallbackQuery):
     chat_id = callback_query.message.chat.id
     bot_msg_id = callback_query.message.message_id
 
-    data = calc_store.get((chat_id, bot_msg_id))
-    offer = None
-    reply_kb = None
-    has_photo = False
-    if data:
-        offer = data.get("offer")
-        reply_kb = data.get("reply_markup")
-        has_photo = data.get("has_photo", False)
-    else:
-        try:
-            chan_msg_id = int(callback_query.data.split("_", 1)[1])
-        except Exception:
-            chan_msg_id = None
-        if chan_msg_id:
-            session = user_sessions.get(callback_query.from_user.id)
-            if session:
-                for o in session.get("results", []):
-                    if o.get("msg_id") == chan_msg_id:
-                        offer = o
-                        reply_kb = offer_card_keyboard(offer["link"], offer["msg_id"])
-                        break
+    data, offer, reply_kb = _card_offer(callback_query)
+    has_photo = data.get("has_photo", False) if data else False
 
     if not offer:
         await callback_query.message.answer("Помилка: не знайдено даних для калькулятора.")
         return
 
-    monthly_payment = float(offer.get("price_total", 0.0))
+    monthly_payment = float(offer.price_total or 0.0)
     now = datetime.now()
     y, m = now.year, now.month
     days_in_month = calendar.monthrange(y, m)[1]
@@ -1143,7 +1899,7 @@ async def calculator_handler(callback_query: types.CallbackQuery):
     sum_until_month_end = daily * days_left
     guarantee = monthly_payment * 2
 
-    if offer.get("type") == "warehouse":
+    if offer.type == "warehouse":
         commission = monthly_payment * 0.5
     else:
         commission = 0.0
@@ -1164,7 +1920,7 @@ async def calculator_handler(callback_query: types.CallbackQuery):
         f"— ВСЬОГО: {fm(total)}$"
     )
 
-    new_text = offer["text"] + calc_block
+    new_text = offer.caption() + calc_block
 
     try:
         if data and has_photo:
@@ -1188,28 +1944,1116 @@ async def calculator_handler(callback_query: types.CallbackQuery):
         else:
             logger.exception(f"Error editing message for calculator: {e}")
 
-# ----------------- Channel fetching helpers -----------------
-async def fetch_channel_messages(limit=None):
-    await ensure_connected()
-    channel = await telethon_client.get_entity(CHANNEL_OFFICES)
-    msgs = await telethon_client.get_messages(channel, limit=limit)
-    return [(m.message, m.id, m.entities) for m in msgs if m.message]
+
+@router.callback_query(F.data.startswith("full_"))
+async def full_collage_handler(callback_query: types.CallbackQuery):
+    """Коллаж карточки в полном размере — отдельным фото (своя сборка, file_id и Drive-объект)."""
+    _, offer, _ = _card_offer(callback_query)
+    if not offer:
+        await callback_query.answer("Оголошення вже немає в результатах пошуку.", show_alert=True)
+        return
+    try:
+        await callback_query.answer("Готую фото…")
+    except Exception:
+        pass
+
+    chat_id = callback_query.message.chat.id
+    if not _has_collage(offer, "full"):
+        await ensure_collage_and_cache_for_offer(offer_channel(offer), offer, "full")
+    if not _has_collage(offer, "full"):
+        await callback_query.message.answer("У цього оголошення немає фото.")
+        return
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Детальніше ➡️", url=offer.link)]
+    ])
+    await send_offer_card(chat_id, offer, keyboard, variant="full")
+
+# ----------------- Export -----------------
+# пользователи, чей файл сейчас собирается и отправляется (повторное нажатие — игнор)
+exports_in_flight: set = set()
+
+
+@router.callback_query(F.data == "export_csv")
+async def export_handler(callback_query: types.CallbackQuery):
+    """
+    Все подходящие офферы (а не только SEARCH_RESULT_LIMIT из сессии) одним CSV.
+    Строки генерируются во время загрузки файла, документ целиком в памяти не лежит.
+    """
+    user_id = callback_query.from_user.id
+    sub = (user_sessions.get(user_id) or {}).get('filter')
+    if sub is None:
+        text = "Цей пошук застарів — почніть новий."
+    elif user_id in exports_in_flight:
+        text = "Файл уже готується."
+    else:
+        text = "Готуємо файл з усіма результатами..."
+    try:
+        await callback_query.answer(text)
+    except Exception:
+        pass
+    if sub is None or user_id in exports_in_flight:
+        return
+
+    exports_in_flight.add(user_id)
+    try:
+        # холодные каналы дочитываются в индекс; дальше — только фильтр по нему
+        await asyncio.gather(*(get_channel_offers(ch) for ch in channels_of_type(sub.type)))
+        offers = offers_of_type(sub.type)
+        total = sum(1 for offer in offers if sub.matches(offer))
+        if not total:
+            await callback_query.message.answer("На жаль, відповідних варіантів не знайдено.")
+            return
+        stamp = datetime.now().strftime("%Y%m%d-%H%M")
+        document = OfferCsvFile(
+            lambda: filter(sub.matches, offers),
+            filename=f"{'offices' if sub.type == 'office' else 'warehouses'}-{stamp}.csv",
+        )
+        with span("export", offers=total):
+            await bot.send_document(
+                callback_query.message.chat.id,
+                document,
+                caption=f"{sub.describe()}: {total} пропозицій",
+            )
+    finally:
+        exports_in_flight.discard(user_id)
+
+# ----------------- /find: довільні числові діапазони -----------------
+FIND_HELP = (
+    "Пошук за будь-якими діапазонами:\n"
+    "/find size=150..300 total<=4000\n"
+    "/find склад height>=8 power>=100 sort=-size\n\n"
+    "Поля: size (м²), total ($/міс), ppm ($/м²), height (м), power (кВт).\n"
+    "Умови: =, <, <=, >, >=, діапазон a..b; офіс / склад; sort=поле або sort=-поле."
+)
+
+# (версия индекса, задача сборки колонок): один пересбор на смену индекса, сколько бы /find ни пришло
+_offer_columns: Optional[Tuple[Tuple, asyncio.Task]] = None
+
+
+async def get_offer_columns() -> OfferColumns:
+    global _offer_columns
+    # холодные каналы дочитываются в индекс, как при экспорте
+    await asyncio.gather(*(get_channel_offers(ch) for ch in CHANNELS))
+    version = _index_version()
+    if _offer_columns is None or _offer_columns[0] != version:
+        offers = list(merge_offers(*(offers_of_type(t) for t in dict.fromkeys(CHANNELS.values()))))
+        _offer_columns = (version, asyncio.create_task(asyncio.to_thread(OfferColumns, offers)))
+    return await asyncio.shield(_offer_columns[1])
+
+
+@router.message(Command("find"))
+async def find_handler(message: types.Message, command: CommandObject):
+    if not command.args:
+        await message.answer(FIND_HELP)
+        return
+    try:
+        query = parse_find_query(command.args)
+    except ValueError as e:
+        await message.answer(f"{e}\n\n{FIND_HELP}")
+        return
+    if not query.conditions:
+        await message.answer(FIND_HELP)
+        return
+
+    columns = await get_offer_columns()
+    with span("find", offers=len(columns)) as sp:
+        total, found = columns.select(query, SEARCH_RESULT_LIMIT)
+        sp.set("matched", total)
+    if not found:
+        await message.answer("На жаль, відповідних варіантів не знайдено.", reply_markup=new_search_keyboard())
+        return
+    shown = f", показую перші {len(found)}" if total > len(found) else ""
+    await message.answer(f"Знайдено {total} пропозицій{shown}.")
+    user_sessions[message.from_user.id] = {'results': found, 'page': 0}
+    await send_page(message.chat.id, message.from_user.id)
+
+# ----------------- Inline mode -----------------
+inline_memo = QueryMemo(ttl=INLINE_CACHE_TIME)
+
+
+def _index_version():
+    return tuple(sorted((channel, entry[0]) for channel, entry in offer_index.items()))
+
+
+def search_offer_index(query: InlineQuery) -> List[Offer]:
+    """Офферы из индекса всех каналов, подходящие под запрос, по возрастанию price_total."""
+    version = _index_version()
+    found = inline_memo.get(query, version)
+    if found is None:
+        offer_types = [query.type] if query.type else list(dict.fromkeys(CHANNELS.values()))
+        found = [
+            offer for offer in merge_offers(*(offers_of_type(t) for t in offer_types))
+            if query.matches(offer)
+        ]
+        inline_memo.put(query, version, found)
+    return found
+
+
+def inline_result(offer: Offer, result_id: str):
+    """
+    Коллаж по file_id, если Telegram его уже видел, иначе текстовая карточка.
+    Калькулятор в чужом чате недоступен — только ссылка на пост.
+    """
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Детальніше ➡️", url=offer.link)]
+    ])
+    _, file_id = collage_file_id(offer)
+    if file_id:
+        return InlineQueryResultCachedPhoto(
+            id=result_id,
+            photo_file_id=file_id,
+            caption=offer.caption(),
+            reply_markup=keyboard,
+        )
+    size = int(offer.size) if float(offer.size).is_integer() else offer.size
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=offer.bc_name or f"#{offer.msg_id}",
+        description=f"{size}м², {int(offer.price_total):,}$ ({offer.price_per_m2}$/м²)",
+        input_message_content=InputTextMessageContent(message_text=offer.caption()),
+        reply_markup=keyboard,
+    )
 
 
-async def fetch_channel_messages_for(channel_username: str, limit: Optional[int] = None):
+@router.inline_query()
+async def inline_query_handler(inline_query: types.InlineQuery):
+    # индекс, который уже есть, сверяем с общим кэшем; пустой — только запускаем чтение
+    for channel in CHANNEL_PARSERS:
+        if channel in offer_index:
+            await get_channel_offers(channel)
+        else:
+            _refresh_in_background(channel)
+
+    found = search_offer_index(parse_inline_query(inline_query.query))
+    try:
+        offset = int(inline_query.offset or 0)
+    except ValueError:
+        offset = 0
+    end = offset + INLINE_PAGE_SIZE
+    await inline_query.answer(
+        [inline_result(offer, result_id)
+         for result_id, offer in unique_inline_results(found[offset:end], offer_channel)],
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(end) if end < len(found) else "",
+    )
+
+# ----------------- Saved-search subscriptions -----------------
+# Индекс подписок живёт в памяти воркера-лидера синхронизации каналов: он один
+# получает события Telethon о новых постах. Подписки меняют любые воркеры, поэтому
+# индекс сверяется с subscription_meta['version'] и при расхождении перестраивается.
+subscription_index = SubscriptionIndex()
+_subscription_index_version: Optional[int] = None
+push_semaphore = asyncio.Semaphore(PUSH_CONCURRENCY)
+channel_sync_leader = False
+
+
+def sync_subscription_index():
+    global subscription_index, _subscription_index_version
+    version = subscription_meta.get('version')
+    if version == _subscription_index_version:
+        return
+    index = SubscriptionIndex()
+    for user_id, entry in subscriptions.items():
+        for sub in entry.get('items', []):
+            index.add(user_id, sub)
+    subscription_index, _subscription_index_version = index, version
+
+
+def _update_subscriptions(user_id: int, entry: Optional[Dict[str, Any]],
+                          added: Tuple[Subscription, ...] = (), removed: Tuple[Subscription, ...] = ()):
+    """Сохранить подписки пользователя; локальный индекс правится на месте, если он актуален."""
+    global _subscription_index_version
+    previous = subscription_meta.get('version')
+    version = time.time_ns()
+    if entry and entry.get('items'):
+        subscriptions[user_id] = entry
+    else:
+        subscriptions.pop(user_id, None)
+    subscription_meta['version'] = version
+    if previous != _subscription_index_version:
+        return      # индекс уже отстал — перестроится целиком при следующем sync
+    for sub in added:
+        subscription_index.add(user_id, sub)
+    for sub in removed:
+        subscription_index.discard(user_id, sub)
+    _subscription_index_version = version
+
+
+def subscriptions_keyboard(items: List[Subscription]):
+    if not items:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"❌ {i + 1}. {sub.describe()}", callback_data=f"unsub_{i}")]
+        for i, sub in enumerate(items)
+    ])
+
+
+def subscriptions_text(items: List[Subscription]) -> str:
+    if not items:
+        return "У вас немає збережених пошуків."
+    lines = ["🔔 Ваші збережені пошуки (натисніть, щоб видалити):"]
+    lines.extend(f"{i + 1}. {sub.describe()}" for i, sub in enumerate(items))
+    return "\n".join(lines)
+
+
+@router.callback_query(F.data == "subscribe")
+async def subscribe_handler(callback_query: types.CallbackQuery):
+    user_id = callback_query.from_user.id
+    session = user_sessions.get(user_id) or {}
+    sub = session.get('filter')
+    entry = subscriptions.get(user_id) or {'items': []}
+    items = list(entry['items'])
+    if sub is None:
+        text = "Цей пошук застарів — почніть новий."
+    elif sub in items:
+        text = "Ви вже стежите за цим пошуком."
+    elif len(items) >= MAX_SUBSCRIPTIONS_PER_USER:
+        text = f"Можна зберегти не більше {MAX_SUBSCRIPTIONS_PER_USER} пошуків. Видаліть зайві: /subscriptions"
+    else:
+        items.append(sub)
+        _update_subscriptions(user_id, {'chat_id': callback_query.message.chat.id, 'items': items}, added=(sub,))
+        text = "🔔 Пошук збережено — нові пропозиції надішлемо сюди."
+    try:
+        await callback_query.answer(text, show_alert=True)
+    except Exception:
+        pass
+
+
+@router.message(Command("subscriptions"))
+async def subscriptions_handler(message: types.Message):
+    items = (subscriptions.get(message.from_user.id) or {}).get('items', [])
+    await message.answer(subscriptions_text(items), reply_markup=subscriptions_keyboard(items))
+
+
+@router.callback_query(F.data.startswith("unsub_"))
+async def unsubscribe_handler(callback_query: types.CallbackQuery):
+    try:
+        await callback_query.answer()
+    except Exception:
+        pass
+    user_id = callback_query.from_user.id
+    entry = subscriptions.get(user_id) or {'items': []}
+    items = list(entry['items'])
+    try:
+        removed = items.pop(int(callback_query.data.split("_", 1)[1]))
+    except (ValueError, IndexError):
+        removed = None
+    if removed is not None:
+        _update_subscriptions(user_id, {**entry, 'items': items}, removed=(removed,))
+    try:
+        await callback_query.message.edit_text(
+            subscriptions_text(items), reply_markup=subscriptions_keyboard(items)
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.warning(f"Edit of subscriptions list failed: {e}")
+
+
+def _remember_push_card(chat_id, message_id: int):
+    """Пуш-карточки вытесняются как страницы: в calc_store живут только PUSH_CARDS_KEEP последних."""
+    cards = push_cards.get(chat_id, []) + [message_id]
+    for old_id in cards[:-PUSH_CARDS_KEEP]:
+        calc_store.pop((chat_id, old_id), None)
+    push_cards[chat_id] = cards[-PUSH_CARDS_KEEP:]
+
+
+async def push_offer(user_id: int, chat_id, offer: Offer):
+    async with push_semaphore:
+        try:
+            with background_priority():
+                await bot.send_message(chat_id, "🔔 Нова пропозиція за вашим пошуком:")
+                keyboard = offer_card_keyboard(offer.link, offer.msg_id)
+                sent, has_photo = await send_offer_card(chat_id, offer, keyboard)
+            calc_store[(chat_id, sent.message_id)] = {
+                'offer': offer,
+                'has_photo': has_photo,
+                'reply_markup': keyboard
+            }
+            _remember_push_card(chat_id, sent.message_id)
+        except TelegramForbiddenError:
+            # бот заблокирован — подписки больше некому доставлять
+            logger.info(f"Dropping subscriptions of {user_id}: bot blocked")
+            entry = subscriptions.get(user_id) or {}
+            _update_subscriptions(user_id, None, removed=tuple(entry.get('items', ())))
+            for message_id in push_cards.pop(chat_id, []):
+                calc_store.pop((chat_id, message_id), None)
+        except Exception:
+            logger.exception(f"Error pushing offer {offer.msg_id} to {user_id}")
+
+
+async def notify_subscribers(channel_username: str, offers: List[Offer]):
+    """
+    Разослать пост подписчикам. Каждому — одна карточка (самый дешёвый подходящий
+    оффер поста); повторно пост отправляется, только если его текст изменился.
+    """
+    sync_subscription_index()
+    best: Dict[int, Offer] = {}
+    for offer in offers:            # офферы поста по возрастанию price_total
+        for user_id in subscription_index.match(offer):
+            best.setdefault(user_id, offer)
+
+    pushes = []
+    for user_id, offer in best.items():
+        key = (user_id, channel_username, offer.msg_id)
+        sent = subscription_pushes.get(key)
+        if sent and sent[0] == offer.version:
+            continue
+        entry = subscriptions.get(user_id)
+        if not entry:
+            continue
+        subscription_pushes[key] = (offer.version, time.time())
+        pushes.append((user_id, entry['chat_id'], offer))
+    if not pushes:
+        return
+
+    # коллаж общий для всех получателей — собираем один раз до рассылки
+    for offer in {id(offer): offer for _, _, offer in pushes}.values():
+        await ensure_collage_and_cache_for_offer(channel_username, offer)
+    await asyncio.gather(*(push_offer(user_id, chat_id, offer) for user_id, chat_id, offer in pushes))
+
+
+def prune_subscription_pushes():
+    cutoff = time.time() - SUBSCRIPTION_PUSH_TTL
+    for key, (_, sent_at) in list(subscription_pushes.items()):
+        if sent_at < cutoff:
+            subscription_pushes.pop(key, None)
+
+
+def _channel_post_handler(channel_username: str):
+    async def on_channel_post(event):
+        # пост видят все воркеры с Telethon — рассылает только лидер синхронизации
+        if not channel_sync_leader:
+            return
+        message = event.message
+        if not message.message:
+            return
+        with tracer.trace("channel_post", channel=channel_username, msg_id=message.id) as sp:
+            try:
+                offers = CHANNEL_PARSERS[channel_username]([(message.message, message.id, message.entities)])
+                sp.set("offers", len(offers))
+                if offers:
+                    await notify_subscribers(channel_username, offers)
+            except Exception:
+                logger.exception(f"Error handling post {message.id} in {channel_username}")
+    return on_channel_post
+
+
+def register_channel_events(client):
+    for channel_username in CHANNELS:
+        handler = _channel_post_handler(channel_username)
+        client.add_event_handler(handler, events.NewMessage(chats=channel_username))
+        client.add_event_handler(handler, events.MessageEdited(chats=channel_username))
+
+
+# ----------------- Admin: profiling -----------------
+def profile_caches() -> Dict[str, Any]:
+    return {
+        "user_sessions": user_sessions,
+        "calc_store": calc_store,
+        "page_views": page_views,
+        "push_cards": push_cards,
+        "collage_bytes_cache": collage_bytes_cache,
+        "collage_url_cache": collage_url_cache,
+        "collage_file_ids": collage_file_ids,
+        "channel_messages": channel_messages,
+        "offer_index": offer_index,
+        "type_index": type_index,
+    }
+
+
+@router.message(Command("profile"), F.from_user.id.in_(ADMIN_IDS))
+async def profile_handler(message: types.Message, command: CommandObject):
+    """
+    /profile [сек] — сэмплирует поток event loop и присылает folded stacks
+    (flamegraph.pl / speedscope) и сводку: self time, зависания loop, память кэшей.
+    """
     try:
-        await ensure_connected()
-        channel = await telethon_client.get_entity(channel_username)
+        seconds = float(command.args or 10)
+    except ValueError:
+        seconds = 10.0
+    seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+    await message.answer(f"Профілюю {seconds:.0f} с...")
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        # аллокации видны только с этого момента; для полной картины — PYTHONTRACEMALLOC=1
+        tracemalloc.start()
+    sampler = StackSampler(interval=PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    try:
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+        # обход кэшей долгий — не на event loop
+        memory = await asyncio.to_thread(memory_report, profile_caches())
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    self_time = "\n".join(f"{share:6.1%} {label}" for label, share in sampler.top_self())
+    summary = (
+        f"{sampler.total} samples in {seconds:.0f}s\n"
+        f"loop stalls: {stall_monitor.stats()}\n"
+        f"superseded work: {work_stats}\n"
+        f"outbound queue: {outbound.stats()}\n"
+        f"telethon pool: {telethon_pool.stats() if telethon_pool else 'not started'}\n"
+        f"collage pack: {get_collage_pack().stats()}\n\n"
+        f"self time:\n{self_time}\n\n{memory}\n"
+    )
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    await bot.send_document(
+        message.chat.id,
+        BufferedInputFile(sampler.folded().encode("utf-8"), filename=f"profile-{stamp}.folded"),
+        caption=f"{sampler.total} samples, {seconds:.0f}s",
+    )
+    await bot.send_document(
+        message.chat.id,
+        BufferedInputFile(summary.encode("utf-8"), filename=f"profile-{stamp}.txt"),
+    )
+
+# ----------------- Channel fetching helpers -----------------
+async def _read_history(pc, channel_username: str, limit: Optional[int], min_id: int = 0,
+                        offset_id: int = 0):
+    """Сообщения с текстом, id в (min_id, offset_id), от новых к старым."""
+    channel = await telethon_pool.get_peer(pc, channel_username)
+
+    async def _read():
         history = []
-        async for message in telethon_client.iter_messages(channel, limit=limit):
+        albums: Dict[int, List[int]] = {}
+        async for message in pc.client.iter_messages(channel, limit=limit, min_id=min_id, offset_id=offset_id):
+            if traffic_recorder is not None:
+                traffic_recorder.channel_message(channel_username, message)
+            # попутно наполняем общий индекс альбомов — потом не нужно окно в 41 id
+            grouped_id = getattr(message, "grouped_id", None)
+            if grouped_id:
+                albums.setdefault(grouped_id, []).append(message.id)
             text = message.message or ""
             if text:
                 history.append((text, message.id, message.entities))
+        for grouped_id, ids in albums.items():
+            telethon_pool.albums.add(channel_username, grouped_id, ids)
         return history
+
+    with client_span("telethon.history", session=pc.name, channel=channel_username,
+                     min_id=min_id, offset_id=offset_id) as sp:
+        history = await pc.history.run(_read, retry_flood=False)
+        sp.set("messages", len(history))
+    return history
+
+
+async def _latest_message_id(pc, channel_username: str) -> int:
+    channel = await telethon_pool.get_peer(pc, channel_username)
+
+    async def _read():
+        async for message in pc.client.iter_messages(channel, limit=1):
+            return message.id
+        return 0
+
+    return await pc.history.run(_read, retry_flood=False)
+
+
+def backfill_ranges(top_id: int, size: int = BACKFILL_RANGE_SIZE) -> List[Tuple[int, int]]:
+    """
+    Диапазоны [lo, hi] id сообщений, от новых к старым. Границы кратны size,
+    поэтому при возобновлении с большим top_id старые диапазоны совпадают,
+    а меняется только верхний (его hi) — он и перечитывается.
+    """
+    ranges = []
+    for lo in range(1, top_id + 1, size):
+        ranges.append((lo, min(lo + size - 1, top_id)))
+    ranges.reverse()
+    return ranges
+
+
+async def backfill_channel_history(channel_username: str) -> List[Tuple[str, int, Any]]:
+    """
+    Полное чтение канала параллельными диапазонами id вместо одного
+    последовательного iter_messages. Каждый диапазон читается через пул
+    (failover по FloodWait, AIMD-лимитер history клиента) и сразу сохраняется
+    в backfill_chunks; прогресс — в backfill_progress, поэтому после падения
+    процесса читаются только недостающие диапазоны (если прогрессу не больше
+    CHANNEL_HISTORY_TTL, иначе всё заново). Порядок завершения
+    диапазонов не важен: история собирается по плану в конце.
+    """
+    top_id = await telethon_pool.run(lambda pc: _latest_message_id(pc, channel_username))
+    ranges = backfill_ranges(top_id)
+    progress = backfill_progress.get(channel_username)
+    if progress and time.time() - progress.get('started', 0) > CHANNEL_HISTORY_TTL:
+        # прочитанное давно могло измениться (правки, удаления) — читаем заново
+        for lo, hi in progress['done']:
+            backfill_chunks.pop((channel_username, lo, hi), None)
+        progress = None
+    progress = progress or {'top': top_id, 'done': {}, 'started': time.time()}
+    progress['top'] = top_id
+    backfill_progress[channel_username] = progress
+    todo = [r for r in ranges if r not in progress['done']]
+
+    with span("backfill", channel=channel_username, top_id=top_id,
+              ranges=len(ranges), resumed=len(ranges) - len(todo)) as sp:
+        queue = asyncio.Queue()
+        for r in todo:
+            queue.put_nowait(r)
+
+        async def _worker():
+            while not queue.empty():
+                lo, hi = queue.get_nowait()
+                chunk = await telethon_pool.run(
+                    lambda pc: _read_history(pc, channel_username, None, min_id=lo - 1, offset_id=hi + 1)
+                )
+                # в общее состояние — без объектов Telethon: entities плоскими списками
+                backfill_chunks[(channel_username, lo, hi)] = [
+                    (text, msg_id, encode_entities(entities)) for text, msg_id, entities in chunk
+                ]
+                # читаем заново: другие воркеры могли дописать свои диапазоны
+                current = backfill_progress.get(channel_username) or progress
+                current['done'][(lo, hi)] = len(chunk)
+                backfill_progress[channel_username] = current
+
+        results = await asyncio.gather(
+            *(_worker() for _ in range(min(BACKFILL_WORKERS, len(todo)))), return_exceptions=True
+        )
+        # упавший диапазон не теряет остальные: они уже в backfill_chunks, повтор дочитает
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        history: List[Tuple[str, int, Any]] = []
+        for lo, hi in ranges:
+            history.extend(
+                (text, msg_id, decode_entities(entities))
+                for text, msg_id, entities in backfill_chunks.get((channel_username, lo, hi)) or []
+            )
+        sp.set("messages", len(history))
+
+    done = backfill_progress.pop(channel_username, progress)['done']
+    for lo, hi in done:
+        backfill_chunks.pop((channel_username, lo, hi), None)
+    return history
+
+
+# профиль парсера -> генератор офферов; имя профиля совпадает с Offer.type
+PARSER_PROFILES: Dict[str, Callable[..., Iterator[Offer]]] = {
+    'office': iter_offices,
+    'warehouse': iter_warehouses,
+}
+
+
+def _channel_parser(channel_username: str, profile: str) -> Callable[[Any], List[Offer]]:
+    if profile not in PARSER_PROFILES:
+        raise ValueError(f"Unknown parser profile '{profile}' for {channel_username}")
+    parse = PARSER_PROFILES[profile]
+    return lambda messages: sorted(parse(messages, channel_username), key=lambda x: x.price_total)
+
+
+CHANNEL_PARSERS = {ch: _channel_parser(ch, profile) for ch, profile in CHANNELS.items()}
+
+_STREAM_END = object()
+
+
+async def stream_channel_messages(channel_username: str, limit: Optional[int] = None
+                                  ) -> AsyncIterator[Tuple[str, int, Any]]:
+    """
+    (text, id, entities) по мере того, как iter_messages их отдаёт. Чтение идёт
+    в отдельной задаче через ограниченную очередь, так что разбор перекрывается
+    со следующим запросом к Telegram, а в памяти не больше HISTORY_STREAM_BUFFER
+    сообщений. После failover на другой клиент чтение продолжается с последнего id.
+    """
+    await ensure_connected()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=HISTORY_STREAM_BUFFER)
+    cursor = {'offset_id': 0, 'read': 0}
+
+    async def _produce(pc):
+        channel = await telethon_pool.get_peer(pc, channel_username)
+
+        async def _read():
+            remaining = None if limit is None else limit - cursor['read']
+            async for message in pc.client.iter_messages(
+                channel, limit=remaining, offset_id=cursor['offset_id']
+            ):
+                cursor['offset_id'] = message.id
+                if traffic_recorder is not None:
+                    traffic_recorder.channel_message(channel_username, message)
+                cursor['read'] += 1
+                grouped_id = getattr(message, "grouped_id", None)
+                if grouped_id:
+                    telethon_pool.albums.add(channel_username, grouped_id, [message.id])
+                if message.message:
+                    await queue.put((message.message, message.id, message.entities))
+
+        await pc.history.run(_read, retry_flood=False)
+
+    async def _pump():
+        try:
+            await telethon_pool.run(_produce)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(_STREAM_END)
+
+    producer = asyncio.create_task(_pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
+
+async def stream_channel_offers(channel_username: str) -> AsyncIterator[Offer]:
+    parse = PARSER_PROFILES[CHANNELS[channel_username]]
+    async for item in stream_channel_messages(channel_username):
+        for offer in parse((item,), channel_username):
+            yield offer
+
+
+async def top_k_offers(offers: AsyncIterator[Offer], matches: Callable[[Offer], bool], k: int) -> List[Offer]:
+    """k самых дешёвых подходящих офферов: max-heap по price_total размером не больше k."""
+    heap: List[Tuple[float, int, Offer]] = []
+    seq = 0
+    async for offer in offers:
+        if not matches(offer):
+            continue
+        seq += 1
+        # при равной цене остаётся встреченный раньше — как при стабильной сортировке
+        item = (-offer.price_total, -seq, offer)
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return [offer for _, _, offer in sorted(heap, key=lambda x: (-x[0], -x[1]))]
+
+
+async def _stream_top_k(channel_username: str, matches: Callable[[Offer], bool], k: int) -> List[Offer]:
+    try:
+        with span("search.stream", channel=channel_username, k=k) as sp:
+            found = await top_k_offers(stream_channel_offers(channel_username), matches, k)
+            sp.set("offers", len(found))
+            return found
     except Exception as e:
-        logger.exception(f"Error fetching messages from {channel_username}: {e}")
+        logger.exception(f"Error streaming messages from {channel_username}: {e}")
         return []
 
+
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _index_channel(channel_username: str, entry) -> List[Offer]:
+    ts, history = entry
+    with span("parse", channel=channel_username, messages=len(history)) as sp:
+        offers = CHANNEL_PARSERS[channel_username](history)
+        sp.set("offers", len(offers))
+    offer_index[channel_username] = (ts, offers)
+    return offers
+
+
+def read_channel_history(channel_username: str) -> Optional[Tuple[float, List[Tuple[str, int, Any]]]]:
+    """(время чтения, [(text, id, entities)] от новых к старым) из общего состояния."""
+    ts = channel_history_ts.get(channel_username)
+    if ts is None:
+        return None
+    ids = sorted((msg_id for channel, msg_id in channel_messages if channel == channel_username), reverse=True)
+    history = []
+    for msg_id in ids:
+        stored = channel_messages.get((channel_username, msg_id))
+        if stored is not None:
+            history.append((stored[0], msg_id, decode_entities(stored[1])))
+    return ts, history
+
+
+def write_channel_history(channel_username: str, history: List[Tuple[str, int, Any]],
+                          ts: float, complete: bool):
+    """
+    Записать сообщения канала; неизменённые не переписываются. complete=True —
+    history это весь канал, остальные его сообщения удалены из Telegram.
+    """
+    ids = set()
+    for text, msg_id, entities in history:
+        ids.add(msg_id)
+        value = (text, encode_entities(entities))
+        if channel_messages.get((channel_username, msg_id)) != value:
+            channel_messages[(channel_username, msg_id)] = value
+    if complete:
+        for key in [key for key in channel_messages if key[0] == channel_username and key[1] not in ids]:
+            channel_messages.pop(key, None)
+    channel_history_ts[channel_username] = ts
+
+
+async def refresh_channel_history(channel_username: str, full: bool = False):
+    """
+    Перечитать канал. Если история уже есть, читаются только сообщения новее
+    курсора канала; full=True перечитывает всё (подхватывает правки и удаления).
+    """
+    await ensure_connected()
+    cursor = channel_cursors.get(channel_username, 0)
+    known = channel_username in channel_history_ts
+    if full or not known or not cursor:
+        history = await backfill_channel_history(channel_username)
+        complete = True
+    else:
+        fresh = await telethon_pool.run(lambda pc: _read_history(pc, channel_username, None, min_id=cursor))
+        indexed = offer_index.get(channel_username)
+        if not fresh and indexed and indexed[0] == channel_history_ts.get(channel_username):
+            # новых сообщений нет — индекс остаётся, обновляется только время
+            ts = time.time()
+            channel_history_ts[channel_username] = ts
+            offer_index[channel_username] = (ts, indexed[1])
+            return
+        previous = read_channel_history(channel_username) or (0.0, [])
+        fresh_ids = {msg_id for _, msg_id, _ in fresh}
+        # iter_messages отдаёт от новых к старым — новые сообщения идут в начало
+        history = fresh + [item for item in previous[1] if item[1] not in fresh_ids]
+        complete = False
+    if history:
+        channel_cursors[channel_username] = max(cursor, max(msg_id for _, msg_id, _ in history))
+    entry = (time.time(), history)
+    write_channel_history(channel_username, history if complete else fresh, entry[0], complete)
+    _index_channel(channel_username, entry)
+
+
+async def _refresh_channel_safely(channel_username: str):
+    try:
+        await refresh_channel_history(channel_username)
+    except Exception as e:
+        logger.exception(f"Error fetching messages from {channel_username}: {e}")
+
+
+def _refresh_in_background(channel_username: str):
+    task = _refresh_tasks.get(channel_username)
+    if task is None or task.done():
+        _refresh_tasks[channel_username] = asyncio.create_task(_refresh_channel_safely(channel_username))
+
+
+async def get_channel_offers(channel_username: str) -> List[Offer]:
+    """
+    Разобранные офферы канала (без фильтров, по возрастанию price_total).
+    История берётся из общего кэша; если он устарел, а индекс уже есть
+    (в т.ч. из снапшота) — отвечаем индексом сразу и перечитываем канал в фоне.
+    """
+    ts = channel_history_ts.get(channel_username)
+    indexed = offer_index.get(channel_username)
+    if ts is None or time.time() - ts >= CHANNEL_HISTORY_TTL:
+        if indexed:
+            _refresh_in_background(channel_username)
+            return indexed[1]
+        await _refresh_channel_safely(channel_username)
+        ts = channel_history_ts.get(channel_username)
+        indexed = offer_index.get(channel_username)
+        if ts is None:
+            return indexed[1] if indexed else []
+
+    if indexed and indexed[0] == ts:
+        return indexed[1]
+    # историю обновил другой воркер — переразбираем её локально
+    entry = read_channel_history(channel_username)
+    if not entry:
+        return indexed[1] if indexed else []
+    return _index_channel(channel_username, entry)
+
+
+def channels_of_type(offer_type: str) -> List[str]:
+    return [ch for ch, profile in CHANNELS.items() if profile == offer_type]
+
+
+def offer_identity(offer: Offer) -> Tuple:
+    # один и тот же оффер часто публикуют несколько агентств (в разных каналах)
+    return offer.type, (offer.bc_name or '').casefold(), offer.size, offer.price_total
+
+
+def merge_offers(*sorted_offers) -> Iterator[Offer]:
+    """
+    Слить отсортированные по price_total списки без дублей между каналами. При
+    равной цене heapq.merge сохраняет порядок аргументов, так что остаётся оффер
+    канала, который идёт раньше в CHANNELS. Офферы одного канала не склеиваются
+    никогда: одинаковые БЦ, площадь и цена там — это разные этажи или посты.
+    """
+    # identity -> канал, чей оффер уже выдан
+    seen: Dict[Tuple, str] = {}
+    for offer in heapq.merge(*sorted_offers, key=lambda o: o.price_total):
+        channel = offer_channel(offer)
+        if seen.setdefault(offer_identity(offer), channel) != channel:
+            continue
+        yield offer
+
+
+def offers_of_type(offer_type: str) -> List[Offer]:
+    """Объединённый индекс всех каналов типа; пересобирается, только когда меняется индекс канала."""
+    channels = [ch for ch in channels_of_type(offer_type) if ch in offer_index]
+    version = tuple((ch, offer_index[ch][0]) for ch in channels)
+    cached = type_index.get(offer_type)
+    if cached and cached[0] == version:
+        return cached[1]
+    offers = list(merge_offers(*(offer_index[ch][1] for ch in channels)))
+    type_index[offer_type] = (version, offers)
+    return offers
+
+
+async def search_offers(offer_type: str, matches: Callable[[Offer], bool],
+                        k: int = SEARCH_RESULT_LIMIT) -> List[Offer]:
+    """
+    Не больше k самых дешёвых подходящих офферов по всем каналам типа.
+    Каналы с индексом или общим кэшем истории отвечают из объединённого индекса.
+    Каналы без них (холодный старт) разбираются потоком в top-k параллельно,
+    не держа всю историю; полный индекс построит channel_sync_loop.
+    Ошибка одного канала не мешает остальным.
+    """
+    channels = channels_of_type(offer_type)
+    warm = [ch for ch in channels if ch in offer_index or ch in channel_history_ts]
+    cold = [ch for ch in channels if ch not in warm]
+    await asyncio.gather(*(get_channel_offers(ch) for ch in warm))
+    found = list(itertools.islice(filter(matches, offers_of_type(offer_type)), k))
+    if not cold:
+        return found
+    streamed = await asyncio.gather(*(_stream_top_k(ch, matches, k) for ch in cold))
+    return list(itertools.islice(merge_offers(found, *streamed), k))
+
+
+async def sync_all_channels(full: bool = False):
+    """Все каналы параллельно; упавший канал только логируется."""
+    channels = list(CHANNELS)
+    results = await asyncio.gather(
+        *(refresh_channel_history(ch, full=full) for ch in channels),
+        return_exceptions=True,
+    )
+    for channel_username, result in zip(channels, results):
+        if isinstance(result, Exception):
+            logger.error(f"Channel sync failed for {channel_username}: {result!r}")
+
+# ----------------- Index snapshot (cold start) -----------------
+_snapshot_signature = None
+
+
+def load_index_snapshot():
+    """
+    Поднять индекс из снапшота: поиск отвечает сразу после старта,
+    а channel_sync_loop сверяет его с каналом в фоне.
+    """
+    snap = load_snapshot(SNAPSHOT_FILE)
+    if snap is None:
+        return
+    try:
+        for channel_username, (ts, rows) in snap.section("offer_rows", {}).items():
+            if channel_username in CHANNEL_PARSERS and channel_username not in offer_index:
+                offers = [Offer.from_row(row) for row in rows]
+                for offer in offers:
+                    offer.channel = offer.channel or channel_username
+                offer_index[channel_username] = (ts, offers)
+        for channel_username, grouped_id, ids in snap.section("albums", []):
+            telethon_pool.albums.add(channel_username, grouped_id, ids)
+        for slug, file_id in snap.section("file_ids", {}).items():
+            if slug not in collage_file_ids:
+                collage_file_ids[slug] = file_id
+        meta = snap.section("meta", {})
+        for slug, url in meta.get("collage_url_cache", {}).items():
+            if slug not in collage_url_cache:
+                collage_url_cache[slug] = url
+        logger.info(f"Index snapshot loaded: {sum(len(v[1]) for v in offer_index.values())} offers")
+    except Exception:
+        logger.exception("Ошибка чтения снапшота индекса")
+    finally:
+        snap.close()
+
+
+async def write_index_snapshot():
+    global _snapshot_signature
+    signature = (
+        tuple(sorted((ch, ts) for ch, (ts, _) in offer_index.items())),
+        len(telethon_pool.albums),
+        len(collage_file_ids),
+        len(collage_url_cache),
+    )
+    if signature == _snapshot_signature:
+        return
+    sections = {
+        "offer_rows": {
+            ch: (ts, [offer.to_row() for offer in offers])
+            for ch, (ts, offers) in offer_index.items()
+        },
+        "albums": [(ch, gid, ids) for (ch, gid), ids in telethon_pool.albums.items()],
+        "file_ids": dict(collage_file_ids),
+        "meta": {
+            "created": time.time(),
+            "worker": WORKER_ID,
+            "collage_url_cache": dict(collage_url_cache),
+        },
+    }
+    await asyncio.to_thread(write_snapshot, SNAPSHOT_FILE, sections)
+    _snapshot_signature = signature
+
+
+async def snapshot_loop():
+    # снапшот пишет только лидер синхронизации каналов — у него самый свежий индекс
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        # pack коллажей у каждого воркера свой
+        try:
+            await maintain_collage_pack()
+        except Exception:
+            logger.exception("Ошибка обслуживания pack-файла коллажей")
+        if await state_backend.acquire_lease_async("channel-sync", WORKER_ID, CHANNEL_SYNC_INTERVAL * 2):
+            try:
+                await write_index_snapshot()
+            except Exception:
+                logger.exception("Ошибка записи снапшота индекса")
+
+# ----------------- Workers: sharding & leader election -----------------
+def shard_of(user_id: int) -> int:
+    return user_id % WORKER_COUNT
+
+
+@dp.update.outer_middleware()
+async def shard_router_middleware(handler, event: types.Update, data: Dict[str, Any]):
+    """
+    Апдейт чужого шарда не обрабатываем, а кладём в очередь его воркера:
+    вся переписка одного пользователя идёт через один процесс.
+    """
+    user = data.get("event_from_user")
+    if WORKER_COUNT > 1 and user is not None:
+        shard = shard_of(user.id)
+        if shard != WORKER_INDEX:
+            await state_backend.push_update_async(shard, event.model_dump_json(exclude_unset=True))
+            return None
+    return await handler(event, data)
+
+
+async def consume_shard_updates():
+    while True:
+        try:
+            payloads = await state_backend.pop_updates_async(WORKER_INDEX)
+        except Exception:
+            logger.exception("Error reading shard updates")
+            payloads = []
+        if not payloads:
+            await asyncio.sleep(0.2)
+            continue
+        for payload in payloads:
+            try:
+                update = types.Update.model_validate_json(payload, context={"bot": bot})
+            except Exception:
+                logger.exception("Broken update in shard queue")
+                continue
+            asyncio.create_task(dp.feed_update(bot, update))
+
+
+async def channel_sync_loop():
+    # один лидер на все воркеры перечитывает каналы и кладёт историю в общий кэш;
+    # обычно только новые сообщения, раз в CHANNEL_FULL_SYNC_EVERY кругов — целиком
+    global channel_sync_leader
+    sync_round = 0
+    while True:
+        channel_sync_leader = await state_backend.acquire_lease_async("channel-sync", WORKER_ID, CHANNEL_SYNC_INTERVAL * 2)
+        if channel_sync_leader:
+            full = sync_round % CHANNEL_FULL_SYNC_EVERY == 0
+            with tracer.trace("channel_sync", full=full):
+                await sync_all_channels(full=full)
+            if full:
+                prune_subscription_pushes()
+            sync_round += 1
+        await asyncio.sleep(CHANNEL_SYNC_INTERVAL)
+
+
+async def leader_polling():
+    # getUpdates может вызывать только один процесс — он и держит lease "poller"
+    while True:
+        if not await state_backend.acquire_lease_async("poller", WORKER_ID, LEASE_TTL):
+            await asyncio.sleep(LEASE_TTL / 3)
+            continue
+
+        lost = asyncio.Event()
+
+        async def _renew():
+            while True:
+                await asyncio.sleep(LEASE_TTL / 3)
+                if not await state_backend.acquire_lease_async("poller", WORKER_ID, LEASE_TTL):
+                    logger.warning("Poller lease lost, stopping polling")
+                    lost.set()
+                    try:
+                        await dp.stop_polling()
+                    except RuntimeError:
+                        pass
+                    return
+
+        renew_task = asyncio.create_task(_renew())
+        try:
+            await safe_polling(keep_running=lambda: not lost.is_set())
+        finally:
+            renew_task.cancel()
+
+async def release_leases():
+    """При остановке отдать lease'ы сразу, не ждать их истечения, и дописать общее состояние."""
+    for name in ("poller", "channel-sync"):
+        try:
+            await state_backend.release_lease_async(name, WORKER_ID)
+        except Exception:
+            logger.exception(f"Failed to release lease {name}")
+    await asyncio.to_thread(state_backend.flush)
+
+
+def describe_update(update: types.Update) -> str:
+    if update.message:
+        return f"message {update.message.text!r}"[:64]
+    if update.callback_query:
+        return f"callback {update.callback_query.data}"
+    return update.event_type
+
+
+@dp.update.outer_middleware()
+async def recording_middleware(handler, event: types.Update, data: Dict[str, Any]):
+    if traffic_recorder is not None:
+        traffic_recorder.update(event)
+    return await handler(event, data)
+
+
+@dp.update.outer_middleware()
+async def tracing_middleware(handler, event: types.Update, data: Dict[str, Any]):
+    user = data.get("event_from_user")
+    attributes = {"update_id": event.update_id, "event": describe_update(event)}
+    if user is not None:
+        attributes["user_id"] = user.id
+    with tracer.trace("update", **attributes):
+        return await handler(event, data)
+
+
+@dp.update.outer_middleware()
+async def task_name_middleware(handler, event: types.Update, data: Dict[str, Any]):
+    # имя задачи попадает в лог LoopStallMonitor — видно, какой апдейт держит loop
+    task = asyncio.current_task()
+    if task is None:
+        return await handler(event, data)
+    previous = task.get_name()
+    task.set_name(f"update {event.update_id} {describe_update(event)}")
+    try:
+        return await handler(event, data)
+    finally:
+        task.set_name(previous)
+
+
+@dp.update.outer_middleware()
+async def startup_timing_middleware(handler, event: types.Update, data: Dict[str, Any]):
+    result = await handler(event, data)
+    if not startup_timer.reported:
+        startup_timer.reported = True
+        startup_timer.mark("first_update")
+        logger.warning(f"Startup timing: {startup_timer.report()}")
+    return result
+
+
+@dp.startup()
+async def on_polling_started():
+    if "polling" in startup_timer.marks:
+        return
+    startup_timer.mark("polling")
+    # Drive (discovery + refresh токена) — уже после старта поллинга, в фоне
+    if USE_DRIVE:
+        asyncio.create_task(asyncio.to_thread(warm_up_drive))
+
 # ----------------- Startup -----------------
 # async def run_bot():
 #     await telethon_client.start()
@@ -1225,10 +3069,10 @@ async def fetch_channel_messages_for(channel_username: str, limit: Optional[int]
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def safe_polling():
+async def safe_polling(keep_running=lambda: True):
     delay = 1
 
-    while True:
+    while keep_running():
         try:
             logger.info("Starting polling...")
             await dp.start_polling(
@@ -1246,14 +3090,33 @@ async def safe_polling():
 
 
 async def run_bot():
-    # Telethon client
-    await telethon_client.start()
-
-    # Run Telethon in background
-    asyncio.create_task(telethon_client.run_until_disconnected())
-
-    # Start Telegram bot polling
-    await safe_polling()
+    global _telethon_started, traffic_recorder
+
+    stall_monitor.start()
+    if RECORD_FILE:
+        traffic_recorder = TrafficRecorder(RECORD_FILE, CHANNELS, RECORD_SALT)
+    create_bot()
+    create_telethon_pool()
+    load_url_cache()
+    # pack коллажей: восстановление индекса (дочитывание хвоста) — не на event loop
+    await asyncio.to_thread(get_collage_pack)
+    # индекс из снапшота — до Telethon и поллинга, чтобы первый поиск не ждал канал
+    load_index_snapshot()
+    startup_timer.mark("session_load")
+
+    # Telethon clients — в фоне, поллинг стартует сразу
+    _telethon_started = asyncio.create_task(start_telethon())
+
+    asyncio.create_task(channel_sync_loop())
+    asyncio.create_task(snapshot_loop())
+    if WORKER_COUNT > 1:
+        asyncio.create_task(consume_shard_updates())
+
+    # Start Telegram bot polling (только на воркере-лидере)
+    try:
+        await leader_polling()
+    finally:
+        await release_leases()
 
 
 if __name__ == "__main__":
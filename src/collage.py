@@ -0,0 +1,99 @@
+# collage.py — сборка коллажа 1–3 фото и JPEG-кодирование
+#
+# Быстрый путь:
+#   * JPEG декодируется в draft-режиме сразу в 1/2, 1/4 или 1/8 — ближайший
+#     масштаб, который ещё не меньше плитки (полное разрешение не нужно);
+#   * кадрирование «cover» задаётся box'ом в resize(), т.е. ресемплится только
+#     видимая часть, а reducing_gap сначала делает дешёвый целочисленный reduce();
+#   * параметры энкодера вынесены в профиль (см. bench_collage.py).
+
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+# quality / optimize / progressive / subsampling (0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0)
+DEFAULT_ENCODER: Dict[str, Any] = {
+    "quality": 85,
+    "optimize": False,
+    "progressive": False,
+    "subsampling": 2,
+}
+
+REDUCING_GAP = 2.0
+
+
+def collage_tiles(n: int, width: int, height: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Плитки (x, y, w, h): 1 фото — на всё поле, 2 — пополам,
+    3 — большое слева и два друг над другом справа.
+    """
+    if n <= 1:
+        return [(0, 0, width, height)]
+    left_w = width // 2
+    right_w = width - left_w
+    if n == 2:
+        return [(0, 0, left_w, height), (left_w, 0, right_w, height)]
+    half_h = height // 2
+    return [
+        (0, 0, left_w, height),
+        (left_w, 0, right_w, half_h),
+        (left_w, half_h, right_w, height - half_h),
+    ]
+
+
+def decode_for_tile(data: bytes, tw: int, th: int) -> Image.Image:
+    img = Image.open(BytesIO(data))
+    # для JPEG: DCT-масштабирование при декодировании, результат >= (tw, th)
+    img.draft("RGB", (tw, th))
+    return img.convert("RGB")
+
+
+def fit_cover(img: Image.Image, tw: int, th: int) -> Image.Image:
+    w, h = img.size
+    if w == 0 or h == 0:
+        return img
+    scale = max(tw / w, th / h)
+    cw, ch = tw / scale, th / scale
+    left = (w - cw) / 2
+    top = (h - ch) / 2
+    return img.resize(
+        (tw, th),
+        Image.LANCZOS,
+        box=(left, top, left + cw, top + ch),
+        reducing_gap=REDUCING_GAP,
+    )
+
+
+def encode_jpeg(img: Image.Image, encoder: Optional[Dict[str, Any]] = None) -> bytes:
+    params = dict(DEFAULT_ENCODER)
+    if encoder:
+        params.update(encoder)
+    out = BytesIO()
+    img.save(out, format="JPEG", **params)
+    return out.getvalue()
+
+
+def compose_collage(images_bytes: List[bytes], width: int, height: int) -> Image.Image:
+    n = min(3, len(images_bytes))
+    collage = Image.new("RGB", (width, height))
+    for data, (x, y, tw, th) in zip(images_bytes[:n], collage_tiles(n, width, height)):
+        tile = fit_cover(decode_for_tile(data, tw, th), tw, th)
+        collage.paste(tile, (x, y))
+    return collage
+
+
+def render_collage(
+    images_bytes: List[bytes],
+    width: int,
+    height: int,
+    encoder: Optional[Dict[str, Any]] = None,
+) -> Optional[bytes]:
+    if not images_bytes:
+        return None
+    return encode_jpeg(compose_collage(images_bytes, width, height), encoder)
+
+
+def render_blank(width: int, height: int, color: Tuple[int, int, int] = (236, 236, 236)) -> bytes:
+    """Однотонная заглушка для пустых карточек."""
+    return encode_jpeg(Image.new("RGB", (width, height), color))
@@ -0,0 +1,363 @@
+# collage_pack.py — локальное хранилище коллажей одним pack-файлом
+#
+# Формат pack-файла:
+#   magic (8 байт) | generation (u64)
+#   записи подряд: magic (u32) | длина ключа (u16) | длина данных (u32) | crc32 ключа+данных (u32)
+#                  | ключ (utf-8) | данные
+# Запись с длиной данных 0 — удаление ключа. Файл только дописывается; живая
+# версия ключа — последняя. Чтение — через mmap, get() отдаёт memoryview без копии.
+#
+# Индекс (path + ".idx"): magic | crc32 (u32) | marshal {generation, end, entries}.
+# Пишется атомарно (tmp, fsync, os.replace) после fsync самого pack'а, поэтому
+# никогда не ссылается на непрочитанное с диска. При открытии индекс
+# дочитывается сканированием записей от его end; битый хвост (падение посреди
+# записи) отрезается. Индекс от другой generation (падение во время compact)
+# игнорируется — тогда сканируется весь файл.
+#
+# compact() переписывает живые записи в новый файл без блокировки читателей:
+# под lock'ом только снимок индекса и докопирование хвоста, дописанного за время
+# копирования. Старые memoryview остаются валидными — старый mmap живёт, пока на
+# него есть ссылки.
+
+import logging
+import marshal
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from aiogram.types import InputFile
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KORPACK\x01"
+INDEX_MAGIC = b"KORPIDX\x01"
+_HEADER = struct.Struct("<8sQ")
+_RECORD = struct.Struct("<IHII")
+_RECORD_MAGIC = 0xC011A6E5
+_INDEX_HEADER = struct.Struct("<8sI")
+
+
+def _record_size(key: bytes, length: int) -> int:
+    return _RECORD.size + len(key) + length
+
+
+def _iter_records(buf, start: int, end: int) -> Iterator[Tuple[str, int, int, int]]:
+    """(ключ, offset данных, длина, конец записи) для целых записей с верным crc."""
+    pos = start
+    while pos + _RECORD.size <= end:
+        magic, key_len, length, crc = _RECORD.unpack_from(buf, pos)
+        key_start = pos + _RECORD.size
+        data_start = key_start + key_len
+        record_end = data_start + length
+        if magic != _RECORD_MAGIC or record_end > end:
+            return
+        with memoryview(buf)[key_start:record_end] as view:
+            if zlib.crc32(view) != crc:
+                return
+            key = bytes(view[:key_len]).decode("utf-8")
+        yield key, data_start, length, record_end
+        pos = record_end
+
+
+class CollagePack:
+    def __init__(self, path: str, index_every: int = 64):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.index_every = index_every
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._mm: Optional[mmap.mmap] = None
+        self._end = 0
+        self._dead = 0
+        self._unsaved = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.compactions = 0
+        self.recovered_bytes = 0
+        self._open()
+
+    # --- открытие и восстановление ---
+    def _open(self):
+        try:
+            os.remove(self.path + ".compact")     # недописанный compact
+        except FileNotFoundError:
+            pass
+        self._file = open(self.path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        header = b""
+        if size >= _HEADER.size:
+            self._file.seek(0)
+            header = self._file.read(_HEADER.size)
+        if not header or _HEADER.unpack(header)[0] != MAGIC:
+            if size:
+                logger.warning(f"Collage pack {self.path} has no valid header, starting empty")
+            self._reset(int.from_bytes(os.urandom(8), "little"))
+            return
+        self._generation = _HEADER.unpack(header)[1]
+        self._end = size
+
+        start = _HEADER.size
+        loaded = self._load_index(size)
+        if loaded is not None:
+            self._index, start = loaded
+        valid_end = self._scan(start, size)
+        if valid_end < size:
+            self.recovered_bytes = size - valid_end
+            logger.warning(f"Collage pack {self.path}: truncating {size - valid_end} bytes of torn tail")
+            self._file.truncate(valid_end)
+            self._end = valid_end
+        self._dead = self._end - _HEADER.size - sum(
+            _record_size(key.encode("utf-8"), length) for key, (_, length) in self._index.items()
+        )
+        if start != self._end:
+            self._save_index_locked()
+
+    def _reset(self, generation: int):
+        self._file.truncate(0)
+        self._file.write(_HEADER.pack(MAGIC, generation))
+        self._file.flush()
+        self._generation = generation
+        self._index = {}
+        self._end = _HEADER.size
+        self._mm = None
+        self._save_index_locked()
+
+    def _load_index(self, size: int) -> Optional[Tuple[Dict[str, Tuple[int, int]], int]]:
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+            magic, crc = _INDEX_HEADER.unpack_from(raw, 0)
+            payload = raw[_INDEX_HEADER.size:]
+            if magic != INDEX_MAGIC or zlib.crc32(payload) != crc:
+                raise ValueError("bad index")
+            state = marshal.loads(payload)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Collage pack index {self.index_path} ignored: {e}")
+            return None
+        if state.get("generation") != self._generation or state.get("end", size + 1) > size:
+            return None
+        return dict(state["entries"]), state["end"]
+
+    def _scan(self, start: int, end: int) -> int:
+        if start >= end:
+            return start
+        mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            valid_end = start
+            for key, offset, length, record_end in _iter_records(mm, start, end):
+                if length:
+                    self._index[key] = (offset, length)
+                else:
+                    self._index.pop(key, None)
+                valid_end = record_end
+            return valid_end
+        finally:
+            mm.close()
+
+    def _save_index_locked(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        payload = marshal.dumps({"generation": self._generation, "end": self._end, "entries": self._index})
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_INDEX_HEADER.pack(INDEX_MAGIC, zlib.crc32(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        self._unsaved = 0
+
+    # --- чтение / запись ---
+    def _mapping(self, need: int) -> mmap.mmap:
+        # старый mmap не закрываем: на него могут ссылаться выданные memoryview
+        if self._mm is None or len(self._mm) < need:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[memoryview]:
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                self.misses += 1
+                return None
+            offset, length = location
+            self.hits += 1
+            return memoryview(self._mapping(offset + length))[offset:offset + length]
+
+    def _append_locked(self, key: str, data) -> int:
+        raw_key = key.encode("utf-8")
+        old = self._index.get(key)
+        crc = zlib.crc32(data, zlib.crc32(raw_key))
+        self._file.write(_RECORD.pack(_RECORD_MAGIC, len(raw_key), len(data), crc))
+        self._file.write(raw_key)
+        self._file.write(data)
+        self._file.flush()
+        offset = self._end + _RECORD.size + len(raw_key)
+        self._end += _record_size(raw_key, len(data))
+        if old is not None:
+            self._dead += _record_size(raw_key, old[1])
+        if data:
+            self._index[key] = (offset, len(data))
+        else:
+            self._dead += _record_size(raw_key, 0)
+            self._index.pop(key, None)
+        self._unsaved += 1
+        if self._unsaved >= self.index_every:
+            self._save_index_locked()
+        return offset
+
+    def put(self, key: str, data) -> memoryview:
+        """Дописать коллаж; возвращает memoryview уже из pack'а (байты можно отпустить)."""
+        if not len(data):
+            raise ValueError("Empty collage")
+        with self._lock:
+            offset = self._append_locked(key, data)
+            return memoryview(self._mapping(offset + len(data)))[offset:offset + len(data)]
+
+    def discard(self, key: str):
+        with self._lock:
+            if key not in self._index:
+                return
+            self._append_locked(key, b"")
+
+    def flush(self):
+        with self._lock:
+            if self._unsaved:
+                self._save_index_locked()
+
+    def import_files(self, directory: str, suffix: str = ".jpg") -> int:
+        """
+        Перенести коллажи старого формата (directory/<ключ>.jpg) в pack и удалить
+        файлы. Уже лежащие в pack ключи не перезаписываются. Возвращает число
+        перенесённых.
+        """
+        imported = 0
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(directory, name)
+            key = name[:-len(suffix)]
+            try:
+                if key not in self:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    if data:
+                        self.put(key, data)
+                        imported += 1
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Collage {path} not imported: {e}")
+        if imported:
+            self.flush()
+        return imported
+
+    # --- compaction ---
+    def dead_bytes(self, keep: Optional[Callable[[str], bool]] = None) -> int:
+        with self._lock:
+            dead = self._dead
+            if keep is not None:
+                dead += sum(
+                    _record_size(key.encode("utf-8"), length)
+                    for key, (_, length) in self._index.items() if not keep(key)
+                )
+            return dead
+
+    def maybe_compact(self, min_dead: int, ratio: float, keep: Optional[Callable[[str], bool]] = None) -> bool:
+        dead = self.dead_bytes(keep)
+        if dead < min_dead or dead < self._end * ratio:
+            return False
+        self.compact(keep)
+        return True
+
+    def compact(self, keep: Optional[Callable[[str], bool]] = None):
+        """Переписать живые записи (и прошедшие keep) в новый файл и подменить им pack."""
+        with self._lock:
+            live = [(key, location) for key, location in self._index.items() if keep is None or keep(key)]
+            snapshot_end = self._end
+            mm = self._mapping(snapshot_end)
+
+        generation = int.from_bytes(os.urandom(8), "little")
+        tmp_path = self.path + ".compact"
+        index: Dict[str, Tuple[int, int]] = {}
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, generation))
+            pos = _HEADER.size
+            for key, (offset, length) in live:
+                # запись целиком, с заголовком и crc — без пересчёта
+                record_start = offset - len(key.encode("utf-8")) - _RECORD.size
+                f.write(mm[record_start:offset + length])
+                index[key] = (pos + offset - record_start, length)
+                pos += offset + length - record_start
+            f.flush()
+            os.fsync(f.fileno())
+
+            with self._lock:
+                # дописанное, пока копировали, переносим как есть
+                tail_end = self._end
+                if tail_end > snapshot_end:
+                    mm = self._mapping(tail_end)
+                    f.write(mm[snapshot_end:tail_end])
+                    shift = pos - snapshot_end
+                    for key, offset, length, _ in _iter_records(mm, snapshot_end, tail_end):
+                        if length:
+                            index[key] = (offset + shift, length)
+                        else:
+                            index.pop(key, None)
+                    pos += tail_end - snapshot_end
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self._file.close()
+                self._file = open(self.path, "a+b")
+                self._mm = None
+                self._generation = generation
+                self._index = index
+                self._end = pos
+                self._dead = pos - _HEADER.size - sum(
+                    _record_size(key.encode("utf-8"), length) for key, (_, length) in index.items()
+                )
+                self._save_index_locked()
+                self.compactions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._index),
+            "bytes": self._end,
+            "dead_bytes": self._dead,
+            "hits": self.hits,
+            "misses": self.misses,
+            "compactions": self.compactions,
+            "recovered_bytes": self.recovered_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._unsaved:
+                self._save_index_locked()
+            self._mm = None
+            self._file.close()
+
+
+class CollageInputFile(InputFile):
+    """InputFile поверх bytes/memoryview: отдаёт срезы без копирования в aiohttp."""
+
+    def __init__(self, data, filename: str = "collage.jpg", chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.data = data
+
+    async def read(self, bot):
+        view = memoryview(self.data)
+        for start in range(0, len(view), self.chunk_size):
+            yield view[start:start + self.chunk_size]
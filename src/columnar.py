@@ -0,0 +1,217 @@
+# columnar.py — числовые поля офферов колонками и запросы /find по ним
+#
+#   /find size=150..300 total<=4000          — офисы и склады 150–300 м² до 4000$/міс
+#   /find склад height>=8 power>=100 sort=-size
+#   /find ppm<20 size>=500 sort=total
+#
+# OfferColumns хранит каждое поле в array('d') (нет значения — NaN) и для
+# каждого поля — перестановку строк по возрастанию значения. Условие-диапазон
+# превращается двумя bisect в непрерывный срез этой перестановки (NaN в неё не
+# входят — оффер без поля не проходит). Срезы пересекаются как множества, начиная
+# с самого узкого, — цикл по строкам идёт в C, а не в Python. Если кандидатов
+# много, первые limit берутся проходом по перестановке поля сортировки с ранним
+# выходом; если мало — сортируются сами.
+# Строки идут в порядке merge_offers (по цене за місяць), он же — порядок по умолчанию.
+
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from offers import Offer
+
+
+def _power(offer: Offer) -> float:
+    try:
+        return float(str(offer.power).rstrip("."))
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _optional(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+# поле -> значение оффера (тип — 0 офис / 1 склад, чтобы фильтровать им же)
+FIELDS: Dict[str, Callable[[Offer], float]] = {
+    "size": lambda o: float(o.size),
+    "total": lambda o: float(o.price_total),
+    "ppm": lambda o: float(o.price_per_m2),
+    "height": lambda o: _optional(o.height),
+    "power": _power,
+    "type": lambda o: 0.0 if o.type == 'office' else 1.0,
+}
+
+FIELD_ALIASES = {
+    "size": "size", "area": "size", "площа": "size", "м2": "size", "m2": "size",
+    "total": "total", "price": "total", "ціна": "total", "сума": "total",
+    "ppm": "ppm", "rate": "ppm", "ставка": "ppm", "за_м2": "ppm",
+    "height": "height", "висота": "height", "стеля": "height",
+    "power": "power", "kw": "power", "квт": "power", "потужність": "power",
+}
+
+TYPE_WORDS = {
+    'офіс': 0.0, 'офіси': 0.0, 'офис': 0.0, 'office': 0.0,
+    'склад': 1.0, 'склади': 1.0, 'warehouse': 1.0,
+}
+
+_NUMBER = r"-?\d+(?:[.,]\d+)?"
+_CONDITION_RE = re.compile(rf"^([^\W\d]\w*)(<=|>=|=|<|>)({_NUMBER})?(\.\.({_NUMBER})?)?$", re.I)
+_UNIT_RE = re.compile(r"(?<=\d)(\$|м²|м2|m2|м|квт|kw)$", re.I)
+_SORT_RE = re.compile(r"^(?:sort|сорт)=(-?)([^\W\d]\w*)$", re.I)
+
+
+@dataclass(frozen=True)
+class Condition:
+    field: str
+    lo: float = -math.inf
+    hi: float = math.inf
+    lo_open: bool = False       # lo < x, а не lo <= x
+    hi_open: bool = False
+
+    def test(self, value: float) -> bool:
+        if self.lo_open:
+            if not value > self.lo:
+                return False
+        elif not value >= self.lo:
+            return False
+        if self.hi_open:
+            return value < self.hi
+        return value <= self.hi
+
+
+@dataclass
+class FindQuery:
+    conditions: List[Condition] = field(default_factory=list)
+    sort: Optional[str] = None
+    descending: bool = False
+
+
+def _number(raw: str) -> float:
+    return float(raw.replace(",", "."))
+
+
+def parse_find_query(text: str) -> FindQuery:
+    """Разбор аргументов /find; ValueError с текстом для пользователя."""
+    query = FindQuery()
+    for token in (text or "").lower().split():
+        token = _UNIT_RE.sub("", token)
+        if token in TYPE_WORDS:
+            value = TYPE_WORDS[token]
+            query.conditions.append(Condition("type", value, value))
+            continue
+        m = _SORT_RE.match(token)
+        if m:
+            name = FIELD_ALIASES.get(m.group(2))
+            if name is None:
+                raise ValueError(f"Невідоме поле сортування: {m.group(2)}")
+            query.sort, query.descending = name, bool(m.group(1))
+            continue
+        m = _CONDITION_RE.match(token)
+        if not m:
+            raise ValueError(f"Не зрозумів умову «{token}». Приклад: size=150..300 total<=4000")
+        raw_name, op, first, dots, second = m.groups()
+        name = FIELD_ALIASES.get(raw_name)
+        if name is None:
+            raise ValueError(f"Невідоме поле: {raw_name}. Поля: size, total, ppm, height, power")
+        if dots:
+            if op != "=" or (first is None and second is None):
+                raise ValueError(f"Діапазон пишеться так: {raw_name}=150..300")
+            lo = _number(first) if first is not None else -math.inf
+            hi = _number(second) if second is not None else math.inf
+            if lo > hi:
+                raise ValueError(f"Порожній діапазон: {token}")
+            query.conditions.append(Condition(name, lo, hi))
+            continue
+        if first is None:
+            raise ValueError(f"Немає числа в умові «{token}»")
+        value = _number(first)
+        query.conditions.append({
+            "=": Condition(name, value, value),
+            "<=": Condition(name, hi=value),
+            "<": Condition(name, hi=value, hi_open=True),
+            ">=": Condition(name, lo=value),
+            ">": Condition(name, lo=value, lo_open=True),
+        }[op])
+    return query
+
+
+def _descending(values: array, rows: array) -> Iterator[int]:
+    """Строки по убыванию значения; равные — в порядке строк, как у sorted(reverse=True)."""
+    end = len(rows)
+    while end:
+        start = bisect_left(values, values[end - 1], 0, end)
+        yield from rows[start:end]
+        end = start
+
+
+class OfferColumns:
+    def __init__(self, offers: Sequence[Offer]):
+        self.offers = list(offers)
+        self.columns: Dict[str, array] = {}
+        # поле -> (значения по возрастанию, номера строк в том же порядке); NaN не входят
+        self._sorted: Dict[str, Tuple[array, array]] = {}
+        # поле -> строки без значения (в конец при сортировке по полю)
+        self._missing: Dict[str, array] = {}
+        for name, get in FIELDS.items():
+            column = array("d", (get(offer) for offer in self.offers))
+            rows = array("l", sorted(
+                (row for row, value in enumerate(column) if value == value),
+                key=column.__getitem__,
+            ))
+            self.columns[name] = column
+            self._sorted[name] = (array("d", (column[row] for row in rows)), rows)
+            self._missing[name] = array("l", (row for row, value in enumerate(column) if value != value))
+
+    def __len__(self) -> int:
+        return len(self.offers)
+
+    def _range(self, condition: Condition) -> array:
+        values, rows = self._sorted[condition.field]
+        start = (bisect_right if condition.lo_open else bisect_left)(values, condition.lo)
+        end = (bisect_left if condition.hi_open else bisect_right)(values, condition.hi)
+        return rows[start:max(start, end)]
+
+    def select(self, query: FindQuery, limit: int) -> Tuple[int, List[Offer]]:
+        """(сколько всего подходит, первые limit офферов в порядке сортировки)."""
+        n = len(self.offers)
+        candidates = None           # None — все строки
+        if query.conditions:
+            for rows in sorted((self._range(c) for c in query.conditions), key=len):
+                if candidates is None:
+                    candidates = set(rows)
+                else:
+                    candidates.intersection_update(rows)
+                if not candidates:
+                    return 0, []
+        total = n if candidates is None else len(candidates)
+        accept = (lambda r: True) if candidates is None else candidates.__contains__
+
+        sort = query.sort if query.sort in self._sorted else None
+        if sort is None:
+            order = range(n)
+            missing = ()
+        else:
+            values, rows = self._sorted[sort]
+            order = _descending(values, rows) if query.descending else rows
+            missing = self._missing[sort]
+
+        if candidates is not None and total * 8 < n:
+            # кандидатов мало — сортируем их самих
+            if sort is None:
+                ordered = sorted(candidates)
+            else:
+                column = self.columns[sort]
+                # sorted(candidates): set обходится не по порядку строк, а равные должны идти по нему
+                ordered = sorted(
+                    (r for r in sorted(candidates) if column[r] == column[r]),
+                    key=column.__getitem__, reverse=query.descending,
+                )
+        else:
+            ordered = list(islice(filter(accept, order), limit))
+        if len(ordered) < limit:
+            ordered += islice(filter(accept, missing), limit - len(ordered))
+        return total, [self.offers[r] for r in ordered[:limit]]
@@ -0,0 +1,65 @@
+# export.py — выгрузка всех найденных офферов одним документом
+#
+# OfferCsvFile — InputFile aiogram, который не держит документ в памяти:
+# read() берёт офферы из генератора и отдаёт CSV кусками по chunk_size,
+# aiohttp отправляет их в multipart по мере готовности. Повторная отправка
+# (RetryAfter) вызывает read() заново, поэтому на вход — фабрика итераторов.
+
+import csv
+import io
+from typing import Callable, Iterable, Iterator, List
+
+from aiogram.types import InputFile
+
+from offers import Offer
+
+# BOM — чтобы Excel открыл кириллицу в UTF-8 без мастера импорта
+_BOM = "\ufeff"
+
+EXPORT_COLUMNS: List[tuple] = [
+    ("Тип", lambda o: "Офіс" if o.type == 'office' else "Склад"),
+    ("Назва", lambda o: o.bc_name),
+    ("Площа, м²", lambda o: o.size),
+    ("Ціна за м², $", lambda o: o.price_per_m2),
+    ("Ціна за місяць, $", lambda o: o.price_total),
+    ("Поверх", lambda o: o.floor),
+    ("Клас", lambda o: o.bc_class or o.w_class),
+    ("Метро", lambda o: o.metro),
+    ("Берег", lambda o: o.shore),
+    ("Адреса", lambda o: o.addr),
+    ("Висота, м", lambda o: o.height),
+    ("Потужність", lambda o: o.power),
+    ("Посилання", lambda o: o.link),
+]
+
+
+def iter_csv(offers: Iterable[Offer], chunk_size: int) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write(_BOM)
+    writer.writerow([title for title, _ in EXPORT_COLUMNS])
+    for offer in offers:
+        writer.writerow(["" if value is None else value for value in (get(offer) for _, get in EXPORT_COLUMNS)])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class OfferCsvFile(InputFile):
+    def __init__(self, offers: Callable[[], Iterable[Offer]], filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.offers = offers
+        self.rows = 0
+
+    def _counted(self) -> Iterator[Offer]:
+        self.rows = 0
+        for offer in self.offers():
+            self.rows += 1
+            yield offer
+
+    async def read(self, bot):
+        for chunk in iter_csv(self._counted(), self.chunk_size):
+            yield chunk
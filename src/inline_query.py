@@ -0,0 +1,150 @@
+# inline_query.py — разбор inline-запросов и мемо результатов
+#
+#   "офіс 200-500 20$"   — офисы 200–500 м², до 20$/м²
+#   "склад 1000+"        — склады от 1000 м²
+#   "офіс 20-30$"        — диапазон цены за м²
+#   "офіс 200 - 500 м2 до 20 $" — то же с пробелами, единицами и «до»
+#   "Парус"              — всё, что не распознано, ищется в названии БЦ
+#
+# Результаты по нормализованному запросу запоминаются в QueryMemo, пока
+# не сменится версия индекса: при наборе текста один и тот же префикс
+# приходит от многих пользователей подряд.
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Iterable, List, Optional, Tuple
+
+from offers import Offer
+
+_TYPE_WORDS = {
+    'офіс': 'office', 'офіси': 'office', 'офис': 'office', 'office': 'office',
+    'склад': 'warehouse', 'склади': 'warehouse', 'warehouse': 'warehouse',
+}
+_UNIT_WORDS = {'м²', 'м2', 'm2', 'кв.м', '$'}
+# "20$", "до20$" — верхняя граница цены за м², "10-20$" — диапазон
+_PRICE_RE = re.compile(r"^(?:до|<=?|(\d+(?:[.,]\d+)?)\s*-\s*)?(\d+(?:[.,]\d+)?)\$$")
+_SIZE_RANGE_RE = re.compile(r"^(\d+(?:[.,]\d+)?)\s*[-–]\s*(\d+(?:[.,]\d+)?)(?:м²|м2|m2)?$", re.I)
+_SIZE_MIN_RE = re.compile(r"^(\d+(?:[.,]\d+)?)\+(?:м²|м2|m2)?$", re.I)
+_SIZE_MAX_RE = re.compile(r"^(?:до|<=?)(\d+(?:[.,]\d+)?)(?:м²|м2|m2)?$", re.I)
+
+
+def _num(value: str) -> float:
+    return float(value.replace(',', '.'))
+
+
+@dataclass(frozen=True)
+class InlineQuery:
+    type: Optional[str] = None
+    min_size: Optional[float] = None
+    max_size: Optional[float] = None
+    min_ppm: Optional[float] = None
+    max_ppm: Optional[float] = None
+    name: str = ''
+
+    def matches(self, offer: Offer) -> bool:
+        if self.type and offer.type != self.type:
+            return False
+        if self.min_size is not None and offer.size < self.min_size:
+            return False
+        if self.max_size is not None and offer.size > self.max_size:
+            return False
+        if self.min_ppm is not None and offer.price_per_m2 < self.min_ppm:
+            return False
+        if self.max_ppm is not None and offer.price_per_m2 > self.max_ppm:
+            return False
+        if self.name and self.name not in (offer.bc_name or '').casefold():
+            return False
+        return True
+
+
+def parse_inline_query(text: str) -> InlineQuery:
+    # "200 - 500" -> "200-500", "20 $" -> "20$", "до 200" -> "до200"
+    text = re.sub(r"\s*([-–])\s*", r"\1", (text or '').strip())
+    text = re.sub(r"\s+\$", "$", text)
+    text = re.sub(r"\b(до)\s+(?=\d)", r"\1", text, flags=re.I)
+    kind = None
+    min_size = max_size = min_ppm = max_ppm = None
+    words = []
+    for token in text.split():
+        low = token.casefold()
+        if low in _UNIT_WORDS:
+            continue
+        if low in _TYPE_WORDS:
+            kind = _TYPE_WORDS[low]
+            continue
+        m = _PRICE_RE.match(low)
+        if m:
+            if m.group(1):
+                min_ppm = _num(m.group(1))
+            max_ppm = _num(m.group(2))
+            continue
+        m = _SIZE_RANGE_RE.match(low)
+        if m:
+            min_size, max_size = _num(m.group(1)), _num(m.group(2))
+            continue
+        m = _SIZE_MIN_RE.match(low)
+        if m:
+            min_size = _num(m.group(1))
+            continue
+        m = _SIZE_MAX_RE.match(low)
+        if m:
+            max_size = _num(m.group(1))
+            continue
+        words.append(low)
+    return InlineQuery(kind, min_size, max_size, min_ppm, max_ppm, ' '.join(words))
+
+
+def inline_result_id(channel: str, offer: Offer) -> str:
+    """
+    id результата inline-ответа (до 64 байт). Пост с несколькими этажами даёт
+    несколько офферов с одним msg_id, а повтор id Telegram отвергает весь ответ.
+    """
+    detail = f"{offer.floor or offer.desc or ''}|{offer.size}|{offer.price_total}"
+    digest = hashlib.blake2b(detail.encode(), digest_size=6).hexdigest()
+    return f"{channel.lstrip('@')[:32]}_{offer.msg_id}_{digest}"
+
+
+def unique_inline_results(offers: Iterable[Offer], channel_of: Callable[[Offer], str]) -> List[Tuple[str, Offer]]:
+    """(id, оффер) без повторов id — полностью совпадающие предложения одного поста схлопываются."""
+    seen = set()
+    results = []
+    for offer in offers:
+        result_id = inline_result_id(channel_of(offer), offer)
+        if result_id not in seen:
+            seen.add(result_id)
+            results.append((result_id, offer))
+    return results
+
+
+class QueryMemo:
+    """LRU запрос -> список офферов; запись живёт ttl секунд и до смены версии индекса."""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[InlineQuery, Hashable], Tuple[float, List[Offer]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: InlineQuery, version: Hashable) -> Optional[List[Offer]]:
+        key = (query, version)
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, query: InlineQuery, version: Hashable, offers: List[Offer]):
+        key = (query, version)
+        self._entries[key] = (time.monotonic(), offers)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
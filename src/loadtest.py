@@ -0,0 +1,410 @@
+# loadtest.py — нагрузочный прогон настоящего Dispatcher'а без сети
+#
+# python src/loadtest.py [--users 10,50,100] [--pages 3] [--posts 1500]
+#                        [--api-latency 0.05] [--mtproto-latency 0.08]
+#                        [--no-rate-limit] [--cold] [--warm-collages] [--tracemalloc]
+#
+# Каждый виртуальный пользователь проходит весь сценарий:
+#   /start → 🏢 Офіс → метраж → цена (поиск) → page_next × N → calc_*
+# Апдейты идут через dp.feed_update; Bot API — фейковая сессия, которая
+# записывает вызовы и отвечает с задержкой; Telethon — фейковый клиент со
+# сгенерированным каналом (альбомы по 3 фото). Печатает throughput,
+# p50/p99 по шагам, задержку event loop и пик памяти для каждого числа пользователей.
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+# трассы прогона не нужны и не должны копиться рядом с кодом
+os.environ["TRACE_FILE"] = ""
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods.base import Response  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import bot as app  # noqa: E402
+from outbound import RateLimitMiddleware  # noqa: E402
+from telethon_pool import PooledClient, TelethonPool  # noqa: E402
+
+OFFICE_SIZES = ["До 200 м²", "200–500 м²", "500–1000 м²", "1000+ м²"]
+OFFICE_PRICES = ["До 20$ за м²", "20–30$ за м²", "Більше 30$ за м²"]
+
+
+# ----------------- Fake Bot API -----------------
+class FakeSession(BaseSession):
+    """
+    Bot API без сети: каждый метод ждёт latency ± 50% и возвращает
+    правдоподобный результат. Запоминает навигацию и карточки по чатам,
+    чтобы сценарий мог нажимать на их кнопки.
+    """
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self.nav: Dict[int, int] = {}
+        self.cards: Dict[int, Dict[int, str]] = defaultdict(dict)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    def _track(self, method, chat_id: int, message_id: int):
+        markup = getattr(method, "reply_markup", None)
+        for row in getattr(markup, "inline_keyboard", None) or []:
+            for button in row:
+                if (button.callback_data or "").startswith("calc_"):
+                    self.cards[chat_id][message_id] = button.callback_data
+                elif button.callback_data in ("page_next", "page_prev"):
+                    self.nav[chat_id] = message_id
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        chat_id = getattr(method, "chat_id", None)
+        message_id = getattr(method, "message_id", None)
+        result: Any = True
+        if name.startswith(("Send", "EditMessage")):
+            message_id = message_id or next(self._message_ids)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            if name in ("SendPhoto", "EditMessageMedia"):
+                file_id = f"fake-photo-{next(self._file_ids)}"
+                result["photo"] = [{
+                    "file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720,
+                }]
+            else:
+                result["text"] = getattr(method, "text", None) or ""
+            if name.startswith("EditMessage"):
+                # очищенная карточка (без кнопки calc_) нажиматься не должна
+                self.cards[chat_id].pop(message_id, None)
+            self._track(method, chat_id, message_id)
+        elif name == "DeleteMessage":
+            self.cards[chat_id].pop(message_id, None)
+
+        response = Response[method.__returning__].model_validate(
+            {"ok": True, "result": result}, context={"bot": bot}
+        )
+        return response.result
+
+
+# ----------------- Fake Telethon -----------------
+def synthetic_photo(seed: int) -> bytes:
+    img = Image.linear_gradient("L").resize((640, 480)).rotate(seed * 37 % 360)
+    img = Image.merge("RGB", (img, img.transpose(Image.FLIP_LEFT_RIGHT), img.transpose(Image.FLIP_TOP_BOTTOM)))
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def generate_office_channel(posts: int, seed: int = 1) -> Dict[int, SimpleNamespace]:
+    """Пост = альбом из 3 фото, текст с 1–3 предложениями этажей на первом сообщении."""
+    rnd = random.Random(seed)
+    messages: Dict[int, SimpleNamespace] = {}
+    for i in range(posts):
+        base = i * 3 + 1
+        lines = [f"Бізнес-центр Load {i % 250}", f"Клас {rnd.choice('ABC')}"]
+        for _ in range(rnd.randint(1, 3)):
+            size = rnd.randint(40, 1500)
+            price = int(size * rnd.uniform(9, 38))
+            lines.append(f"{rnd.randint(1, 25)}-й поверх {size}m2 ({price}$)")
+        lines.append("м. Палац Спорту")
+        for k in range(3):
+            messages[base + k] = SimpleNamespace(
+                id=base + k,
+                message="\n".join(lines) if k == 0 else "",
+                entities=[],
+                grouped_id=10_000 + i,
+                photo=SimpleNamespace(dc_id=2),
+            )
+    return messages
+
+
+class FakeTelegramClient:
+    def __init__(self, channels: Dict[str, Dict[int, SimpleNamespace]], latency: float, photos: List[bytes]):
+        self.channels = channels
+        self.latency = latency
+        self.photos = photos
+        self.calls: Counter = Counter()
+
+    async def _rpc(self, name: str):
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def connect(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def get_input_entity(self, username: str):
+        await self._rpc("get_input_entity")
+        return SimpleNamespace(username=username)
+
+    async def iter_messages(self, entity, limit=None, min_id=0, offset_id=0):
+        channel = self.channels.get(entity.username, {})
+        ids = sorted((i for i in channel if i > min_id and (not offset_id or i < offset_id)), reverse=True)
+        if limit is not None:
+            ids = ids[:limit]
+        for n, msg_id in enumerate(ids):
+            if n % 100 == 0:
+                await self._rpc("messages.getHistory")
+            yield channel[msg_id]
+
+    async def get_messages(self, entity, ids):
+        await self._rpc("messages.getMessages")
+        channel = self.channels.get(entity.username, {})
+        if isinstance(ids, list):
+            return [channel.get(i) for i in ids]
+        return channel.get(ids)
+
+    async def download_media(self, message, file=bytes):
+        await self._rpc("upload.getFile")
+        return self.photos[message.id % len(self.photos)]
+
+
+# ----------------- Сценарий -----------------
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.updates = 0
+        self.errors = 0
+
+
+class Scenario:
+    def __init__(self, bot: Bot, session: FakeSession, recorder: Recorder, think: float):
+        self.bot = bot
+        self.session = session
+        self.recorder = recorder
+        self.think = think
+        self._update_ids = itertools.count(1)
+
+    def _chat(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "type": "private"}
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"load{user_id}"}
+
+    async def _feed(self, step: str, payload: Dict[str, Any]):
+        payload["update_id"] = next(self._update_ids)
+        update = app.types.Update.model_validate(payload, context={"bot": self.bot})
+        start = time.perf_counter()
+        try:
+            await app.dp.feed_update(self.bot, update)
+        except Exception:
+            self.recorder.errors += 1
+            app.logger.exception(f"Load test step {step} failed")
+        self.recorder.latencies[step].append(time.perf_counter() - start)
+        self.recorder.updates += 1
+        if self.think:
+            await asyncio.sleep(self.think * random.uniform(0.5, 1.5))
+
+    async def text(self, step: str, user_id: int, text: str):
+        await self._feed(step, {"message": {
+            "message_id": random.randint(1, 1 << 30),
+            "date": int(time.time()),
+            "chat": self._chat(user_id),
+            "from": self._user(user_id),
+            "text": text,
+        }})
+
+    async def press(self, step: str, user_id: int, message_id: int, data: str):
+        await self._feed(step, {"callback_query": {
+            "id": str(random.randint(1, 1 << 62)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": self._chat(user_id),
+                "text": "",
+            },
+        }})
+
+    async def run_user(self, user_id: int, pages: int):
+        await self.text("start", user_id, "/start")
+        await self.text("menu", user_id, "🏢 Офіс")
+        await self.text("size", user_id, random.choice(OFFICE_SIZES))
+        await self.text("search", user_id, random.choice(OFFICE_PRICES))
+        for _ in range(pages):
+            nav_id = self.session.nav.get(user_id)
+            if nav_id is None:
+                break
+            await self.press("page_next", user_id, nav_id, "page_next")
+        cards = self.session.cards.get(user_id)
+        if cards:
+            message_id, data = list(cards.items())[-1]
+            await self.press("calc", user_id, message_id, data)
+
+
+# ----------------- Отчёт -----------------
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+async def monitor_loop_lag(samples: List[float], interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+def reset_state(temp_dir: str, warm_collages: bool, cold: bool):
+    app.user_sessions.clear()
+    app.calc_store.clear()
+    app.page_views.clear()
+    app.push_cards.clear()
+    if not warm_collages:
+        app.collage_bytes_cache.clear()
+        app.collage_file_ids.clear()
+        app.close_collage_pack()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir, exist_ok=True)
+    if cold:
+        for mapping in (app.offer_index, app.type_index, app.channel_messages,
+                        app.channel_history_ts, app.channel_cursors):
+            mapping.clear()
+
+
+async def run_load(args, users: int, session: FakeSession, client: FakeTelegramClient, temp_dir: str):
+    reset_state(temp_dir, args.warm_collages, args.cold)
+    if not args.cold:
+        await app.sync_all_channels(full=True)
+
+    session.calls.clear()
+    client.calls.clear()
+    session.nav.clear()
+    session.cards.clear()
+    recorder = Recorder()
+    scenario = Scenario(app.bot, session, recorder, args.think)
+    lag: List[float] = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag))
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    base_uid = 1_000_000 * (users + 1)
+    await asyncio.gather(*(scenario.run_user(base_uid + n, args.pages) for n in range(users)))
+    elapsed = time.perf_counter() - start
+
+    monitor.cancel()
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    print(f"== {users} users: {recorder.updates} updates in {elapsed:.1f}s "
+          f"({recorder.updates / elapsed:.1f} upd/s), errors={recorder.errors}")
+    print(f"{'step':<10} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for step, values in recorder.latencies.items():
+        print(f"{step:<10} {len(values):>6} {percentile(values, 50) * 1000:>9.1f} "
+              f"{percentile(values, 99) * 1000:>9.1f} {max(values) * 1000:>9.1f}")
+    print(f"loop lag: p50={percentile(lag, 50) * 1000:.1f}ms p99={percentile(lag, 99) * 1000:.1f}ms "
+          f"max={max(lag, default=0.0) * 1000:.1f}ms")
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    memory = f"peak RSS {rss_mb:.0f} MB"
+    if traced_peak is not None:
+        memory += f", tracemalloc peak {traced_peak / 1024 / 1024:.1f} MB"
+    print(memory)
+    print("Bot API calls:", ", ".join(f"{k}={v}" for k, v in session.calls.most_common()))
+    print("MTProto calls:", ", ".join(f"{k}={v}" for k, v in client.calls.most_common()))
+    print()
+
+
+async def main_async(args):
+    temp_dir = tempfile.mkdtemp(prefix="loadtest_collages_")
+    app.TEMP_FOLDER = temp_dir
+    app.CACHE_FILE = os.path.join(temp_dir, "collage_url_cache.json")
+    app.USE_DRIVE = False
+
+    session = FakeSession(args.api_latency)
+    app.bot = Bot(token="123456:LOADTEST", session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    app.bot.session.middleware(app.BotApiTracingMiddleware())
+    if not args.no_rate_limit:
+        app.bot.session.middleware(RateLimitMiddleware(app.outbound, queue_warn=app.OUTBOUND_QUEUE_WARN))
+
+    photos = [synthetic_photo(i) for i in range(6)]
+    channels = {
+        channel: generate_office_channel(args.posts, seed=n + 1)
+        for n, (channel, profile) in enumerate(app.CHANNELS.items())
+        if profile == "office"
+    }
+    client = FakeTelegramClient(channels, args.mtproto_latency, photos)
+    app.telethon_pool = TelethonPool([
+        PooledClient(
+            "loadtest",
+            client,
+            initial=app.MAX_PARALLEL_DOWNLOADS,
+            min_limit=app.TELETHON_MIN_CONCURRENCY,
+            max_limit=app.TELETHON_MAX_CONCURRENCY,
+            default_timeout=app.TELETHON_CALL_TIMEOUT,
+        )
+    ])
+    app._telethon_started = None
+
+    print(f"{args.posts} posts per office channel, Bot API {args.api_latency * 1000:.0f}ms, "
+          f"MTProto {args.mtproto_latency * 1000:.0f}ms, rate limit {'off' if args.no_rate_limit else 'on'}, "
+          f"pagination={app.PAGINATION_MODE}\n")
+    try:
+        for users in args.users:
+            await run_load(args, users, session, client, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test: N concurrent users through the real Dispatcher")
+    parser.add_argument("--users", default="10,50,100", help="числа пользователей через запятую")
+    parser.add_argument("--pages", type=int, default=3, help="нажатий «Далі» на пользователя")
+    parser.add_argument("--posts", type=int, default=1500, help="постов в сгенерированном канале")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="средняя задержка Bot API, сек")
+    parser.add_argument("--mtproto-latency", type=float, default=0.08, help="средняя задержка MTProto, сек")
+    parser.add_argument("--think", type=float, default=0.2, help="пауза пользователя между шагами, сек")
+    parser.add_argument("--no-rate-limit", action="store_true", help="без RateLimitMiddleware")
+    parser.add_argument("--cold", action="store_true", help="без индекса: поиск читает канал потоком")
+    parser.add_argument("--warm-collages", action="store_true", help="не сбрасывать коллажи между прогонами")
+    parser.add_argument("--tracemalloc", action="store_true", help="пик памяти Python-объектов (медленнее)")
+    args = parser.parse_args()
+    args.users = [int(u) for u in args.users.split(",") if u.strip()]
+
+    app.logging.getLogger().setLevel(app.logging.WARNING)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
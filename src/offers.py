@@ -0,0 +1,92 @@
+# offers.py — компактная запись оффера и ленивый рендер подписи
+#
+# Парсер создаёт тысячи офферов, а показываются из них единицы, поэтому
+# HTML-подпись не собирается при разборе: caption() строит её при первой
+# отправке карточки и запоминает до смены version (например, после правки поста).
+
+from dataclasses import dataclass, field, fields
+from typing import Optional, Tuple
+
+
+@dataclass(slots=True, eq=False)
+class Offer:
+    type: str                       # 'office' | 'warehouse'
+    msg_id: int
+    link: str
+    price_total: float
+    price_per_m2: float
+    size: float
+    bc_name: str
+    # офисы
+    floor: Optional[str] = None
+    bc_class: Optional[str] = None
+    price_formula: Optional[str] = None
+    # склады
+    desc: Optional[str] = None
+    addr: Optional[str] = None
+    shore: Optional[str] = None
+    w_class: Optional[str] = None
+    height: Optional[float] = None
+    power: Optional[str] = None
+    # общее
+    metro: Optional[str] = None
+    version: int = 0
+    channel: str = ''               # канал-источник ('' в старых снапшотах)
+    _caption: Optional[str] = field(default=None, init=False, repr=False)
+    _caption_version: int = field(default=-1, init=False, repr=False)
+
+    def caption(self) -> str:
+        if self._caption is None or self._caption_version != self.version:
+            if self.type == 'office':
+                self._caption = _render_office(self)
+            else:
+                self._caption = _render_warehouse(self)
+            self._caption_version = self.version
+        return self._caption
+
+    # ---------- компактная сериализация (снапшот) ----------
+    def to_row(self) -> Tuple:
+        return tuple(getattr(self, name) for name in ROW_FIELDS)
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "Offer":
+        return cls(*row)
+
+
+ROW_FIELDS = tuple(f.name for f in fields(Offer) if not f.name.startswith('_'))
+
+
+def _fmt_number(value: float):
+    return int(value) if float(value).is_integer() else value
+
+
+def _render_office(o: Offer) -> str:
+    lines = [f"<b>{o.bc_name}</b>"]
+    if o.bc_class:
+        lines.append(f"Клас {o.bc_class}")
+    if o.price_formula:
+        lines.append(f"ЦІНА: {o.price_formula}")
+    lines.append(f"{o.floor}, {_fmt_number(o.size)}м²")
+    lines.append(f"💵 {int(o.price_total):,}$ ({o.price_per_m2}$/м²)")
+    if o.metro:
+        lines.append(f"Ⓜ️{o.metro}")
+    return "\n".join(lines)
+
+
+def _render_warehouse(o: Offer) -> str:
+    lines = [f"<b>{o.bc_name}</b>"]
+    if o.addr:
+        lines.append(f"📍 {o.addr}")
+    if o.metro:
+        lines.append(f"Ⓜ️ {o.metro}")
+    if o.shore:
+        lines.append(f"🚩 Берег: {o.shore}")
+    if o.w_class:
+        lines.append(f"🏗 Клас: {o.w_class}")
+    if o.height:
+        lines.append(f"📏 Висота стелі: {_fmt_number(o.height)} м")
+    if o.power:
+        lines.append(f"⚡ Потужність: {o.power}")
+    lines.append(f"{o.desc}, {_fmt_number(o.size)}м²")
+    lines.append(f"💵 {int(o.price_total):,}$ ({o.price_per_m2}$/м²)")
+    return "\n".join(lines)
@@ -0,0 +1,235 @@
+# outbound.py — планировщик исходящих запросов к Bot API
+#
+# Глобальный token bucket (~30 сообщений/с на бота) + bucket на каждый чат
+# (~1 сообщение/с в личке, ~20/мин в группах). TelegramRetryAfter не роняет
+# карточку: чат (или весь бот) блокируется на retry_after, запрос повторяется.
+# Telegram не говорит, чей лимит превышен: 429 в чате, который почти ничего не
+# отправлял, или 429 сразу в нескольких чатах — это глобальный лимит бота.
+# Интерактивные ответы имеют приоритет над фоновыми рассылками.
+
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+_PRIORITY_NAMES = ("interactive", "background")
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "outbound_priority", default=PRIORITY_INTERACTIVE
+)
+
+# Методы, которые Telegram считает «сообщениями» и лимитирует
+RATE_LIMITED_METHODS = frozenset({
+    "sendMessage",
+    "sendPhoto",
+    "sendDocument",
+    "sendMediaGroup",
+    "copyMessage",
+    "forwardMessage",
+    "editMessageText",
+    "editMessageCaption",
+    "editMessageMedia",
+    "editMessageReplyMarkup",
+})
+
+ChatKey = Union[int, str, None]
+
+
+@contextmanager
+def background_priority():
+    """
+    Всё, что отправляется внутри блока, уступает место интерактивным ответам.
+    """
+    token = _priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def wait_time(self, now: float, reserve: float = 0.0) -> float:
+        """
+        Сколько секунд ждать, пока в корзине будет 1 токен сверх reserve.
+        """
+        self._refill(now)
+        need = 1.0 + reserve
+        wait = 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self):
+        self.tokens -= 1.0
+
+    def block(self, seconds: float, now: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.stamp = now
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundScheduler:
+    """
+    Выдаёт «слоты» на отправку с учётом глобального и per-chat лимитов.
+    Очередь — это корутины, ждущие слот; depth() показывает её глубину.
+    """
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 8.0,
+        group_rate: float = 20.0 / 60.0,
+        group_burst: float = 3.0,
+        max_retries: int = 5,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._chats: Dict[ChatKey, TokenBucket] = {}
+        self._waiting = [0, 0]
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retries = 0
+        self.global_blocks = 0
+        # (чат, до какого времени заблокирован) — последний RetryAfter конкретного чата
+        self._last_chat_block: Tuple[ChatKey, float] = (None, 0.0)
+
+    def depth(self) -> Dict[str, int]:
+        return {name: self._waiting[i] for i, name in enumerate(_PRIORITY_NAMES)}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.depth(),
+            "sent": self.sent,
+            "retries": self.retries,
+            "global_blocks": self.global_blocks,
+            "chats": len(self._chats),
+        }
+
+    def _chat_bucket(self, chat_id: ChatKey) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                for key in [k for k, b in self._chats.items() if b.is_idle(now)]:
+                    del self._chats[key]
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            if is_group:
+                bucket = TokenBucket(self._group_rate, self._group_burst)
+            else:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: ChatKey, priority: int = PRIORITY_INTERACTIVE):
+        self._waiting[priority] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                # фоновые запросы оставляют в глобальной корзине запас под интерактивные
+                reserve = 0.0
+                if priority != PRIORITY_INTERACTIVE:
+                    reserve = min(self._waiting[PRIORITY_INTERACTIVE], self._global.capacity / 2)
+                wait = self._global.wait_time(now, reserve)
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                if bucket is not None:
+                    wait = max(wait, bucket.wait_time(now))
+                if wait <= 0:
+                    self._global.consume()
+                    if bucket is not None:
+                        bucket.consume()
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self._waiting[priority] -= 1
+
+    def on_retry_after(self, chat_id: ChatKey, seconds: float):
+        now = time.monotonic()
+        if chat_id is None:
+            self._block_global(seconds, now)
+            return
+        bucket = self._chat_bucket(chat_id)
+        bucket.wait_time(now)       # пополнить перед проверкой
+        last_chat, last_until = self._last_chat_block
+        # чат потратил не больше токена из своего burst — его лимит тут ни при чём
+        chat_was_quiet = bucket.tokens >= bucket.capacity - 1.0
+        other_chat_blocked = last_chat != chat_id and last_until > now
+        bucket.block(seconds, now)
+        self._last_chat_block = (chat_id, now + seconds)
+        if chat_was_quiet or other_chat_blocked:
+            self._block_global(seconds, now)
+
+    def _block_global(self, seconds: float, now: float):
+        self.global_blocks += 1
+        self._global.block(seconds, now)
+
+    async def call(self, chat_id: ChatKey, factory: Callable[[], Awaitable[Any]]) -> Any:
+        priority = _priority.get()
+        attempt = 0
+        while True:
+            await self.acquire(chat_id, priority)
+            try:
+                result = await factory()
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retries += 1
+                self.on_retry_after(chat_id, e.retry_after)
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(f"RetryAfter {e.retry_after}s for chat {chat_id}, attempt {attempt}")
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии aiogram: все «сообщения» идут через OutboundScheduler,
+    остальные методы (getUpdates, answerCallbackQuery, ...) — напрямую.
+    """
+
+    def __init__(self, scheduler: OutboundScheduler, queue_warn: Optional[int] = None):
+        self.scheduler = scheduler
+        self.queue_warn = queue_warn
+
+    async def __call__(self, make_request, bot, method):
+        if method.__api_method__ not in RATE_LIMITED_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        if self.queue_warn:
+            depth = self.scheduler.depth()
+            if sum(depth.values()) >= self.queue_warn:
+                logger.warning(f"Outbound queue depth: {depth}")
+
+        return await self.scheduler.call(chat_id, lambda: make_request(bot, method))
@@ -0,0 +1,188 @@
+# profiling.py — профилирование по запросу и детектор зависаний event loop
+#
+# StackSampler   — поток, который каждые interval секунд снимает стек потока
+#                  event loop; результат — folded stacks ("a;b;c N"), их понимают
+#                  flamegraph.pl, speedscope и inferno.
+# LoopStallMonitor — всегда включён: корутина в loop'е обновляет heartbeat,
+#                  сторожевой поток замечает, что heartbeat не обновлялся дольше
+#                  порога, и логирует стек loop'а и имя текущей задачи (апдейт).
+# memory_report  — глубокий размер кэшей + топ tracemalloc (если трассировка идёт).
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _stack(frame) -> List[str]:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def format_stack(frame, limit: int = 25) -> str:
+    return " <- ".join(reversed(_stack(frame)[-limit:]))
+
+
+class StackSampler:
+    """Статистический сэмплер одного потока (по умолчанию — того, кто его создал)."""
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples: Counter = Counter()
+        self.total = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples[";".join(_stack(frame))] += 1
+            self.total += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def top_self(self, limit: int = 15) -> List[tuple]:
+        """Функции, в которых чаще всего стоял верх стека: (label, доля)."""
+        own: Counter = Counter()
+        for stack, count in self.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        return [(label, count / self.total) for label, count in own.most_common(limit)] if self.total else []
+
+
+class LoopStallMonitor:
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.worst = 0.0
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            # стек снимаем, пока loop ещё занят — это и есть виновник
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            task = asyncio.current_task(self._loop) if self._loop else None
+            self.stalls += 1
+            logger.warning(
+                f"Event loop blocked for {stalled * 1000:.0f}ms+ "
+                f"in {task.get_name() if task else 'callback'}: "
+                f"{format_stack(frame) if frame else '?'}"
+            )
+            threading.Thread(target=self._measure, args=(beat,), daemon=True).start()
+
+    def _measure(self, beat: float):
+        while self._beat == beat and not self._stop.is_set():
+            time.sleep(self.interval / 5)
+        duration = time.monotonic() - beat - self.interval
+        self.worst = max(self.worst, duration)
+        logger.warning(f"Event loop stall ended after ~{duration * 1000:.0f}ms")
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._task = self._loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-stall-monitor", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"threshold_ms": self.threshold * 1000, "stalls": self.stalls, "worst_ms": round(self.worst * 1000)}
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    # list(...) — снимок: обход идёт в потоке, пока loop меняет кэши
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in list(obj.items()))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in list(obj))
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, name, None), seen) for name in obj.__slots__)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def memory_report(caches: Dict[str, Any], top: int = 10) -> str:
+    """
+    Размер кэшей в памяти процесса (у SharedDict — его реплика)
+    и, если tracemalloc включён (PYTHONTRACEMALLOC=1 или /profile), топ мест аллокаций.
+    Обход долгий на больших кэшах — вызывать через asyncio.to_thread.
+    """
+    lines = ["caches:"]
+    sizes = []
+    for name, cache in caches.items():
+        cache = getattr(cache, "replica", cache)
+        if not isinstance(cache, (dict, list)):
+            sizes.append((0, f"  {name}: {len(cache)} items (external)"))
+            continue
+        try:
+            size = deep_sizeof(cache)
+        except RuntimeError:
+            # объект поменяли во время обхода
+            sizes.append((0, f"  {name}: {len(cache)} items (changed while measuring)"))
+            continue
+        sizes.append((size, f"  {name}: {len(cache)} items, {size / 1024 / 1024:.2f} MB"))
+    lines.extend(line for _, line in sorted(sizes, reverse=True))
+
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"tracemalloc: current {current / 1024 / 1024:.1f} MB, peak {peak / 1024 / 1024:.1f} MB")
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:top]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"  {os.path.basename(frame.filename)}:{frame.lineno} "
+                f"{stat.size / 1024:.0f} KB in {stat.count} blocks"
+            )
+    return "\n".join(lines)
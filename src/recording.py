@@ -0,0 +1,197 @@
+# recording.py — запись продакшн-трафика для офлайн-воспроизведения (replay.py)
+#
+# Включается переменной RECORD_FILE. В файл (gzip, JSON по строке) пишутся:
+#   {"kind": "header", "channels": {...}, "started": ts}
+#   {"kind": "update", "t": сек от старта, "update": {...}}    — входящие апдейты
+#   {"kind": "message", "channel": "@...", "id": ..., "text": ..., "entities": [...],
+#    "grouped_id": ..., "photo_dc": ...}                        — сообщения каналов
+#
+# id пользователей и чатов (и любые целые *_id, кроме id сообщений) заменяются
+# псевдонимами (blake2b с солью, которая не сохраняется), имена, username и
+# телефоны убираются — в любом месте апдейта, включая forward_origin, contact
+# и users_shared. Сообщение канала пишется один
+# раз на версию текста. Запись и сжатие — в отдельном потоке; каждая пачка —
+# отдельный gzip-member, поэтому файл читается и после падения процесса.
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# личные поля удаляются в любом месте апдейта; обязательные в Bot API заменяются заглушкой
+_PII_FIELDS = frozenset({"first_name", "last_name", "username", "phone_number", "vcard", "bio"})
+_PII_PLACEHOLDERS = {"first_name": "user", "phone_number": "+380000000000"}
+# признаки User/Chat (в т.ч. forward_origin.sender_user, sender_chat, users_shared)
+_IDENTITY_FIELDS = frozenset({"is_bot", "first_name", "last_name", "username", "type", "title"})
+# *_id, которые не указывают на человека и нужны replay как есть
+_OPAQUE_IDS = frozenset({"message_id", "update_id", "message_thread_id", "reply_to_message_id", "request_id"})
+
+
+class Anonymizer:
+    def __init__(self, salt: Optional[str] = None):
+        self._salt = (salt or os.urandom(16).hex()).encode()
+        self._cache: Dict[int, int] = {}
+
+    def pseudonym(self, value: int) -> int:
+        alias = self._cache.get(value)
+        if alias is None:
+            digest = hashlib.blake2b(str(abs(value)).encode(), key=self._salt, digest_size=8).digest()
+            alias = int.from_bytes(digest, "big") % 10**9 + 10**9
+            # групповые чаты отрицательные — знак сохраняем
+            alias = -alias if value < 0 else alias
+            self._cache[value] = alias
+        return alias
+
+    def pseudonym_text(self, value: str) -> str:
+        # стабилен между процессами при той же соли, в отличие от hash()
+        return hashlib.blake2b(value.encode(), key=self._salt, digest_size=8).hexdigest()
+
+    def _scrub_id(self, value: Any) -> Any:
+        # строковые *_id (file_id, inline_message_id) — не про людей, остаются
+        if isinstance(value, int) and not isinstance(value, bool):
+            return self.pseudonym(value)
+        if isinstance(value, list):
+            return [self._scrub_id(item) for item in value]
+        return value
+
+    def scrub(self, node: Any) -> Any:
+        """Копия апдейта без PII; решение по самому полю, а не по родителю."""
+        if isinstance(node, dict):
+            identity = isinstance(node.get("id"), int) and not _IDENTITY_FIELDS.isdisjoint(node)
+            out = {}
+            for key, value in node.items():
+                if key in _PII_FIELDS or (identity and key == "title"):
+                    if key in _PII_PLACEHOLDERS:
+                        out[key] = _PII_PLACEHOLDERS[key]
+                    continue
+                if key == "id" and identity:
+                    out[key] = self.pseudonym(value)
+                elif (key.endswith("_id") or key.endswith("_ids")) and key not in _OPAQUE_IDS:
+                    out[key] = self._scrub_id(value)
+                elif key == "chat_instance":
+                    out[key] = self.pseudonym_text(str(value))
+                else:
+                    out[key] = self.scrub(value)
+            if identity and "is_bot" in node:
+                out.setdefault("first_name", _PII_PLACEHOLDERS["first_name"])
+            return out
+        if isinstance(node, list):
+            return [self.scrub(item) for item in node]
+        return node
+
+
+def encode_entities(entities) -> List[List[Any]]:
+    return [
+        [type(e).__name__, e.offset, e.length, getattr(e, "url", None)]
+        for e in entities or []
+    ]
+
+
+def decode_entities(rows: List[List[Any]]) -> list:
+    """Обратно в объекты Telethon; типы с дополнительными полями пропускаются."""
+    from telethon.tl import types as tl_types
+
+    entities = []
+    for name, offset, length, url in rows:
+        cls = getattr(tl_types, name, None)
+        if cls is None:
+            continue
+        try:
+            entities.append(cls(offset, length, url) if url is not None else cls(offset, length))
+        except TypeError:
+            continue
+    return entities
+
+
+class TrafficRecorder:
+    def __init__(self, path: str, channels: Dict[str, str], salt: Optional[str] = None):
+        self.path = path
+        self.anonymizer = Anonymizer(salt)
+        self.started = time.time()
+        self.updates = 0
+        self.messages = 0
+        self._seen: set = set()
+        self._queue: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        self._put({"kind": "header", "channels": dict(channels), "started": self.started})
+        threading.Thread(target=self._write_loop, name="traffic-recorder", daemon=True).start()
+
+    def _put(self, record: Dict[str, Any]):
+        self._queue.put(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+    def update(self, update) -> None:
+        payload = update.model_dump(mode="json", by_alias=True, exclude_none=True, exclude_unset=True)
+        self._put({
+            "kind": "update",
+            "t": round(time.time() - self.started, 3),
+            "update": self.anonymizer.scrub(payload),
+        })
+        self.updates += 1
+
+    def channel_message(self, channel_username: str, message) -> None:
+        text = message.message or ""
+        key = (channel_username, message.id, zlib.crc32(text.encode("utf-8")))
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        photo = getattr(message, "photo", None)
+        record = {"kind": "message", "channel": channel_username, "id": message.id}
+        if text:
+            record["text"] = text
+            record["entities"] = encode_entities(message.entities)
+        if getattr(message, "grouped_id", None):
+            record["grouped_id"] = message.grouped_id
+        if photo is not None:
+            record["photo_dc"] = getattr(photo, "dc_id", 0)
+        self._put(record)
+        self.messages += 1
+
+    def _write_loop(self):
+        while True:
+            lines = [self._queue.get()]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "ab") as f:
+                    f.write(gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))
+            except Exception:
+                logger.exception(f"Failed to write traffic recording to {self.path}")
+            time.sleep(0.5)     # пачки покрупнее — меньше gzip-заголовков
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "updates": self.updates, "messages": self.messages}
+
+
+def read_recording(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def load_recording(path: str) -> Tuple[Dict[str, str], List[Dict[str, Any]], Dict[str, Dict[int, Dict[str, Any]]]]:
+    """(каналы с профилями, апдейты по времени, канал -> id -> последняя версия сообщения)."""
+    channels: Dict[str, str] = {}
+    updates: List[Dict[str, Any]] = []
+    messages: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for record in read_recording(path):
+        kind = record.get("kind")
+        if kind == "header":
+            channels.update(record["channels"])
+        elif kind == "update":
+            updates.append(record)
+        elif kind == "message":
+            messages.setdefault(record["channel"], {})[record["id"]] = record
+    updates.sort(key=lambda r: r["t"])
+    return channels, updates, messages
@@ -0,0 +1,244 @@
+# replay.py — воспроизведение записанного трафика без сети
+#
+# python src/replay.py recording.jsonl.gz [--speed 1] [--api-latency 0.05]
+#                      [--mtproto-latency 0.08] [--drive-latency 0.15]
+#                      [--no-rate-limit] [--cold]
+#
+# Запись делает сам бот при RECORD_FILE=... (см. recording.py). Каналы
+# восстанавливаются из снапшота сообщений (текст, entities, grouped_id, DC фото)
+# в фейковый Telethon из loadtest.py, Bot API — FakeSession, Drive — FakeDrive
+# в памяти. Апдейты подаются в dp.feed_update отдельными задачами с исходными
+# интервалами, делёнными на --speed (0 — без пауз). message_id в callback'ах
+# подменяются на id сообщений, которые бот отправил уже в этом прогоне.
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+# трассы прогона не нужны и не должны копиться рядом с кодом
+os.environ["TRACE_FILE"] = ""
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+
+import bot as app  # noqa: E402
+from loadtest import (  # noqa: E402
+    FakeSession, FakeTelegramClient, monitor_loop_lag, percentile, reset_state, synthetic_photo,
+)
+from outbound import RateLimitMiddleware  # noqa: E402
+from recording import decode_entities, load_recording  # noqa: E402
+from telethon_pool import PooledClient, TelethonPool  # noqa: E402
+
+
+# ----------------- Fake Drive -----------------
+class FakeDrive:
+    """Подменяет upload/download коллажей; вызывается из asyncio.to_thread, как настоящий."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.files: Dict[str, bytes] = {}
+        self.calls: Counter = Counter()
+
+    def _rpc(self, name: str):
+        self.calls[name] += 1
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def upload(self, collage_bytes: bytes, filename: str, folder_id: str) -> Optional[str]:
+        self._rpc("upload")
+        self.files[filename] = collage_bytes
+        return f"https://drive.google.com/uc?id={filename}"
+
+    def download(self, file_id: str) -> Optional[bytes]:
+        self._rpc("download")
+        return self.files.get(file_id)
+
+
+def build_channels(messages: Dict[str, Dict[int, Dict[str, Any]]]) -> Dict[str, Dict[int, SimpleNamespace]]:
+    channels = {}
+    for channel, records in messages.items():
+        channels[channel] = {
+            msg_id: SimpleNamespace(
+                id=msg_id,
+                message=record.get("text", ""),
+                entities=decode_entities(record.get("entities", [])),
+                grouped_id=record.get("grouped_id"),
+                photo=SimpleNamespace(dc_id=record["photo_dc"]) if "photo_dc" in record else None,
+            )
+            for msg_id, record in records.items()
+        }
+    return channels
+
+
+# ----------------- Replay -----------------
+def step_name(payload: Dict[str, Any]) -> str:
+    if "callback_query" in payload:
+        data = payload["callback_query"].get("data", "")
+        return data.split("_", 1)[0] if "_" in data else data
+    if "inline_query" in payload:
+        return "inline"
+    text = payload.get("message", {}).get("text", "")
+    if text in app.SUPERSEDING_TEXTS or text.startswith("/"):
+        return text.split()[0] if text.startswith("/") else text
+    return "text"
+
+
+def remap_callback(payload: Dict[str, Any], session: FakeSession) -> bool:
+    """
+    Привязать callback к сообщению этого прогона. False — сообщения нет
+    (например, запись началась посреди сессии пользователя); апдейт пропускается.
+    """
+    query = payload.get("callback_query")
+    if not query or "message" not in query:
+        return True
+    chat_id = query["message"]["chat"]["id"]
+    data = query.get("data", "")
+    if data in ("page_next", "page_prev", "subscribe"):
+        message_id = session.nav.get(chat_id)
+    elif data.startswith(("calc_", "full_")):
+        # карточку FakeSession помнит по кнопке калькулятора
+        calc_data = "calc_" + data.split("_", 1)[1]
+        message_id = next((mid for mid, d in session.cards[chat_id].items() if d == calc_data), None)
+    else:
+        return True
+    if message_id is None:
+        return False
+    query["message"]["message_id"] = message_id
+    return True
+
+
+async def replay(args, updates: List[Dict[str, Any]], session: FakeSession):
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    skipped = 0
+    tasks = []
+
+    # user_id -> задача его последнего апдейта
+    last: Dict[int, asyncio.Task] = {}
+
+    async def _feed(step: str, payload: Dict[str, Any], previous: Optional[asyncio.Task]):
+        nonlocal errors, skipped
+        if "callback_query" in payload:
+            # кнопку нажимали на уже показанном сообщении — ждём, пока бот его отправит
+            if previous is not None:
+                await asyncio.wait([previous])
+            if not remap_callback(payload, session):
+                skipped += 1
+                return
+        update = app.types.Update.model_validate(payload, context={"bot": app.bot})
+        start = time.perf_counter()
+        try:
+            await app.dp.feed_update(app.bot, update)
+        except Exception:
+            errors += 1
+            app.logger.exception(f"Replay step {step} failed")
+        latencies[step].append(time.perf_counter() - start)
+
+    lag: List[float] = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag))
+    started = time.perf_counter()
+    for record in updates:
+        if args.speed > 0:
+            delay = record["t"] / args.speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        payload = record["update"]
+        event = next((value for key, value in payload.items() if key != "update_id"), {})
+        user_id = event.get("from", {}).get("id")
+        task = asyncio.create_task(_feed(step_name(payload), payload, last.get(user_id)))
+        last[user_id] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+    return latencies, lag, elapsed, errors, skipped
+
+
+async def main_async(args):
+    channels, updates, messages = load_recording(args.recording)
+    if channels:
+        app.CHANNELS.clear()
+        app.CHANNELS.update(channels)
+        app.CHANNEL_PARSERS.clear()
+        app.CHANNEL_PARSERS.update({ch: app._channel_parser(ch, p) for ch, p in channels.items()})
+
+    temp_dir = tempfile.mkdtemp(prefix="replay_collages_")
+    app.TEMP_FOLDER = temp_dir
+    app.CACHE_FILE = os.path.join(temp_dir, "collage_url_cache.json")
+    drive = FakeDrive(args.drive_latency)
+    app.USE_DRIVE = True
+    app.upload_collage_to_drive = drive.upload
+    app.download_collage_from_drive = drive.download
+
+    session = FakeSession(args.api_latency)
+    app.bot = Bot(token="123456:REPLAY", session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    app.bot.session.middleware(app.BotApiTracingMiddleware())
+    if not args.no_rate_limit:
+        app.bot.session.middleware(RateLimitMiddleware(app.outbound, queue_warn=app.OUTBOUND_QUEUE_WARN))
+
+    client = FakeTelegramClient(build_channels(messages), args.mtproto_latency,
+                                [synthetic_photo(i) for i in range(6)])
+    app.telethon_pool = TelethonPool([
+        PooledClient(
+            "replay",
+            client,
+            initial=app.MAX_PARALLEL_DOWNLOADS,
+            min_limit=app.TELETHON_MIN_CONCURRENCY,
+            max_limit=app.TELETHON_MAX_CONCURRENCY,
+            default_timeout=app.TELETHON_CALL_TIMEOUT,
+        )
+    ])
+    app._telethon_started = None
+
+    try:
+        reset_state(temp_dir, warm_collages=False, cold=args.cold)
+        if not args.cold:
+            await app.sync_all_channels(full=True)
+        client.calls.clear()
+        span = updates[-1]["t"] if updates else 0.0
+        print(f"{len(updates)} updates over {span:.0f}s, "
+              f"{sum(len(m) for m in messages.values())} channel messages in {len(messages)} channels, "
+              f"speed {'max' if args.speed <= 0 else f'x{args.speed:g}'}\n")
+
+        latencies, lag, elapsed, errors, skipped = await replay(args, updates, session)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"== replayed {total} updates in {elapsed:.1f}s, errors={errors}, skipped={skipped}")
+    print(f"{'step':<22} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for step, values in sorted(latencies.items(), key=lambda kv: -len(kv[1])):
+        print(f"{step[:22]:<22} {len(values):>6} {percentile(values, 50) * 1000:>9.1f} "
+              f"{percentile(values, 99) * 1000:>9.1f} {max(values) * 1000:>9.1f}")
+    print(f"loop lag: p50={percentile(lag, 50) * 1000:.1f}ms p99={percentile(lag, 99) * 1000:.1f}ms "
+          f"max={max(lag, default=0.0) * 1000:.1f}ms")
+    print("Bot API calls:", ", ".join(f"{k}={v}" for k, v in session.calls.most_common()))
+    print("MTProto calls:", ", ".join(f"{k}={v}" for k, v in client.calls.most_common()))
+    print("Drive calls:", ", ".join(f"{k}={v}" for k, v in drive.calls.most_common()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded updates and channels through the real Dispatcher")
+    parser.add_argument("recording", help="файл RECORD_FILE (gzip JSON lines)")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение времени; 0 — без пауз")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="средняя задержка Bot API, сек")
+    parser.add_argument("--mtproto-latency", type=float, default=0.08, help="средняя задержка MTProto, сек")
+    parser.add_argument("--drive-latency", type=float, default=0.15, help="средняя задержка Drive, сек")
+    parser.add_argument("--no-rate-limit", action="store_true", help="без RateLimitMiddleware")
+    parser.add_argument("--cold", action="store_true", help="без индекса: первые поиски читают каналы")
+    args = parser.parse_args()
+
+    app.logging.getLogger().setLevel(app.logging.WARNING)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
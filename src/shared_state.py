@@ -0,0 +1,407 @@
+# shared_state.py — общее состояние для нескольких воркеров бота
+#
+# STATE_BACKEND=memory            — как раньше: обычные dict в процессе;
+# STATE_BACKEND=sqlite:////path.db — SQLite в WAL-режиме на общем томе:
+#   * namespace'ы ключ-значение (сессии, калькулятор, кэш Drive, история каналов);
+#   * lease'ы для выбора лидера (поллинг Bot API, синхронизация каналов);
+#   * очередь апдейтов по шардам (user_id % WORKER_COUNT).
+
+import asyncio
+import logging
+import math
+import pickle
+import sqlite3
+import threading
+import time
+from collections import deque
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# маркеры в очереди записи / inbox реплики
+_DELETED = object()
+_ACK = object()
+
+
+class _AsyncOps:
+    """Lease'ы и очередь апдейтов для вызова из event loop."""
+
+    async def acquire_lease_async(self, name: str, owner: str, ttl: float) -> bool:
+        return await self._offload(self.acquire_lease, name, owner, ttl)
+
+    async def release_lease_async(self, name: str, owner: str):
+        return await self._offload(self.release_lease, name, owner)
+
+    async def push_update_async(self, shard: int, payload: str):
+        return await self._offload(self.push_update, shard, payload)
+
+    async def pop_updates_async(self, shard: int, limit: int = 50) -> List[str]:
+        return await self._offload(self.pop_updates, shard, limit)
+
+
+class MemoryBackend(_AsyncOps):
+    """Всё в памяти одного процесса; lease всегда у текущего воркера."""
+
+    def __init__(self):
+        self._namespaces: Dict[str, Dict[Any, Any]] = {}
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._queues: Dict[int, List[str]] = {}
+
+    def mapping(self, namespace: str) -> MutableMapping:
+        return self._namespaces.setdefault(namespace, {})
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        holder = self._leases.get(name)
+        now = time.time()
+        if holder is None or holder[0] == owner or holder[1] < now:
+            self._leases[name] = (owner, now + ttl)
+            return True
+        return False
+
+    def release_lease(self, name: str, owner: str):
+        holder = self._leases.get(name)
+        if holder and holder[0] == owner:
+            del self._leases[name]
+
+    def push_update(self, shard: int, payload: str):
+        self._queues.setdefault(shard, []).append(payload)
+
+    def pop_updates(self, shard: int, limit: int = 50) -> List[str]:
+        queue = self._queues.get(shard, [])
+        batch, self._queues[shard] = queue[:limit], queue[limit:]
+        return batch
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        return True
+
+    async def _offload(self, fn, *args):
+        return fn(*args)
+
+
+class SQLiteBackend(_AsyncOps):
+    """
+    Один файл SQLite на общем томе. WAL позволяет читать параллельно
+    с записью из других процессов; значения сериализуются pickle.
+
+    Event loop в SQLite не ходит: у каждого namespace есть реплика в памяти
+    (SharedDict), записи копятся и пишутся пачками из потока-писателя, он же
+    раз в POLL_INTERVAL подтягивает чужие изменения по rev. Lease'ы и очередь
+    апдейтов — через *_async (asyncio.to_thread). busy_timeout короткий:
+    занятую базу поток повторяет сам, а не держит loop.
+    """
+
+    BUSY_TIMEOUT_MS = 250
+    POLL_INTERVAL = 0.5
+    TOMBSTONE_TTL = 3600        # сек; удалённые ключи нужны, пока их не увидели другие воркеры
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (ns, key) -> (значение или _DELETED, seq локальной записи)
+        self._pending: Dict[Tuple[str, Any], Tuple[Any, int]] = {}
+        self._wake = threading.Event()
+        self._flushed = threading.Condition(self._lock)
+        self._writing = False
+        self._dicts: Dict[str, "SharedDict"] = {}
+        self._own_revs: set = set()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        self._retry(self._create_schema, conn)
+        self._last_rev = conn.execute("SELECT COALESCE(MAX(rev), 0) FROM kv").fetchone()[0]
+        threading.Thread(target=self._sync_loop, name="state-sync", daemon=True).start()
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(kv)")]
+        if columns and "rev" not in columns:
+            # старая схема без rev: переносим значения
+            conn.executescript(
+                """
+                ALTER TABLE kv RENAME TO kv_old;
+                CREATE TABLE kv (ns TEXT NOT NULL, key BLOB NOT NULL, value BLOB,
+                                 rev INTEGER NOT NULL, updated REAL NOT NULL, PRIMARY KEY (ns, key));
+                INSERT INTO kv SELECT ns, key, value, 1, 0 FROM kv_old;
+                DROP TABLE kv_old;
+                """
+            )
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS kv (
+                ns TEXT NOT NULL,
+                key BLOB NOT NULL,
+                value BLOB,                 -- NULL: ключ удалён (tombstone)
+                rev INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (ns, key)
+            );
+            CREATE INDEX IF NOT EXISTS kv_rev ON kv (rev);
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS updates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                shard INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS updates_shard ON updates (shard, id);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _retry(fn, *args, attempts: int = 40):
+        """Повтор при занятой базе — только вне event loop (поток-писатель, to_thread)."""
+        for attempt in range(attempts):
+            try:
+                return fn(*args)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e) or attempt == attempts - 1:
+                    raise
+                time.sleep(min(0.05 * (attempt + 1), 0.5))
+
+    def mapping(self, namespace: str) -> MutableMapping:
+        shared = self._dicts.get(namespace)
+        if shared is None:
+            shared = self._dicts[namespace] = SharedDict(self, namespace, self._load(namespace))
+        return shared
+
+    def _load(self, ns: str) -> Dict[Any, Any]:
+        # при создании mapping'а (импорт модуля, до старта loop'а)
+        rows = self._conn().execute("SELECT key, value FROM kv WHERE ns=? AND value IS NOT NULL", (ns,))
+        return {pickle.loads(key): pickle.loads(value) for key, value in rows}
+
+    # ---------- kv: запись пачками и подтягивание чужих изменений ----------
+    def enqueue(self, ns: str, key, value, seq: int):
+        with self._lock:
+            self._pending[(ns, key)] = (value, seq)
+        self._wake.set()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Дождаться записи всего накопленного (тесты, остановка процесса)."""
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while self._pending or self._writing:
+                self._wake.set()
+                left = deadline - time.monotonic()
+                if left <= 0 or not self._flushed.wait(left):
+                    return False
+        return True
+
+    def _sync_loop(self):
+        last_prune = 0.0
+        while True:
+            self._wake.wait(self.POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self._write_pending()
+                self._poll()
+                if time.time() - last_prune > self.TOMBSTONE_TTL / 4:
+                    # строку с максимальным rev не трогаем: иначе rev следующей записи повторится
+                    self._retry(lambda: self._conn().execute(
+                        "DELETE FROM kv WHERE value IS NULL AND updated < ? AND rev < (SELECT MAX(rev) FROM kv)",
+                        (time.time() - self.TOMBSTONE_TTL,),
+                    ))
+                    last_prune = time.time()
+            except Exception:
+                logger.exception("Shared state sync failed")
+                time.sleep(self.POLL_INTERVAL)
+
+    def _write_pending(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._writing = bool(batch)
+        if not batch:
+            return
+        try:
+            self._write_batch(batch)
+        finally:
+            with self._flushed:
+                self._writing = False
+                self._flushed.notify_all()
+
+    def _write_batch(self, batch):
+        rows, acks = [], []
+        for (ns, key), (value, seq) in batch.items():
+            try:
+                raw = None if value is _DELETED else pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except RuntimeError:
+                # объект меняли во время сериализации — возьмём в следующую пачку
+                self._requeue({(ns, key): (value, seq)})
+                continue
+            rows.append((ns, pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL), raw))
+            acks.append((ns, key, seq))
+        if not rows:
+            return
+
+        def _write():
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rev = conn.execute("SELECT COALESCE(MAX(rev), 0) + 1 FROM kv").fetchone()[0]
+                now = time.time()
+                conn.executemany(
+                    "INSERT INTO kv (ns, key, value, rev, updated) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(ns, key) DO UPDATE SET value=excluded.value, rev=excluded.rev, "
+                    "updated=excluded.updated",
+                    [(ns, key, raw, rev, now) for ns, key, raw in rows],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return rev
+
+        try:
+            rev = self._retry(_write)
+        except Exception:
+            self._requeue(batch)
+            raise
+        self._own_revs.add(rev)
+        for ns, key, seq in acks:
+            self._dicts[ns].inbox.append((key, _ACK, rev, seq))
+
+    def _requeue(self, batch):
+        with self._lock:
+            for item, entry in batch.items():
+                # более новая локальная запись того же ключа важнее
+                self._pending.setdefault(item, entry)
+
+    def _poll(self):
+        rows = self._conn().execute(
+            "SELECT ns, key, value, rev FROM kv WHERE rev > ? ORDER BY rev", (self._last_rev,)
+        ).fetchall()
+        for ns, key, value, rev in rows:
+            self._last_rev = max(self._last_rev, rev)
+            shared = self._dicts.get(ns)
+            if shared is None or rev in self._own_revs:
+                continue
+            shared.inbox.append((pickle.loads(key), _DELETED if value is None else pickle.loads(value), rev, 0))
+        self._own_revs = {rev for rev in self._own_revs if rev > self._last_rev}
+
+    # ---------- leases ----------
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires=excluded.expires "
+            "WHERE leases.owner=excluded.owner OR leases.expires < ?",
+            (name, owner, now + ttl, now),
+        )
+        row = conn.execute("SELECT owner FROM leases WHERE name=?", (name,)).fetchone()
+        return bool(row and row[0] == owner)
+
+    def release_lease(self, name: str, owner: str):
+        self._conn().execute("DELETE FROM leases WHERE name=? AND owner=?", (name, owner))
+
+    # ---------- очередь апдейтов ----------
+    def push_update(self, shard: int, payload: str):
+        self._conn().execute("INSERT INTO updates (shard, payload) VALUES (?, ?)", (shard, payload))
+
+    def pop_updates(self, shard: int, limit: int = 50) -> List[str]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload FROM updates WHERE shard=? ORDER BY id LIMIT ?", (shard, limit)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM updates WHERE shard=? AND id<=?", (shard, rows[-1][0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [payload for _, payload in rows]
+
+    async def _offload(self, fn, *args):
+        return await asyncio.to_thread(self._retry, fn, *args)
+
+
+class SharedDict(MutableMapping):
+    """
+    dict-подобная реплика namespace SQLiteBackend: чтения — из памяти, записи —
+    в память и в очередь потока-писателя. Изменение вложенного объекта нужно
+    записать обратно: d[k] = obj. Чужие изменения приходят в inbox и
+    применяются при следующем обращении, если ключ не переписан локально позже.
+    """
+
+    def __init__(self, backend: SQLiteBackend, namespace: str, data: Dict[Any, Any]):
+        self._backend = backend
+        self._ns = namespace
+        self.replica = data
+        # ключ -> rev значения в реплике; inf — локальная запись ещё не в базе
+        self._revs: Dict[Any, float] = {key: 0 for key in data}
+        self._seq: Dict[Any, int] = {}
+        # (ключ, значение | _DELETED | _ACK, rev, seq) из потока синхронизации
+        self.inbox: deque = deque()
+
+    def _drain(self):
+        inbox = self.inbox
+        while inbox:
+            key, value, rev, seq = inbox.popleft()
+            if value is _ACK:
+                if self._seq.get(key) == seq:
+                    self._revs[key] = rev
+                    del self._seq[key]
+            elif rev > self._revs.get(key, 0):
+                self._revs[key] = rev
+                if value is _DELETED:
+                    self.replica.pop(key, None)
+                else:
+                    self.replica[key] = value
+
+    def _write(self, key, value):
+        seq = self._seq.get(key, 0) + 1
+        self._seq[key] = seq
+        self._revs[key] = math.inf
+        self._backend.enqueue(self._ns, key, value, seq)
+
+    def __getitem__(self, key):
+        self._drain()
+        return self.replica[key]
+
+    def __setitem__(self, key, value):
+        self._drain()
+        self.replica[key] = value
+        self._write(key, value)
+
+    def __delitem__(self, key):
+        self._drain()
+        del self.replica[key]
+        self._write(key, _DELETED)
+
+    def __iter__(self) -> Iterator:
+        # снимок ключей: удалять во время обхода можно
+        self._drain()
+        return iter(list(self.replica))
+
+    def __len__(self) -> int:
+        self._drain()
+        return len(self.replica)
+
+    def __contains__(self, key) -> bool:
+        self._drain()
+        return key in self.replica
+
+
+def make_backend(url: Optional[str]):
+    """
+    'memory' (по умолчанию), 'sqlite:///относительный.db' или 'sqlite:////абсолютный/путь.db'.
+    """
+    if not url or url == "memory":
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    raise ValueError(f"Unknown STATE_BACKEND: {url}")
@@ -0,0 +1,111 @@
+# snapshot.py — бинарный снапшот индекса для быстрого холодного старта
+#
+# Формат файла:
+#   magic (8 байт) | версия Python major, minor (2 x u8) | число секций (u16)
+#   таблица секций: имя (16 байт, ascii) | offset (u64) | length (u64) | crc32 (u32)
+#   секции: marshal-сериализованные объекты (dict/list/tuple/str/float/int/None)
+#
+# Файл открывается через mmap, секция декодируется только при первом обращении.
+# marshal зависит от версии Python — чужой снапшот просто игнорируется.
+
+import logging
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KORSNAP\x01"
+_HEADER = struct.Struct("<8sBBH")
+_ENTRY = struct.Struct("<16sQQI")
+
+
+def write_snapshot(path: str, sections: Dict[str, Any]):
+    """
+    Атомарно записать снапшот: во временный файл, fsync, os.replace.
+    """
+    payloads = []
+    for name, obj in sections.items():
+        if len(name.encode("ascii")) > 16:
+            raise ValueError(f"Section name too long: {name}")
+        payloads.append((name, marshal.dumps(obj)))
+
+    offset = _HEADER.size + _ENTRY.size * len(payloads)
+    table = []
+    for name, data in payloads:
+        table.append(_ENTRY.pack(name.encode("ascii"), offset, len(data), zlib.crc32(data)))
+        offset += len(data)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, sys.version_info[0], sys.version_info[1], len(payloads)))
+        for entry in table:
+            f.write(entry)
+        for _, data in payloads:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._sections: Dict[str, Tuple[int, int, int]] = {}
+        self._decoded: Dict[str, Any] = {}
+        self._parse_header()
+
+    def _parse_header(self):
+        magic, major, minor, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an index snapshot")
+        if (major, minor) != sys.version_info[:2]:
+            raise ValueError(f"Snapshot written by Python {major}.{minor}")
+        pos = _HEADER.size
+        for _ in range(count):
+            raw_name, offset, length, crc = _ENTRY.unpack_from(self._mm, pos)
+            pos += _ENTRY.size
+            if offset + length > len(self._mm):
+                raise ValueError("Truncated snapshot")
+            self._sections[raw_name.rstrip(b"\0").decode("ascii")] = (offset, length, crc)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def section(self, name: str, default: Any = None) -> Any:
+        if name in self._decoded:
+            return self._decoded[name]
+        if name not in self._sections:
+            return default
+        offset, length, crc = self._sections[name]
+        with memoryview(self._mm)[offset:offset + length] as view:
+            if zlib.crc32(view) != crc:
+                raise ValueError(f"Snapshot section {name} is corrupted")
+            obj = marshal.loads(view)
+        self._decoded[name] = obj
+        return obj
+
+    def close(self):
+        self._decoded.clear()
+        self._mm.close()
+        self._file.close()
+
+
+def load_snapshot(path: str) -> Optional[Snapshot]:
+    if not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except Exception as e:
+        logger.warning(f"Index snapshot {path} ignored: {e}")
+        return None
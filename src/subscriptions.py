@@ -0,0 +1,179 @@
+# subscriptions.py — сохранённые поиски и их индекс для новых постов
+#
+# Подписка — тот же фильтр, что и в поиске: интервал площади плюс цена за м²
+# (офисы) или берег (склады). Одинаковые фильтры у разных пользователей
+# хранятся одной группой, а группы одного типа — в дереве интервалов по
+# площади. Новый оффер — точка (size, price_per_m2): дерево находит группы,
+# чей интервал площади её содержит, за O(log g + k), остальные условия
+# проверяются один раз на группу, а не на каждого подписчика.
+
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from offers import Offer
+
+
+@dataclass(frozen=True)
+class Subscription:
+    type: str                           # 'office' | 'warehouse'
+    min_size: float = 0.0
+    max_size: float = math.inf
+    min_ppm: float = 0.0
+    max_ppm: float = math.inf
+    shore: Optional[str] = None         # склады: 'Лівий' / 'Правий'
+
+    @classmethod
+    def for_offices(cls, min_size, max_size, min_ppm, max_ppm) -> "Subscription":
+        return cls(
+            'office',
+            float(min_size or 0),
+            math.inf if max_size is None else float(max_size),
+            float(min_ppm or 0),
+            math.inf if max_ppm is None else float(max_ppm),
+        )
+
+    @classmethod
+    def for_warehouses(cls, shore: Optional[str], size_choice: Optional[str]) -> "Subscription":
+        if size_choice == "<=1000":
+            return cls('warehouse', 0.0, 1000.0, shore=shore)
+        if size_choice == ">1000":
+            return cls('warehouse', 1000.0, math.inf, shore=shore)
+        return cls('warehouse', shore=shore)
+
+    def size_interval(self) -> Tuple[float, float]:
+        return self.min_size, self.max_size
+
+    def matches_rest(self, offer: Offer) -> bool:
+        """Всё, кроме площади (её проверяет дерево)."""
+        if offer.type != self.type:
+            return False
+        if not (self.min_ppm <= offer.price_per_m2 <= self.max_ppm):
+            return False
+        if self.shore:
+            if not offer.shore or not offer.shore.lower().startswith(self.shore[:3].lower()):
+                return False
+        return True
+
+    def matches(self, offer: Offer) -> bool:
+        return self.min_size <= offer.size <= self.max_size and self.matches_rest(offer)
+
+    def describe(self) -> str:
+        def bound(lo, hi, unit):
+            if hi == math.inf:
+                return f"від {lo:g}{unit}"
+            if lo == 0:
+                return f"до {hi:g}{unit}"
+            return f"{lo:g}–{hi:g}{unit}"
+
+        parts = ["Офіс" if self.type == 'office' else "Склад"]
+        if self.shore:
+            parts.append(f"{self.shore} берег")
+        if self.min_size or self.max_size != math.inf:
+            parts.append(bound(self.min_size, self.max_size, " м²"))
+        if self.min_ppm or self.max_ppm != math.inf:
+            parts.append(bound(self.min_ppm, self.max_ppm, "$/м²"))
+        return ", ".join(parts)
+
+
+class IntervalTree:
+    """
+    Статическое центрированное дерево замкнутых интервалов [lo, hi].
+    stab(x) отдаёт payload всех интервалов, содержащих x, за O(log n + k).
+    """
+
+    __slots__ = ("center", "by_lo", "by_hi", "left", "right")
+
+    def __init__(self, intervals: List[Tuple[float, float, object]]):
+        endpoints = sorted(p for lo, hi, _ in intervals for p in (lo, hi))
+        self.center = endpoints[len(endpoints) // 2]
+        left, right, here = [], [], []
+        for item in intervals:
+            if item[1] < self.center:
+                left.append(item)
+            elif item[0] > self.center:
+                right.append(item)
+            else:
+                here.append(item)
+        self.by_lo = sorted(here, key=lambda i: i[0])
+        self.by_hi = sorted(here, key=lambda i: i[1], reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    @classmethod
+    def build(cls, intervals: List[Tuple[float, float, object]]) -> Optional["IntervalTree"]:
+        # пустой интервал (lo > hi) ничего не содержит, а дерево на нём не сходится
+        intervals = [item for item in intervals if item[0] <= item[1]]
+        return cls(intervals) if intervals else None
+
+    def stab(self, x: float) -> Iterator[object]:
+        node = self
+        while node is not None:
+            if x < node.center:
+                for lo, _, payload in node.by_lo:
+                    if lo > x:
+                        break
+                    yield payload
+                node = node.left
+            elif x > node.center:
+                for _, hi, payload in node.by_hi:
+                    if hi < x:
+                        break
+                    yield payload
+                node = node.right
+            else:
+                for _, _, payload in node.by_lo:
+                    yield payload
+                return
+
+
+class SubscriptionIndex:
+    """
+    Подписка -> множество user_id. Дерево по типу оффера перестраивается
+    лениво и только когда появляется или исчезает целая группа.
+    """
+
+    def __init__(self):
+        self._groups: Dict[Subscription, Set[int]] = {}
+        self._trees: Dict[str, Optional[IntervalTree]] = {}
+        self._dirty: Set[str] = set()
+
+    def add(self, user_id: int, sub: Subscription):
+        users = self._groups.get(sub)
+        if users is None:
+            users = self._groups[sub] = set()
+            self._dirty.add(sub.type)
+        users.add(user_id)
+
+    def discard(self, user_id: int, sub: Subscription):
+        users = self._groups.get(sub)
+        if not users:
+            return
+        users.discard(user_id)
+        if not users:
+            del self._groups[sub]
+            self._dirty.add(sub.type)
+
+    def _tree(self, offer_type: str) -> Optional[IntervalTree]:
+        if offer_type in self._dirty or offer_type not in self._trees:
+            self._trees[offer_type] = IntervalTree.build([
+                (*sub.size_interval(), sub) for sub in self._groups if sub.type == offer_type
+            ])
+            self._dirty.discard(offer_type)
+        return self._trees[offer_type]
+
+    def match(self, offer: Offer) -> Set[int]:
+        users: Set[int] = set()
+        tree = self._tree(offer.type)
+        if tree is None:
+            return users
+        for sub in tree.stab(offer.size):
+            if sub.matches_rest(offer):
+                users |= self._groups[sub]
+        return users
+
+    def groups(self) -> int:
+        return len(self._groups)
+
+    def __len__(self) -> int:
+        return sum(len(users) for users in self._groups.values())
@@ -0,0 +1,237 @@
+# telethon_pool.py — пул пользовательских сессий Telethon
+#
+# Каждая сессия — отдельный TelegramClient со своим соединением и своими
+# AIMD-лимитерами. Запросы уходят на наименее загруженный клиент; если
+# клиент словил FloodWait, он на это время выпадает из ротации, а запрос
+# повторяется на следующем. Кэш пиров и индекс альбомов — общие для пула.
+# get_messages по id разных корутин склеиваются MessageBatcher'ом в один запрос.
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+from adaptive import AdaptiveLimiter, LimiterGroup
+
+logger = logging.getLogger(__name__)
+
+
+class PeerCache:
+    """
+    username -> InputPeer. access_hash у каждого аккаунта свой,
+    поэтому ключ — (имя сессии, username); хранилище одно на весь пул.
+    """
+
+    def __init__(self):
+        self._peers: Dict[Tuple[str, str], Any] = {}
+
+    def get(self, session: str, username: str):
+        return self._peers.get((session, username.lower()))
+
+    def put(self, session: str, username: str, peer):
+        self._peers[(session, username.lower())] = peer
+
+    def __len__(self):
+        return len(self._peers)
+
+
+class AlbumIndex:
+    """
+    (канал, grouped_id) -> отсортированные id сообщений альбома.
+    id сообщений в канале одинаковы для всех аккаунтов.
+    """
+
+    def __init__(self):
+        self._group_of: Dict[Tuple[str, int], int] = {}
+        self._members: Dict[Tuple[str, int], List[int]] = {}
+
+    def add(self, channel: str, grouped_id: int, msg_ids: Iterable[int]):
+        key = (channel, grouped_id)
+        ids = sorted(set(self._members.get(key, [])) | set(msg_ids))
+        self._members[key] = ids
+        for mid in ids:
+            self._group_of[(channel, mid)] = grouped_id
+
+    def lookup(self, channel: str, msg_id: int) -> Optional[List[int]]:
+        grouped_id = self._group_of.get((channel, msg_id))
+        if grouped_id is None:
+            return None
+        return self._members.get((channel, grouped_id))
+
+    def items(self):
+        return self._members.items()
+
+    def __len__(self):
+        return len(self._members)
+
+
+class MessageBatcher:
+    """
+    get_messages(ids=...) от разных корутин за window секунд — одним запросом
+    на (клиент, канал). Сообщения нужны тому же клиенту, что их получил:
+    access_hash фото у каждого аккаунта свой, поэтому ключ включает сессию.
+    Больше 100 id Telethon сам разбивает на части.
+    """
+
+    def __init__(self, window: float = 0.01):
+        self.window = window
+        self._pending: Dict[Tuple[str, str], Tuple[set, asyncio.Future]] = {}
+        # сильные ссылки на задачи _flush: loop держит задачи только слабо
+        self._flushes: set = set()
+        self.requests = 0
+        self.batches = 0
+
+    async def get(self, pool: "TelethonPool", pc: "PooledClient", channel_username: str,
+                  ids: Iterable[int]) -> Dict[int, Any]:
+        key = (pc.name, channel_username)
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = (set(), loop.create_future())
+            # запрос нашего пира/истории может упасть, когда ждать уже некому
+            pending[1].add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._pending[key] = pending
+            loop.call_later(self.window, self._start_flush, pool, pc, channel_username)
+        pending[0].update(ids)
+        self.requests += 1
+        return await asyncio.shield(pending[1])
+
+    def _start_flush(self, pool: "TelethonPool", pc: "PooledClient", channel_username: str):
+        task = asyncio.ensure_future(self._flush(pool, pc, channel_username))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, pool: "TelethonPool", pc: "PooledClient", channel_username: str):
+        ids, future = self._pending.pop((pc.name, channel_username))
+        self.batches += 1
+        ordered = sorted(ids)
+        try:
+            channel = await pool.get_peer(pc, channel_username)
+            messages = await pc.history.run(lambda: pc.client.get_messages(channel, ids=ordered), retry_flood=False)
+        except BaseException as e:
+            future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        future.set_result({m.id: m for m in messages if m})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "batches": self.batches}
+
+
+class PooledClient:
+    def __init__(self, name: str, client: TelegramClient, **limiter_kwargs):
+        self.name = name
+        self.client = client
+        self.history = AdaptiveLimiter(f"{name}:history", **limiter_kwargs)
+        self.media = LimiterGroup(f"{name}:media", **limiter_kwargs)
+        self.active = 0
+        self.paused_until = 0.0
+        self.authorized = True
+
+    def is_available(self) -> bool:
+        return self.authorized and self.paused_until <= time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "paused_for": max(0.0, round(self.paused_until - time.monotonic(), 1)),
+            "authorized": self.authorized,
+            "history": self.history.stats(),
+            "media": self.media.stats(),
+        }
+
+
+class TelethonPool:
+    def __init__(self, clients: List[PooledClient]):
+        if not clients:
+            raise ValueError("TelethonPool needs at least one client")
+        self.clients = clients
+        self.peers = PeerCache()
+        self.albums = AlbumIndex()
+        self.messages = MessageBatcher()
+
+    @classmethod
+    def from_sessions(cls, session_names: Iterable[str], api_id, api_hash, **limiter_kwargs) -> "TelethonPool":
+        clients = [
+            PooledClient(name, TelegramClient(name, api_id, api_hash), **limiter_kwargs)
+            for name in session_names
+        ]
+        return cls(clients)
+
+    @property
+    def primary(self) -> PooledClient:
+        return self.clients[0]
+
+    async def ensure_connected(self):
+        for pc in self.clients:
+            if not pc.client.is_connected():
+                try:
+                    await pc.client.connect()
+                except Exception:
+                    await pc.client.start()
+            # если не авторизован – предупредим и уберём из ротации
+            try:
+                pc.authorized = await pc.client.is_user_authorized()
+                if not pc.authorized:
+                    logger.warning(f"Telethon session {pc.name} is not authorized!")
+            except Exception:
+                pass
+
+    def pick(self, exclude: Iterable[str] = ()) -> PooledClient:
+        excluded = set(exclude)
+        candidates = [pc for pc in self.clients if pc.name not in excluded and pc.authorized]
+        if not candidates:
+            candidates = [pc for pc in self.clients if pc.name not in excluded] or self.clients
+        available = [pc for pc in candidates if pc.is_available()]
+        if available:
+            return min(available, key=lambda pc: (pc.active, pc.history.load))
+        # все на паузе — берём того, кто освободится раньше
+        return min(candidates, key=lambda pc: pc.paused_until)
+
+    async def get_peer(self, pc: PooledClient, username: str):
+        peer = self.peers.get(pc.name, username)
+        if peer is None:
+            peer = await pc.history.run(lambda: pc.client.get_input_entity(username), retry_flood=False)
+            self.peers.put(pc.name, username, peer)
+        return peer
+
+    async def run(self, fn: Callable[[PooledClient], Awaitable[Any]], timeout: float = 60.0) -> Any:
+        """
+        Выполнить fn(client) на наименее загруженном клиенте.
+        FloodWait внутри fn снимает клиент с ротации и повторяет fn на другом;
+        если на паузе все — ждём первого освободившегося, пока не истёк timeout.
+        """
+        deadline = time.monotonic() + timeout
+        tried: List[str] = []
+        last_error: Optional[FloodWaitError] = None
+        while True:
+            if len(tried) >= len(self.clients):
+                wait = min(pc.paused_until for pc in self.clients) - time.monotonic()
+                if last_error is not None and time.monotonic() + wait > deadline:
+                    raise last_error
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                tried.clear()
+            pc = self.pick(exclude=tried)
+            pc.active += 1
+            try:
+                return await fn(pc)
+            except FloodWaitError as e:
+                last_error = e
+                pc.paused_until = max(pc.paused_until, time.monotonic() + e.seconds)
+                tried.append(pc.name)
+                logger.warning(f"Session {pc.name} FloodWait {e.seconds}s, failing over")
+            finally:
+                pc.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": {pc.name: pc.stats() for pc in self.clients},
+            "peers": len(self.peers),
+            "albums": len(self.albums),
+            "get_messages": self.messages.stats(),
+        }
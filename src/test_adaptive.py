@@ -0,0 +1,140 @@
+# test_adaptive.py — AIMD-лимитер вызовов Telethon: рост, деление на FloodWait, повторы
+#
+#   cd src && python -m pytest -q test_adaptive.py
+
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+
+import adaptive
+from adaptive import AdaptiveLimiter, LimiterGroup
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(adaptive, "RETRY_BACKOFF", 0.001)
+
+
+def test_success_grows_limit_additively_up_to_max():
+    limiter = AdaptiveLimiter("t", initial=4, max_limit=5)
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.limit == pytest.approx(5.0, abs=0.2)
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 5.0
+
+
+def test_flood_halves_limit_once_per_burst_and_pauses():
+    async def run():
+        limiter = AdaptiveLimiter("t", initial=8, min_limit=1)
+        limiter.on_flood(1)
+        limiter.on_flood(1)     # одновременный FloodWait — то же событие
+        return limiter
+
+    limiter = asyncio.run(run())
+    assert limiter.limit == 4.0
+    assert limiter.floods == 2
+    assert limiter.is_paused()
+
+
+def test_limit_never_drops_below_min():
+    async def run():
+        limiter = AdaptiveLimiter("t", initial=3, min_limit=2)
+        limiter.on_flood(0)
+        return limiter.limit
+
+    assert asyncio.run(run()) == 2.0
+
+
+def test_concurrency_is_capped_by_limit():
+    limiter = AdaptiveLimiter("t", initial=3, max_limit=3)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(limiter.run(call) for _ in range(12)))
+
+    asyncio.run(run())
+    assert peak == 3
+    assert limiter.in_flight == 0
+
+
+def test_flood_wait_is_retried_within_deadline():
+    limiter = AdaptiveLimiter("t", initial=4)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) == 1:
+            raise FloodWaitError(request=None, capture=0)
+        return "ok"
+
+    assert asyncio.run(limiter.run(call, timeout=5)) == "ok"
+    assert limiter.floods == 1 and limiter.in_flight == 0
+
+
+def test_flood_wait_past_deadline_is_raised():
+    limiter = AdaptiveLimiter("t")
+
+    async def call():
+        raise FloodWaitError(request=None, capture=60)
+
+    with pytest.raises(FloodWaitError):
+        asyncio.run(limiter.run(call, timeout=1))
+    assert limiter.in_flight == 0
+
+
+def test_retry_flood_false_raises_immediately():
+    limiter = AdaptiveLimiter("t")
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise FloodWaitError(request=None, capture=0)
+
+    with pytest.raises(FloodWaitError):
+        asyncio.run(limiter.run(call, timeout=5, retry_flood=False))
+    assert len(calls) == 1
+
+
+def test_transient_errors_are_retried_with_backoff():
+    limiter = AdaptiveLimiter("t")
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert asyncio.run(limiter.run(call, timeout=5)) == "ok"
+    assert len(calls) == 3 and limiter.in_flight == 0
+
+
+def test_other_errors_are_not_retried():
+    limiter = AdaptiveLimiter("t")
+
+    async def call():
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        asyncio.run(limiter.run(call))
+    assert limiter.in_flight == 0
+
+
+def test_limiter_group_isolates_keys():
+    async def run():
+        group = LimiterGroup("dc", initial=8)
+        group.get(2).on_flood(1)
+        return group
+
+    group = asyncio.run(run())
+    assert group.get(2).limit == 4.0
+    assert group.get(4).limit == 8.0
+    assert set(group.stats()) == {"2", "4"}
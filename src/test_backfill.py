@@ -0,0 +1,76 @@
+# test_backfill.py — полное чтение канала диапазонами id: план, сборка истории, возобновление
+#
+#   cd src && python -m pytest -q test_backfill.py
+
+import asyncio
+import os
+import time
+
+os.environ.setdefault("TRACE_FILE", "")
+
+import pytest  # noqa: E402
+
+import bot  # noqa: E402
+from loadtest import FakeTelegramClient, generate_office_channel  # noqa: E402
+from telethon_pool import PooledClient, TelethonPool  # noqa: E402
+
+CHANNEL = next(ch for ch, profile in bot.CHANNELS.items() if profile == "office")
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    messages = generate_office_channel(1500)         # id 1..4500 — три диапазона
+    client = FakeTelegramClient({CHANNEL: messages}, 0.0, [])
+    pool = TelethonPool([PooledClient("test", client, initial=4, min_limit=1, max_limit=8, default_timeout=30)])
+    monkeypatch.setattr(bot, "telethon_pool", pool)
+    bot.backfill_progress.clear()
+    bot.backfill_chunks.clear()
+    yield messages
+    bot.backfill_progress.clear()
+    bot.backfill_chunks.clear()
+
+
+def _texts(history):
+    return [(text, msg_id) for text, msg_id, _ in history]
+
+
+def test_backfill_ranges_cover_ids_newest_first():
+    assert bot.backfill_ranges(4500, size=2000) == [(4001, 4500), (2001, 4000), (1, 2000)]
+    assert bot.backfill_ranges(2000, size=2000) == [(1, 2000)]
+    assert bot.backfill_ranges(0, size=2000) == []
+
+
+def test_backfill_ranges_keep_old_boundaries_when_channel_grows():
+    before, after = bot.backfill_ranges(4500, size=2000), bot.backfill_ranges(7100, size=2000)
+    assert after[-len(before) + 1:] == before[1:]
+    assert after[len(after) - len(before)] == (4001, 6000)
+
+
+def test_backfill_reads_whole_channel_newest_first(channel):
+    history = asyncio.run(bot.backfill_channel_history(CHANNEL))
+    # подписи альбома — только у первого фото, пустые сообщения в историю не попадают
+    expected = sorted(((m.message, m.id) for m in channel.values() if m.message), key=lambda x: -x[1])
+    assert _texts(history) == expected
+    # прогресс и куски после сборки не остаются в общем состоянии
+    assert CHANNEL not in bot.backfill_progress
+    assert len(bot.backfill_chunks) == 0
+
+
+def test_backfill_resumes_from_saved_ranges(channel):
+    oldest = bot.backfill_ranges(max(channel))[-1]
+    bot.backfill_progress[CHANNEL] = {'top': 0, 'done': {oldest: 1}, 'started': time.time()}
+    bot.backfill_chunks[(CHANNEL, *oldest)] = [("SAVED", 1, [["MessageEntityTextUrl", 0, 5, "https://x"]])]
+    history = asyncio.run(bot.backfill_channel_history(CHANNEL))
+    assert history[-1][:2] == ("SAVED", 1)
+    assert history[-1][2][0].url == "https://x"
+    assert all(msg_id > oldest[1] for _, msg_id, _ in history[:-1])
+
+
+def test_backfill_discards_stale_progress(channel):
+    oldest = bot.backfill_ranges(max(channel))[-1]
+    started = time.time() - bot.CHANNEL_HISTORY_TTL - 60
+    bot.backfill_progress[CHANNEL] = {'top': 0, 'done': {oldest: 1}, 'started': started}
+    bot.backfill_chunks[(CHANNEL, *oldest)] = [("STALE", 1, [])]
+    history = asyncio.run(bot.backfill_channel_history(CHANNEL))
+    assert "STALE" not in {text for text, _, _ in history}
+    assert len(history) == sum(1 for m in channel.values() if m.message)
@@ -0,0 +1,111 @@
+# test_channel_parsing.py — разбор постов каналов, фильтры и потоковый top-k холодного пути
+#
+#   cd src && python -m pytest -q test_channel_parsing.py
+
+import asyncio
+import os
+import random
+
+os.environ.setdefault("TRACE_FILE", "")
+
+import bot  # noqa: E402
+from loadtest import generate_office_channel  # noqa: E402
+from telethon.tl.types import MessageEntityTextUrl  # noqa: E402
+
+OFFICE_POST = (
+    "Бізнес-центр Парус\n"
+    "Клас A\n"
+    "3-й поверх 150m2 (3000$)\n"
+    "7-й поверх 320.5m2 (6410$)\n"
+    "м. Палац Спорту"
+)
+
+WAREHOUSE_POST = (
+    "Склад на Оболоні\n"
+    "📍 Адреса: вул. Електриків, 1\n"
+    "Берег: Правий\n"
+    "Висота стелі 8.5m\n"
+    "Клас: B\n"
+    "Склад опалювальний 1200m2 (6000$) (https://example.com/sklad)\n"
+    "Рампа 300m2 (1800$)"
+)
+
+
+def _channel_messages(posts: int = 60, seed: int = 3):
+    return [(m.message, m.id, m.entities) for m in generate_office_channel(posts, seed).values()]
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def test_iter_offices_yields_one_offer_per_floor():
+    offers = list(bot.iter_offices([(OFFICE_POST, 42, [])], "@offices"))
+    assert [(o.floor, o.size, o.price_total, o.price_per_m2) for o in offers] == [
+        ("3-й поверх", 150.0, 3000.0, 20.0),
+        ("7-й поверх", 320.5, 6410.0, 20.0),
+    ]
+    assert all(o.bc_name == "Парус" and o.bc_class == "A" for o in offers)
+    assert all(o.channel == "@offices" and o.link == "https://t.me/offices/42" for o in offers)
+
+
+def test_iter_offices_takes_link_from_nearest_entity():
+    entity = MessageEntityTextUrl(offset=OFFICE_POST.index("7-й"), length=3, url="https://example.com/7")
+    offers = list(bot.iter_offices([(OFFICE_POST, 42, [entity])], "@offices"))
+    assert offers[1].link == "https://example.com/7"
+
+
+def test_iter_offices_skips_empty_messages():
+    assert list(bot.iter_offices([("", 1, []), (None, 2, [])], "@offices")) == []
+
+
+def test_iter_warehouses():
+    offers = list(bot.iter_warehouses([(WAREHOUSE_POST, 7, [])], "@sklad"))
+    assert [(o.desc, o.size, o.price_total, o.link) for o in offers] == [
+        ("Склад опалювальний", 1200.0, 6000.0, "https://example.com/sklad"),
+        ("Рампа", 300.0, 1800.0, "https://t.me/sklad/7"),
+    ]
+    first = offers[0]
+    assert (first.bc_name, first.addr, first.shore, first.height, first.w_class) == (
+        "Склад на Оболоні", "вул. Електриків, 1", "Правий", 8.5, "B")
+
+
+def test_office_filter():
+    offers = list(bot.iter_offices([(OFFICE_POST, 42, [])], "@offices"))
+    assert [o.floor for o in offers if bot.office_filter(100, 200)(o)] == ["3-й поверх"]
+    assert [o.floor for o in offers if bot.office_filter(300, None)(o)] == ["7-й поверх"]
+    assert [o.floor for o in offers if bot.office_filter(0, None, max_price_per_m2=19)(o)] == []
+
+
+def test_warehouse_filter():
+    offers = list(bot.iter_warehouses([(WAREHOUSE_POST, 7, [])], "@sklad"))
+    assert [o.desc for o in offers if bot.warehouse_filter("Прав", "<=1000")(o)] == ["Рампа"]
+    assert [o.desc for o in offers if bot.warehouse_filter("Лів", None)(o)] == []
+    assert len([o for o in offers if bot.warehouse_filter(None, ">1000")(o)]) == 1
+
+
+def test_top_k_matches_full_sort():
+    offers = list(bot.iter_offices(_channel_messages(), "@offices"))
+    matches = bot.office_filter(100, 1000)
+    expected = sorted((o for o in offers if matches(o)), key=lambda o: o.price_total)
+    for k in (1, 5, len(expected), len(expected) + 10):
+        found = asyncio.run(bot.top_k_offers(_aiter(offers), matches, k))
+        assert found == expected[:k]
+
+
+def test_top_k_keeps_first_seen_on_equal_price():
+    offers = list(bot.iter_offices(_channel_messages(10), "@offices"))
+    for offer in offers:
+        offer.price_total = 1000.0
+    random.Random(1).shuffle(offers)
+    found = asyncio.run(bot.top_k_offers(_aiter(offers), lambda o: True, 4))
+    assert found == offers[:4]
+
+
+def test_channel_parser_sorts_by_price():
+    channel = next(ch for ch, profile in bot.CHANNELS.items() if profile == "office")
+    parse = bot.CHANNEL_PARSERS[channel]
+    offers = parse(_channel_messages())
+    assert [o.price_total for o in offers] == sorted(o.price_total for o in offers)
+    assert len(offers) == len(list(bot.iter_offices(_channel_messages(), channel)))
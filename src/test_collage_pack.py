@@ -0,0 +1,165 @@
+# test_collage_pack.py — pack-файл коллажей: дописывание, переоткрытие, битый хвост, compact
+#
+#   cd src && python -m pytest -q test_collage_pack.py
+
+import asyncio
+import os
+
+import pytest
+
+from collage_pack import CollageInputFile, CollagePack
+
+
+@pytest.fixture
+def pack_path(tmp_path):
+    return str(tmp_path / "collages-0.pack")
+
+
+def _jpeg(seed: int, size: int = 3000) -> bytes:
+    return bytes((seed * 31 + i) % 251 for i in range(size))
+
+
+def test_put_get(pack_path):
+    pack = CollagePack(pack_path)
+    view = pack.put("parus_3", _jpeg(1))
+    assert isinstance(view, memoryview) and bytes(view) == _jpeg(1)
+    assert bytes(pack.get("parus_3")) == _jpeg(1)
+    assert pack.get("missing") is None
+    assert "parus_3" in pack and len(pack) == 1
+    assert (pack.stats()["hits"], pack.stats()["misses"]) == (1, 1)
+    with pytest.raises(ValueError):
+        pack.put("empty", b"")
+
+
+def test_overwrite_and_discard(pack_path):
+    pack = CollagePack(pack_path)
+    pack.put("a", _jpeg(1))
+    pack.put("a", _jpeg(2, 500))
+    pack.put("b", _jpeg(3))
+    pack.discard("b")
+    pack.discard("never-stored")
+    assert bytes(pack.get("a")) == _jpeg(2, 500)
+    assert "b" not in pack and len(pack) == 1
+    assert pack.dead_bytes() > 6000
+
+
+@pytest.mark.parametrize("index_every", [1, 1000])
+def test_reopen_restores_entries(pack_path, index_every):
+    pack = CollagePack(pack_path, index_every=index_every)
+    for i in range(10):
+        pack.put(f"k{i}", _jpeg(i))
+    pack.discard("k3")
+    pack.put("k4", _jpeg(40))
+    pack.close()
+
+    reopened = CollagePack(pack_path)
+    assert len(reopened) == 9 and "k3" not in reopened
+    assert bytes(reopened.get("k4")) == _jpeg(40)
+    assert all(bytes(reopened.get(f"k{i}")) == _jpeg(i) for i in range(10) if i not in (3, 4))
+    assert reopened.dead_bytes() == pack.dead_bytes()
+
+
+def test_unflushed_index_is_rebuilt_by_scan(pack_path):
+    pack = CollagePack(pack_path, index_every=1000)
+    pack.put("a", _jpeg(1))
+    pack.flush()
+    pack.put("b", _jpeg(2))         # индекс на диске знает только про "a"
+    reopened = CollagePack(pack_path)
+    assert bytes(reopened.get("b")) == _jpeg(2)
+
+
+def test_torn_tail_is_truncated(pack_path):
+    pack = CollagePack(pack_path)
+    pack.put("a", _jpeg(1))
+    pack.put("b", _jpeg(2))
+    pack.close()
+    size = os.path.getsize(pack_path)
+    with open(pack_path, "r+b") as f:
+        f.truncate(size - 100)      # процесс упал посреди записи "b"
+
+    reopened = CollagePack(pack_path)
+    assert bytes(reopened.get("a")) == _jpeg(1)
+    assert "b" not in reopened
+    assert reopened.stats()["recovered_bytes"] > 0
+    reopened.put("c", _jpeg(3))
+    reopened.close()
+    assert bytes(CollagePack(pack_path).get("c")) == _jpeg(3)
+
+
+def test_corrupted_index_is_ignored(pack_path):
+    pack = CollagePack(pack_path)
+    pack.put("a", _jpeg(1))
+    pack.close()
+    with open(pack_path + ".idx", "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"\x00")
+    assert bytes(CollagePack(pack_path).get("a")) == _jpeg(1)
+
+
+def test_garbage_file_starts_empty(pack_path):
+    with open(pack_path, "wb") as f:
+        f.write(b"not a pack")
+    pack = CollagePack(pack_path)
+    assert len(pack) == 0
+    pack.put("a", _jpeg(1))
+    assert bytes(pack.get("a")) == _jpeg(1)
+
+
+def test_compact_drops_dead_records_and_keeps_old_views(pack_path):
+    pack = CollagePack(pack_path)
+    for i in range(6):
+        pack.put(f"k{i}", _jpeg(i))
+    pack.put("k0", _jpeg(10))
+    old_view = pack.get("k1")
+    size_before = pack.stats()["bytes"]
+
+    pack.compact(keep=lambda key: key != "k5")
+    assert pack.dead_bytes() == 0
+    assert pack.stats()["bytes"] < size_before
+    assert sorted(k for k in (f"k{i}" for i in range(6)) if k in pack) == ["k0", "k1", "k2", "k3", "k4"]
+    assert bytes(pack.get("k0")) == _jpeg(10)
+    assert bytes(old_view) == _jpeg(1)
+    assert not os.path.exists(pack_path + ".compact")
+
+    pack.put("new", _jpeg(7))
+    pack.close()
+    reopened = CollagePack(pack_path)
+    assert len(reopened) == 6 and bytes(reopened.get("new")) == _jpeg(7)
+
+
+def test_maybe_compact_thresholds(pack_path):
+    pack = CollagePack(pack_path)
+    pack.put("a", _jpeg(1))
+    pack.put("a", _jpeg(2))
+    assert not pack.maybe_compact(min_dead=10**6, ratio=0.0)
+    assert not pack.maybe_compact(min_dead=0, ratio=0.9)
+    assert pack.maybe_compact(min_dead=0, ratio=0.3)
+    assert pack.stats()["compactions"] == 1
+
+
+def test_import_files_moves_legacy_jpegs(tmp_path, pack_path):
+    (tmp_path / "parus_3.jpg").write_bytes(_jpeg(1))
+    (tmp_path / "already.jpg").write_bytes(_jpeg(2))
+    (tmp_path / "empty.jpg").write_bytes(b"")
+    (tmp_path / "notes.txt").write_text("keep me")
+    pack = CollagePack(pack_path)
+    pack.put("already", _jpeg(9))
+
+    assert pack.import_files(str(tmp_path)) == 1
+    assert bytes(pack.get("parus_3")) == _jpeg(1)
+    assert bytes(pack.get("already")) == _jpeg(9)
+    assert "empty" not in pack
+    assert sorted(os.listdir(tmp_path)) == ["collages-0.pack", "collages-0.pack.idx", "notes.txt"]
+    assert pack.import_files(str(tmp_path)) == 0
+
+
+def test_input_file_streams_chunks(pack_path):
+    pack = CollagePack(pack_path)
+    view = pack.put("a", _jpeg(1, 10000))
+
+    async def collect():
+        return [bytes(chunk) async for chunk in CollageInputFile(view, chunk_size=4096).read(None)]
+
+    chunks = asyncio.run(collect())
+    assert [len(c) for c in chunks] == [4096, 4096, 1808]
+    assert b"".join(chunks) == _jpeg(1, 10000)
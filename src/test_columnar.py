@@ -0,0 +1,111 @@
+# test_columnar.py — разбор /find и OfferColumns.select против перебора
+#
+#   cd src && python -m pytest -q test_columnar.py
+
+import math
+import random
+
+import pytest
+
+from columnar import FIELDS, Condition, FindQuery, OfferColumns, parse_find_query
+from offers import Offer
+
+
+@pytest.mark.parametrize("text, conditions, sort, descending", [
+    ("size=150..300 total<=4000",
+     [Condition("size", 150, 300), Condition("total", hi=4000)], None, False),
+    ("склад height>=8 power>=100 sort=-size",
+     [Condition("type", 1, 1), Condition("height", lo=8), Condition("power", lo=100)], "size", True),
+    ("ppm<20 size>500 sort=total",
+     [Condition("ppm", hi=20, hi_open=True), Condition("size", lo=500, lo_open=True)], "total", False),
+    ("площа=100.. ставка=..12,5 офіс",
+     [Condition("size", lo=100), Condition("ppm", hi=12.5), Condition("type", 0, 0)], None, False),
+    ("size>=150м2 total<=4000$ power>=50квт",
+     [Condition("size", lo=150), Condition("total", hi=4000), Condition("power", lo=50)], None, False),
+    ("", [], None, False),
+])
+def test_parse_find_query(text, conditions, sort, descending):
+    assert parse_find_query(text) == FindQuery(conditions, sort, descending)
+
+
+@pytest.mark.parametrize("text", [
+    "size", "colour>5", "size<=", "size<..5", "size=300..150", "size=..", "sort=colour",
+])
+def test_parse_find_query_errors(text):
+    with pytest.raises(ValueError):
+        parse_find_query(text)
+
+
+def test_condition_bounds():
+    assert Condition("size", 100, 200).test(100) and Condition("size", 100, 200).test(200)
+    assert not Condition("size", lo=100, lo_open=True).test(100)
+    assert not Condition("size", hi=200, hi_open=True).test(200)
+    assert not Condition("height", lo=0).test(math.nan)
+
+
+def _random_offers(n: int, seed: int):
+    rng = random.Random(seed)
+    offers = []
+    for i in range(n):
+        size = float(rng.choice([100, 150, 200, 300, 500, 1000, 2500]) if rng.random() < 0.5
+                     else round(rng.uniform(20, 3000)))
+        ppm = float(rng.choice([10, 12.5, 15, 20, 25]))
+        warehouse = rng.random() < 0.4
+        offers.append(Offer(
+            type='warehouse' if warehouse else 'office', msg_id=i, link=f"https://t.me/c/{i}",
+            price_total=round(size * ppm, 2), price_per_m2=ppm, size=size, bc_name=f"БЦ {i}",
+            height=rng.choice([None, 6.0, 8.0, 12.0]) if warehouse else None,
+            power=rng.choice([None, "50", "100.", "n/a", "250"]) if warehouse else None,
+        ))
+    offers.sort(key=lambda o: o.price_total)        # порядок merge_offers
+    return offers
+
+
+def _random_query(rng: random.Random) -> FindQuery:
+    conditions = []
+    for name in rng.sample(["size", "total", "ppm", "height", "power", "type"], rng.randint(0, 3)):
+        if name == "type":
+            value = float(rng.randint(0, 1))
+            conditions.append(Condition("type", value, value))
+            continue
+        a, b = sorted(rng.uniform(0, 4000 if name != "ppm" else 30) for _ in range(2))
+        if name in ("height", "power"):
+            a, b = sorted(rng.choice([0, 6, 8, 50, 100, 250, 300]) for _ in range(2))
+        conditions.append(rng.choice([
+            Condition(name, a, b),
+            Condition(name, lo=a, lo_open=rng.random() < 0.5),
+            Condition(name, hi=b, hi_open=rng.random() < 0.5),
+        ]))
+    sort = rng.choice([None, "size", "total", "ppm", "height", "power"])
+    return FindQuery(conditions, sort, rng.random() < 0.5)
+
+
+def _brute_force(offers, query: FindQuery, limit: int):
+    found = [o for o in offers if all(c.test(FIELDS[c.field](o)) for c in query.conditions)]
+    if query.sort:
+        get = FIELDS[query.sort]
+        present = [o for o in found if not math.isnan(get(o))]
+        missing = [o for o in found if math.isnan(get(o))]
+        # стабильная сортировка: при равных значениях — порядок строк
+        found = sorted(present, key=get, reverse=query.descending) + missing
+    return len(found), found[:limit]
+
+
+def test_select_matches_brute_force():
+    offers = _random_offers(400, seed=5)
+    columns = OfferColumns(offers)
+    rng = random.Random(9)
+    for _ in range(500):
+        query = _random_query(rng)
+        limit = rng.choice([1, 10, 50, 1000])
+        assert columns.select(query, limit) == _brute_force(offers, query, limit), query
+
+
+def test_select_without_conditions_keeps_row_order():
+    offers = _random_offers(50, seed=1)
+    total, found = OfferColumns(offers).select(FindQuery(), 10)
+    assert total == 50 and found == offers[:10]
+
+
+def test_select_empty_store():
+    assert OfferColumns([]).select(parse_find_query("size>=100 sort=size"), 10) == (0, [])
@@ -0,0 +1,51 @@
+# test_inline_query.py — формы запросов из шапки inline_query.py и id inline-результатов
+#
+#   cd src && python -m pytest -q test_inline_query.py
+
+import pytest
+
+from inline_query import InlineQuery, inline_result_id, parse_inline_query, unique_inline_results
+from offers import Offer
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("офіс 200-500 20$", InlineQuery(type='office', min_size=200, max_size=500, max_ppm=20)),
+    ("офіс 200 - 500 м2 до 20 $", InlineQuery(type='office', min_size=200, max_size=500, max_ppm=20)),
+    ("склад до 20$", InlineQuery(type='warehouse', max_ppm=20)),
+    ("склад 1000+", InlineQuery(type='warehouse', min_size=1000)),
+    ("склад до 800 м2", InlineQuery(type='warehouse', max_size=800)),
+    ("офіс 20-30$", InlineQuery(type='office', min_ppm=20, max_ppm=30)),
+    ("офіс 12,5$", InlineQuery(type='office', max_ppm=12.5)),
+    ("Парус", InlineQuery(name='парус')),
+    ("Парус офіс 100-200", InlineQuery(type='office', min_size=100, max_size=200, name='парус')),
+    ("", InlineQuery()),
+])
+def test_parse_inline_query(text, expected):
+    assert parse_inline_query(text) == expected
+
+
+def _floor_offer(floor: str, size: float, price_total: float, msg_id: int = 501) -> Offer:
+    return Offer(type='office', msg_id=msg_id, link=f"https://t.me/offices/{msg_id}",
+                 price_total=price_total, price_per_m2=round(price_total / size, 2), size=size,
+                 bc_name="Парус", floor=floor, channel="@offices")
+
+
+def test_two_floor_post_gives_distinct_result_ids():
+    # один пост — два этажа: iter_offices отдаёт два оффера с одним msg_id
+    post = [_floor_offer("3 поверх", 150, 3000), _floor_offer("7 поверх", 320, 6400)]
+    results = unique_inline_results(post, lambda o: o.channel)
+    ids = [result_id for result_id, _ in results]
+    assert len(ids) == 2 and len(set(ids)) == 2
+    assert all(len(result_id.encode()) <= 64 for result_id in ids)
+    assert all(result_id.startswith("offices_501_") for result_id in ids)
+
+
+def test_identical_offers_of_one_post_collapse():
+    post = [_floor_offer("3 поверх", 150, 3000), _floor_offer("3 поверх", 150, 3000)]
+    assert len(unique_inline_results(post, lambda o: o.channel)) == 1
+
+
+def test_result_id_is_stable_and_per_channel():
+    offer = _floor_offer("3 поверх", 150, 3000)
+    assert inline_result_id("@offices", offer) == inline_result_id("@offices", offer)
+    assert inline_result_id("@offices", offer) != inline_result_id("@offices_2", offer)
@@ -0,0 +1,67 @@
+# test_offers.py — запись Offer: строка снапшота и ленивая подпись
+#
+#   cd src && python -m pytest -q test_offers.py
+
+import pytest
+
+from offers import ROW_FIELDS, Offer
+
+
+def _office(**overrides) -> Offer:
+    values = dict(type='office', msg_id=10, link="https://t.me/offices/10", price_total=3000.0,
+                  price_per_m2=20.0, size=150.0, bc_name="Парус", floor="3 поверх", bc_class="A",
+                  price_formula="20$ + ОПЕКС", metro="Палац Спорту", channel="@offices")
+    values.update(overrides)
+    return Offer(**values)
+
+
+def test_offer_has_no_instance_dict():
+    with pytest.raises(AttributeError):
+        _office().__dict__
+
+
+def test_row_round_trip_skips_caption_cache():
+    offer = _office()
+    offer.caption()
+    row = offer.to_row()
+    assert len(row) == len(ROW_FIELDS)
+    assert not any(name.startswith('_') for name in ROW_FIELDS)
+    restored = Offer.from_row(row)
+    assert restored.to_row() == row
+    assert restored.caption() == offer.caption()
+
+
+def test_row_without_channel_from_old_snapshot():
+    row = _office().to_row()[:-1]
+    assert Offer.from_row(row).channel == ''
+
+
+def test_office_caption():
+    assert _office().caption() == (
+        "<b>Парус</b>\n"
+        "Клас A\n"
+        "ЦІНА: 20$ + ОПЕКС\n"
+        "3 поверх, 150м²\n"
+        "💵 3,000$ (20.0$/м²)\n"
+        "Ⓜ️Палац Спорту"
+    )
+
+
+def test_warehouse_caption_skips_empty_fields():
+    offer = Offer(type='warehouse', msg_id=11, link="https://t.me/sklad/11", price_total=5000.0,
+                  price_per_m2=5.0, size=1000.0, bc_name="Склад", desc="Склад", height=8.5)
+    assert offer.caption() == (
+        "<b>Склад</b>\n"
+        "📏 Висота стелі: 8.5 м\n"
+        "Склад, 1000м²\n"
+        "💵 5,000$ (5.0$/м²)"
+    )
+
+
+def test_caption_is_memoised_until_version_changes():
+    offer = _office()
+    first = offer.caption()
+    offer.size = 200.0
+    assert offer.caption() is first
+    offer.version += 1
+    assert "200м²" in offer.caption()
@@ -0,0 +1,114 @@
+# test_outbound.py — token bucket'ы OutboundScheduler и реакция на RetryAfter
+#
+#   cd src && python -m pytest -q test_outbound.py
+
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from outbound import OutboundScheduler, TokenBucket
+
+
+def _retry_after(chat_id, seconds: int = 0) -> TelegramRetryAfter:
+    return TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text="x"),
+                              message="Too Many Requests", retry_after=seconds)
+
+
+def _drain(scheduler: OutboundScheduler, chat_id, n: int):
+    async def run():
+        for _ in range(n):
+            await scheduler.acquire(chat_id)
+    asyncio.run(run())
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2.0, capacity=3.0)
+    now = time.monotonic()
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0
+        bucket.consume()
+    assert bucket.wait_time(now) == pytest.approx(0.5, abs=0.01)
+    assert bucket.wait_time(now + 0.5) == pytest.approx(0.0, abs=0.01)
+
+
+def test_token_bucket_block_overrides_tokens():
+    bucket = TokenBucket(rate=100.0, capacity=100.0)
+    now = time.monotonic()
+    bucket.block(5, now)
+    assert bucket.wait_time(now + 1) == pytest.approx(4.0, abs=0.01)
+    assert not bucket.is_idle(now + 1)
+    assert bucket.is_idle(now + 10)
+
+
+def test_private_and_group_chats_get_different_bursts():
+    scheduler = OutboundScheduler(chat_burst=8, group_burst=3)
+    started = time.monotonic()
+    _drain(scheduler, 42, 8)
+    _drain(scheduler, -100500, 3)
+    assert time.monotonic() - started < 0.5
+    now = time.monotonic()
+    assert scheduler._chat_bucket(42).wait_time(now) > 0.5
+    assert scheduler._chat_bucket(-100500).wait_time(now) > 2.0
+
+
+def test_retry_after_in_busy_chat_blocks_only_that_chat():
+    scheduler = OutboundScheduler()
+    _drain(scheduler, 42, 8)
+    scheduler.on_retry_after(42, 5)
+    now = time.monotonic()
+    assert scheduler._chat_bucket(42).wait_time(now) > 4
+    assert scheduler._chat_bucket(7).wait_time(now) == 0
+    assert scheduler.stats()["global_blocks"] == 0
+
+
+def test_retry_after_in_quiet_chat_blocks_the_bot():
+    scheduler = OutboundScheduler()
+    scheduler.on_retry_after(42, 5)
+    assert scheduler.stats()["global_blocks"] == 1
+    assert scheduler._global.wait_time(time.monotonic()) > 4
+
+
+def test_retry_after_in_two_chats_blocks_the_bot():
+    scheduler = OutboundScheduler()
+    _drain(scheduler, 1, 8)
+    _drain(scheduler, 2, 8)
+    scheduler.on_retry_after(1, 5)
+    assert scheduler.stats()["global_blocks"] == 0
+    scheduler.on_retry_after(2, 5)
+    assert scheduler.stats()["global_blocks"] == 1
+
+
+def test_retry_after_without_chat_blocks_the_bot():
+    scheduler = OutboundScheduler()
+    scheduler.on_retry_after(None, 3)
+    assert scheduler.stats()["global_blocks"] == 1
+
+
+def test_call_retries_after_retry_after():
+    scheduler = OutboundScheduler(chat_rate=50)
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise _retry_after(42)
+        return "ok"
+
+    assert asyncio.run(scheduler.call(42, send)) == "ok"
+    stats = scheduler.stats()
+    assert (stats["sent"], stats["retries"], len(attempts)) == (1, 1, 2)
+
+
+def test_call_gives_up_after_max_retries():
+    scheduler = OutboundScheduler(chat_rate=50, max_retries=2)
+
+    async def send():
+        raise _retry_after(42)
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(scheduler.call(42, send))
+    assert scheduler.stats()["retries"] == 3
+    assert scheduler.stats()["sent"] == 0
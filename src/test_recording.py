@@ -0,0 +1,115 @@
+# test_recording.py — запись трафика: вычистка PII из апдейтов, entities, чтение файла
+#
+#   cd src && python -m pytest -q test_recording.py
+
+import json
+import time
+from types import SimpleNamespace
+
+from aiogram import types
+from telethon.tl.types import MessageEntityBold, MessageEntityTextUrl, MessageEntityUrl
+
+from recording import Anonymizer, TrafficRecorder, decode_entities, encode_entities, load_recording
+
+PRIVATE_UPDATE = {
+    "update_id": 5,
+    "message": {
+        "message_id": 77,
+        "date": 1700000000,
+        "text": "/start",
+        "chat": {"id": 4242, "type": "private", "first_name": "Ivan", "username": "ivan"},
+        "from": {"id": 4242, "is_bot": False, "first_name": "Ivan", "last_name": "Petrenko", "username": "ivan"},
+        "forward_origin": {"type": "user", "date": 1,
+                           "sender_user": {"id": 999, "is_bot": False, "first_name": "Olga", "username": "olga"}},
+        "contact": {"phone_number": "+380671234567", "first_name": "Petro", "user_id": 31337,
+                    "vcard": "BEGIN:VCARD"},
+        "users_shared": {"request_id": 1, "users": [{"user_id": 555, "first_name": "Zoryana", "username": "zz"}]},
+        "reply_to_message": {"message_id": 3, "date": 1,
+                             "chat": {"id": -100123, "type": "supergroup", "title": "Secret chat"}},
+    },
+}
+
+LEAKS = ["Ivan", "ivan", "Petrenko", "Olga", "olga", "380671234567", "Petro", "VCARD", "Zoryana",
+         "Secret chat"]
+
+
+def test_scrub_removes_names_phones_and_titles():
+    dumped = json.dumps(Anonymizer("salt").scrub(PRIVATE_UPDATE), ensure_ascii=False)
+    for leak in LEAKS:
+        assert leak not in dumped, leak
+
+
+def test_scrub_replaces_user_and_chat_ids():
+    message = Anonymizer("salt").scrub(PRIVATE_UPDATE)["message"]
+    ids = [message["chat"]["id"], message["from"]["id"], message["forward_origin"]["sender_user"]["id"],
+           message["contact"]["user_id"], message["users_shared"]["users"][0]["user_id"],
+           message["reply_to_message"]["chat"]["id"]]
+    assert not {4242, 999, 31337, 555, -100123} & set(ids)
+    assert message["chat"]["id"] == message["from"]["id"]          # один человек — один псевдоним
+    assert message["reply_to_message"]["chat"]["id"] < 0            # группа остаётся группой
+
+
+def test_scrub_keeps_opaque_ids_and_input_untouched():
+    before = json.dumps(PRIVATE_UPDATE)
+    scrubbed = Anonymizer("salt").scrub(PRIVATE_UPDATE)
+    assert json.dumps(PRIVATE_UPDATE) == before
+    assert scrubbed["update_id"] == 5
+    assert scrubbed["message"]["message_id"] == 77
+    assert scrubbed["message"]["users_shared"]["request_id"] == 1
+    assert scrubbed["message"]["text"] == "/start"
+
+
+def test_scrubbed_update_is_still_valid_for_aiogram():
+    update = types.Update.model_validate(Anonymizer("salt").scrub(PRIVATE_UPDATE))
+    assert update.message.from_user.first_name == "user"
+    assert update.message.contact.phone_number == "+380000000000"
+
+
+def test_pseudonyms_depend_on_salt():
+    assert Anonymizer("a").pseudonym(4242) == Anonymizer("a").pseudonym(4242)
+    assert Anonymizer("a").pseudonym(4242) != Anonymizer("b").pseudonym(4242)
+    assert Anonymizer("a").pseudonym_text("-8123") == Anonymizer("a").pseudonym_text("-8123")
+    callback = {"callback_query": {"id": "q", "chat_instance": "-8123", "data": "calc_1",
+                                   "from": {"id": 1, "is_bot": False, "first_name": "A"}}}
+    scrubbed = Anonymizer("a").scrub(callback)["callback_query"]
+    assert scrubbed["chat_instance"] != "-8123" and scrubbed["data"] == "calc_1"
+
+
+def test_entities_round_trip():
+    entities = [MessageEntityBold(0, 5), MessageEntityTextUrl(6, 4, "https://example.com"), MessageEntityUrl(11, 19)]
+    rows = encode_entities(entities)
+    assert json.loads(json.dumps(rows)) == rows
+    assert decode_entities(rows) == entities
+    assert decode_entities([["NoSuchEntity", 0, 1, None]]) == []
+    assert encode_entities(None) == []
+
+
+def test_recorder_writes_readable_file(tmp_path):
+    path = str(tmp_path / "traffic.jsonl.gz")
+    recorder = TrafficRecorder(path, {"@offices": "office"}, salt="salt")
+    recorder.update(types.Update.model_validate(PRIVATE_UPDATE))
+    post = SimpleNamespace(id=10, message="Бізнес-центр Парус", entities=[MessageEntityBold(0, 5)],
+                           grouped_id=777, photo=SimpleNamespace(dc_id=2))
+    recorder.channel_message("@offices", post)
+    recorder.channel_message("@offices", post)         # та же версия текста — не пишется
+    assert recorder.stats()["messages"] == 1
+
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            channels, updates, messages = load_recording(path)
+        except (OSError, EOFError):
+            channels, updates, messages = {}, [], {}
+        if updates and messages:
+            break
+        assert time.monotonic() < deadline, "recording was not written"
+        time.sleep(0.05)
+
+    assert channels == {"@offices": "office"}
+    assert len(updates) == 1
+    dumped = json.dumps(updates[0], ensure_ascii=False)
+    for leak in LEAKS:
+        assert leak not in dumped, leak
+    record = messages["@offices"][10]
+    assert (record["text"], record["grouped_id"], record["photo_dc"]) == ("Бізнес-центр Парус", 777, 2)
+    assert decode_entities(record["entities"]) == [MessageEntityBold(0, 5)]
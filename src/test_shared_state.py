@@ -0,0 +1,155 @@
+# test_shared_state.py — бэкенды общего состояния: реплики SharedDict, rev и tombstone'ы,
+# lease'ы, очередь апдейтов. Два SQLiteBackend на одном файле — это два воркера.
+#
+#   cd src && python -m pytest -q test_shared_state.py
+
+import asyncio
+import pickle
+import sqlite3
+import time
+
+import pytest
+
+from shared_state import MemoryBackend, SQLiteBackend, make_backend
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(SQLiteBackend, "POLL_INTERVAL", 0.02)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, db_path):
+    return MemoryBackend() if request.param == "memory" else SQLiteBackend(db_path)
+
+
+def _eventually(check, timeout: float = 3.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, "replica did not converge"
+        time.sleep(0.02)
+
+
+def test_make_backend_urls(tmp_path):
+    assert isinstance(make_backend(None), MemoryBackend)
+    assert isinstance(make_backend("memory"), MemoryBackend)
+    sqlite_backend = make_backend(f"sqlite:///{tmp_path}/state.db")
+    assert isinstance(sqlite_backend, SQLiteBackend)
+    assert sqlite_backend.path == f"{tmp_path}/state.db"
+    with pytest.raises(ValueError):
+        make_backend("redis://localhost")
+
+
+def test_mapping_is_dict_like(backend):
+    sessions = backend.mapping("sessions")
+    sessions[1] = {"page": 2}
+    sessions[(2, "x")] = [1, 2]
+    del sessions[1]
+    assert dict(sessions) == {(2, "x"): [1, 2]}
+    assert backend.mapping("sessions") is sessions
+    assert len(backend.mapping("other")) == 0
+    assert backend.flush()
+
+
+def test_leases(backend):
+    assert backend.acquire_lease("poller", "w1", ttl=30)
+    assert not backend.acquire_lease("poller", "w2", ttl=30)
+    assert backend.acquire_lease("poller", "w1", ttl=30)        # продление
+    backend.release_lease("poller", "w2")                       # чужой lease не снимается
+    assert not backend.acquire_lease("poller", "w2", ttl=30)
+    backend.release_lease("poller", "w1")
+    assert backend.acquire_lease("poller", "w2", ttl=30)
+
+
+def test_expired_lease_can_be_taken(backend):
+    assert backend.acquire_lease("channel-sync", "w1", ttl=0.01)
+    time.sleep(0.05)
+    assert backend.acquire_lease("channel-sync", "w2", ttl=30)
+
+
+def test_update_queue_is_fifo_per_shard(backend):
+    for i in range(3):
+        backend.push_update(0, f"u{i}")
+    backend.push_update(1, "other")
+    assert backend.pop_updates(0, limit=2) == ["u0", "u1"]
+    assert backend.pop_updates(0) == ["u2"]
+    assert backend.pop_updates(0) == []
+    assert backend.pop_updates(1) == ["other"]
+
+
+def test_async_ops(backend):
+    async def run():
+        assert await backend.acquire_lease_async("poller", "w1", 30)
+        await backend.push_update_async(3, "payload")
+        batch = await backend.pop_updates_async(3)
+        await backend.release_lease_async("poller", "w1")
+        return batch
+
+    assert asyncio.run(run()) == ["payload"]
+    assert backend.acquire_lease("poller", "w2", ttl=30)
+
+
+def test_write_reaches_other_worker(db_path):
+    first, second = SQLiteBackend(db_path), SQLiteBackend(db_path)
+    a, b = first.mapping("calc"), second.mapping("calc")
+    a["offer"] = {"size": 120}
+    assert first.flush()
+    _eventually(lambda: b.get("offer") == {"size": 120})
+
+
+def test_delete_propagates_as_tombstone(db_path):
+    first, second = SQLiteBackend(db_path), SQLiteBackend(db_path)
+    a, b = first.mapping("calc"), second.mapping("calc")
+    a["offer"] = 1
+    a["kept"] = 2
+    assert first.flush()
+    _eventually(lambda: "offer" in b)
+    del a["offer"]
+    assert first.flush()
+    _eventually(lambda: "offer" not in b)
+    assert dict(b) == {"kept": 2}
+
+    with sqlite3.connect(db_path) as conn:
+        rows = {pickle.loads(key): value for key, value in conn.execute("SELECT key, value FROM kv")}
+    assert rows["offer"] is None
+    # новый воркер tombstone не загружает
+    assert dict(SQLiteBackend(db_path).mapping("calc")) == {"kept": 2}
+
+
+def test_replicas_converge_on_last_write(db_path):
+    first, second = SQLiteBackend(db_path), SQLiteBackend(db_path)
+    a, b = first.mapping("sessions"), second.mapping("sessions")
+    b["user"] = "remote"
+    assert second.flush()
+    a["user"] = "local"
+    assert first.flush()
+    _eventually(lambda: b["user"] == "local")
+    time.sleep(0.1)
+    assert a["user"] == "local"
+
+
+def test_namespaces_are_isolated(db_path):
+    first, second = SQLiteBackend(db_path), SQLiteBackend(db_path)
+    first.mapping("calc")["k"] = "calc"
+    first.mapping("sessions")["k"] = "sessions"
+    assert first.flush()
+    calc = second.mapping("calc")
+    assert calc["k"] == "calc"
+    assert second.mapping("sessions")["k"] == "sessions"
+
+
+def test_old_schema_is_migrated(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE kv (ns TEXT NOT NULL, key BLOB NOT NULL, value BLOB, PRIMARY KEY (ns, key))")
+        conn.execute("INSERT INTO kv VALUES (?, ?, ?)", ("calc", pickle.dumps("offer"), pickle.dumps(42)))
+    backend = SQLiteBackend(db_path)
+    calc = backend.mapping("calc")
+    assert calc["offer"] == 42
+    calc["offer"] = 43
+    assert backend.flush()
+    assert SQLiteBackend(db_path).mapping("calc")["offer"] == 43
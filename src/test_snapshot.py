@@ -0,0 +1,112 @@
+# test_snapshot.py — снапшот индекса: round-trip секций, ленивое чтение, битые файлы
+#
+#   cd src && python -m pytest -q test_snapshot.py
+
+import os
+import struct
+import sys
+
+import pytest
+
+from offers import Offer
+from snapshot import MAGIC, Snapshot, load_snapshot, write_snapshot
+
+
+def _offers():
+    return [
+        Offer(type='office', msg_id=10, link="https://t.me/offices/10", price_total=3000.0,
+              price_per_m2=20.0, size=150.0, bc_name="Парус", floor="3 поверх", bc_class="A",
+              metro="Палац Спорту", version=2, channel="@offices"),
+        Offer(type='warehouse', msg_id=11, link="https://t.me/sklad/11", price_total=5000.0,
+              price_per_m2=5.0, size=1000.0, bc_name="Склад на Оболоні", desc="Склад",
+              addr="вул. Електриків, 1", shore="Правий", w_class="B", height=8.5, channel="@sklad"),
+    ]
+
+
+def _sections():
+    return {
+        "offer_rows": {"@offices": (1700000000.0, [o.to_row() for o in _offers()])},
+        "albums": [("@offices", 777, [10, 12, 13])],
+        "file_ids": {"parus_3": "AgACAgIAAxk"},
+        "meta": {"created": 1700000000.0, "worker": "w0"},
+    }
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_snapshot(path, _sections())
+    snap = load_snapshot(path)
+    try:
+        for name, value in _sections().items():
+            assert name in snap
+            assert snap.section(name) == value
+        ts, rows = snap.section("offer_rows")["@offices"]
+        restored = [Offer.from_row(tuple(row)) for row in rows]
+        assert [o.caption() for o in restored] == [o.caption() for o in _offers()]
+        assert [o.to_row() for o in restored] == [o.to_row() for o in _offers()]
+    finally:
+        snap.close()
+    assert os.listdir(tmp_path) == ["index.bin"]
+
+
+def test_missing_section_returns_default(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_snapshot(path, {"meta": {}})
+    snap = Snapshot(path)
+    assert "albums" not in snap
+    assert snap.section("albums", []) == []
+    snap.close()
+
+
+def test_section_is_decoded_once(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_snapshot(path, _sections())
+    snap = Snapshot(path)
+    assert snap.section("file_ids") is snap.section("file_ids")
+    snap.close()
+
+
+def test_rewrite_replaces_file(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_snapshot(path, {"meta": {"v": 1}})
+    write_snapshot(path, {"meta": {"v": 2}})
+    snap = Snapshot(path)
+    assert snap.section("meta") == {"v": 2}
+    snap.close()
+
+
+def test_long_section_name_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        write_snapshot(str(tmp_path / "index.bin"), {"x" * 17: 1})
+
+
+def test_corrupted_section_detected(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_snapshot(path, {"file_ids": {"slug": "file-id"}})
+    with open(path, "r+b") as f:
+        f.seek(-3, os.SEEK_END)
+        f.write(b"\xff")
+    snap = Snapshot(path)
+    with pytest.raises(ValueError):
+        snap.section("file_ids")
+    snap.close()
+
+
+def test_load_snapshot_ignores_bad_files(tmp_path):
+    assert load_snapshot(str(tmp_path / "missing.bin")) is None
+
+    garbage = tmp_path / "garbage.bin"
+    garbage.write_bytes(b"not a snapshot at all")
+    assert load_snapshot(str(garbage)) is None
+
+    truncated = tmp_path / "truncated.bin"
+    write_snapshot(str(truncated), _sections())
+    truncated.write_bytes(truncated.read_bytes()[:100])
+    assert load_snapshot(str(truncated)) is None
+
+    other_python = tmp_path / "other_python.bin"
+    write_snapshot(str(other_python), _sections())
+    data = bytearray(other_python.read_bytes())
+    struct.pack_into("<8sBB", data, 0, MAGIC, sys.version_info[0], sys.version_info[1] + 1)
+    other_python.write_bytes(bytes(data))
+    assert load_snapshot(str(other_python)) is None
@@ -0,0 +1,130 @@
+# test_subscriptions.py — подписки, дерево интервалов и SubscriptionIndex против перебора
+#
+#   cd src && python -m pytest -q test_subscriptions.py
+
+import math
+import random
+
+import pytest
+
+from offers import Offer
+from subscriptions import IntervalTree, Subscription, SubscriptionIndex
+
+
+def _office(size: float, ppm: float) -> Offer:
+    return Offer(type='office', msg_id=1, link="https://t.me/offices/1", price_total=size * ppm,
+                 price_per_m2=ppm, size=size, bc_name="Парус", floor="3 поверх")
+
+
+def _warehouse(size: float, shore=None) -> Offer:
+    return Offer(type='warehouse', msg_id=2, link="https://t.me/sklad/2", price_total=size * 5,
+                 price_per_m2=5.0, size=size, bc_name="Склад", desc="Склад", shore=shore)
+
+
+def test_interval_tree_stab_matches_brute_force():
+    rng = random.Random(7)
+    intervals = []
+    for i in range(300):
+        lo = rng.choice([0.0, rng.uniform(0, 2000)])
+        hi = rng.choice([math.inf, lo + rng.uniform(0, 1500)])
+        intervals.append((lo, hi, i))
+    tree = IntervalTree.build(intervals)
+    points = [rng.uniform(0, 4000) for _ in range(200)] + [lo for lo, _, _ in intervals[:50]]
+    for x in points:
+        expected = {i for lo, hi, i in intervals if lo <= x <= hi}
+        found = list(tree.stab(x))
+        assert len(found) == len(set(found))
+        assert set(found) == expected
+
+
+def test_interval_tree_closed_bounds():
+    tree = IntervalTree.build([(100.0, 200.0, "a"), (200.0, 300.0, "b")])
+    assert set(tree.stab(200.0)) == {"a", "b"}
+    assert set(tree.stab(100.0)) == {"a"}
+    assert set(tree.stab(300.0)) == {"b"}
+    assert set(tree.stab(99.9)) == set()
+
+
+def test_interval_tree_build_empty():
+    assert IntervalTree.build([]) is None
+    assert IntervalTree.build([(500.0, 300.0, "inverted")]) is None
+
+
+def test_interval_tree_ignores_inverted_intervals():
+    tree = IntervalTree.build([(500.0, 300.0, "inverted"), (500.0, 300.0, "again"), (0.0, 1000.0, "ok")])
+    assert list(tree.stab(400.0)) == ["ok"]
+
+
+def test_office_subscription_bounds():
+    sub = Subscription.for_offices(100, None, None, 20)
+    assert sub == Subscription('office', 100.0, math.inf, 0.0, 20.0)
+    assert sub.matches(_office(150, 20))
+    assert not sub.matches(_office(150, 21))
+    assert not sub.matches(_office(99, 10))
+    assert not sub.matches(_warehouse(150))
+    assert sub.describe() == "Офіс, від 100 м², до 20$/м²"
+
+
+@pytest.mark.parametrize("size_choice, size, expected", [
+    ("<=1000", 1000, True),
+    ("<=1000", 1001, False),
+    (">1000", 1000, True),
+    (">1000", 999, False),
+    (None, 50000, True),
+])
+def test_warehouse_subscription_size_choice(size_choice, size, expected):
+    assert Subscription.for_warehouses(None, size_choice).matches(_warehouse(size)) is expected
+
+
+def test_warehouse_subscription_shore():
+    sub = Subscription.for_warehouses("Лівий", None)
+    assert sub.matches(_warehouse(500, "Лівий"))
+    assert not sub.matches(_warehouse(500, "Правий"))
+    assert not sub.matches(_warehouse(500, None))
+
+
+def test_index_groups_identical_filters():
+    index = SubscriptionIndex()
+    sub = Subscription.for_offices(100, 200, None, None)
+    index.add(1, sub)
+    index.add(2, Subscription.for_offices(100, 200, None, None))
+    index.add(3, Subscription.for_offices(300, None, None, None))
+    assert (index.groups(), len(index)) == (2, 3)
+    assert index.match(_office(150, 20)) == {1, 2}
+    assert index.match(_office(400, 20)) == {3}
+    assert index.match(_warehouse(150)) == set()
+
+
+def test_index_discard_rebuilds_tree():
+    index = SubscriptionIndex()
+    sub = Subscription.for_offices(100, 200, None, None)
+    index.add(1, sub)
+    index.add(2, sub)
+    index.discard(1, sub)
+    assert index.match(_office(150, 20)) == {2}
+    index.discard(2, sub)
+    index.discard(2, sub)
+    assert index.groups() == 0
+    assert index.match(_office(150, 20)) == set()
+    index.add(5, sub)
+    assert index.match(_office(150, 20)) == {5}
+
+
+def test_index_matches_brute_force():
+    rng = random.Random(11)
+    index = SubscriptionIndex()
+    subs = []
+    for user_id in range(500):
+        if rng.random() < 0.6:
+            lo = rng.choice([None, 50, 100, 200, 500])
+            hi = rng.choice([None, 300, 800, 2000])
+            sub = Subscription.for_offices(lo, hi, rng.choice([None, 10, 15]), rng.choice([None, 20, 30]))
+        else:
+            sub = Subscription.for_warehouses(rng.choice([None, "Лівий", "Правий"]),
+                                              rng.choice([None, "<=1000", ">1000"]))
+        subs.append((user_id, sub))
+        index.add(user_id, sub)
+    offers = [_office(rng.uniform(20, 3000), rng.uniform(5, 40)) for _ in range(100)]
+    offers += [_warehouse(rng.uniform(100, 5000), rng.choice([None, "Лівий", "Правий"])) for _ in range(100)]
+    for offer in offers:
+        assert index.match(offer) == {user_id for user_id, sub in subs if sub.matches(offer)}
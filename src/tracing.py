@@ -0,0 +1,237 @@
+# tracing.py — трассировка апдейтов: вложенные span'ы и экспорт в JSONL (OTLP/JSON)
+#
+#   with tracer.trace("update", update_id=1):      # корень, обычно в middleware
+#       with span("telethon.history", channel=...) as s:
+#           ...
+#           s.set("messages", 120)
+#
+# Текущий span живёт в contextvar, поэтому дочерние задачи (gather) и
+# asyncio.to_thread наследуют его автоматически. Вне трассы span() — no-op.
+#
+# Head sampling: трасса помечается sampled при старте с вероятностью sample_rate,
+# но span'ы пишутся всегда, и при завершении медленные (>= slow_threshold) или
+# упавшие трассы экспортируются независимо от решения сэмплера.
+# Каждая строка файла — один ExportTraceServiceRequest в JSON-кодировке OTLP.
+# Файл больше max_bytes переименовывается в path + ".1" (старый .1 удаляется).
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+_KIND_INTERNAL = 1
+_KIND_SERVER = 2
+_KIND_CLIENT = 3
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, sampled: bool):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: Trace, name: str, parent_id: str, kind: int, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class _NoopSpan:
+    trace = None
+    span_id = ""
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+_NOOP = _NoopSpan()
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    active = _current.get()
+    return active.trace.trace_id if active else None
+
+
+class TraceIdLogFilter(logging.Filter):
+    """
+    Фильтр handler'а логов: record.trace — " [trace <id>]" внутри трассы, иначе "".
+    По id запись лога находится в файле трасс.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace_id = current_trace_id()
+        record.trace = f" [trace {trace_id}]" if trace_id else ""
+        return True
+
+
+@contextmanager
+def span(name: str, kind: int = _KIND_INTERNAL, **attributes) -> Iterator[Any]:
+    parent = _current.get()
+    if parent is None:
+        yield _NOOP
+        return
+    child = Span(parent.trace, name, parent.span_id, kind, attributes)
+    parent.trace.spans.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+def client_span(name: str, **attributes):
+    """Span внешнего вызова (Bot API, MTProto, Drive)."""
+    return span(name, kind=_KIND_CLIENT, **attributes)
+
+
+def _attr_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(s: Span) -> Dict[str, Any]:
+    out = {
+        "traceId": s.trace.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": s.kind,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns or time.time_ns()),
+        "attributes": [{"key": k, "value": _attr_value(v)} for k, v in s.attributes.items()],
+        "status": {"code": _STATUS_ERROR, "message": s.error} if s.error else {"code": _STATUS_OK},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    return out
+
+
+class Tracer:
+    """
+    Корневые трассы и экспорт. Запись в файл — в отдельном потоке,
+    event loop только кладёт готовую строку в очередь.
+    """
+
+    def __init__(self, path: Optional[str], service: str, sample_rate: float = 0.05,
+                 slow_threshold: float = 3.0, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.service = service
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Any]:
+        if not self.enabled or _current.get() is not None:
+            with span(name, **attributes) as nested:
+                yield nested
+            return
+        trace = Trace(sampled=random.random() < self.sample_rate)
+        root = Span(trace, name, "", _KIND_SERVER, attributes)
+        trace.spans.append(root)
+        token = _current.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = repr(e)
+            raise
+        finally:
+            root.end_ns = time.time_ns()
+            _current.reset(token)
+            self._finish(trace, root)
+
+    def _finish(self, trace: Trace, root: Span):
+        slow = root.duration >= self.slow_threshold
+        failed = any(s.error for s in trace.spans)
+        if not (trace.sampled or slow or failed):
+            self.dropped += 1
+            return
+        root.set("trace.slow", slow)
+        root.set("trace.sampled", trace.sampled)
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [_otlp_span(s) for s in trace.spans],
+                }],
+            }]
+        }
+        self._queue.put(json.dumps(request, ensure_ascii=False))
+        self.exported += 1
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            lines = [self._queue.get()]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            data = "\n".join(lines) + "\n"
+            try:
+                self._rotate(len(data.encode("utf-8")))
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(data)
+            except Exception:
+                logger.exception(f"Failed to write traces to {self.path}")
+
+    def _rotate(self, incoming: int):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size and size + incoming > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"exported": self.exported, "dropped": self.dropped, "sample_rate": self.sample_rate}